@@ -9,6 +9,8 @@ Written by Irmen de Jong (irmen@razorvine.net) - License: GNU LGPL 3.
 """
 
 import time
+import math
+import array
 import collections
 import itertools
 import tkinter as tk
@@ -22,7 +24,6 @@ from synthplayer.synth import major_chord_keys
 from synthplayer.sample import Sample
 from synthplayer.playback import Output
 from synthplayer.oscillators import Oscillator
-from synthplayer import params
 import synthplayer
 try:
     import matplotlib
@@ -33,7 +34,10 @@ except ImportError:
     matplotlib = Figure = None
 
 
-params.norm_frames_per_chunk = params.norm_osc_blocksize
+# the voices that are played live are rendered in small blocks, for low latency,
+# the samples that are rendered in advance use large blocks, for throughput.
+live_blocksize = 512
+render_blocksize = 8192
 
 
 class StreamingOscSample(Sample):
@@ -41,7 +45,7 @@ class StreamingOscSample(Sample):
         super().__init__()
         self.mono()
         self.samplerate = samplerate
-        self.blocks = oscillator.blocks()
+        self.oscillator = oscillator
         self.max_play_duration = duration or 1000000
 
     @property
@@ -56,18 +60,16 @@ class StreamingOscSample(Sample):
 
     def chunked_frame_data(self, chunksize, repeat=False, stopcondition=lambda: False):
         num_frames = chunksize // self.samplewidth // self.nchannels
-        if num_frames != params.norm_osc_blocksize:
-            raise ValueError("streaming osc num_frames must be equal to the oscillator blocksize")
+        self.oscillator.blocksize = num_frames
+        buffer = array.array('d', bytes(8 * num_frames))
         played_duration = 0.0
         scale = 2 ** (8 * self.samplewidth - 1)
         while played_duration < self.max_play_duration:
-            try:
-                frames = [int(v * scale) for v in next(self.blocks)]
-            except StopIteration:
+            count = self.oscillator.render_into(buffer)
+            if count == 0:
                 break
-            else:
-                sample = Sample.from_array(frames, self.samplerate, 1)
-                yield sample.view_frame_data()
+            sample = Sample.from_osc_block(memoryview(buffer)[:count], self.samplerate, scale)
+            yield sample.view_frame_data()
             played_duration += num_frames / self.samplerate
 
 
@@ -647,7 +649,7 @@ class SynthGUI(tk.Frame):
         self.synth = WaveSynth(samplewidth=2, samplerate=samplerate)
         if self.output is not None:
             self.output.close()
-        self.output = Output(self.synth.samplerate, self.synth.samplewidth, 1, mixing="mix")
+        self.output = Output(self.synth.samplerate, self.synth.samplewidth, 1, frames_per_chunk=live_blocksize, mixing="mix")
 
     def add_osc_to_gui(self):
         osc_nr = len(self.oscillators)
@@ -783,8 +785,8 @@ class SynthGUI(tk.Frame):
         if not matplotlib:
             self.statusbar["text"] = "Cannot plot! To plot things, you need to have matplotlib installed!"
             return
-        o = self.create_osc(None, None, osc.input_freq.get(), osc, all_oscillators=self.oscillators).blocks()
-        blocks = list(itertools.islice(o, self.synth.samplerate//params.norm_osc_blocksize))
+        o = self.create_osc(None, None, osc.input_freq.get(), osc, all_oscillators=self.oscillators)
+        blocks = list(itertools.islice(o.blocks(), self.synth.samplerate//o.blocksize))
         # integrating matplotlib in tikinter, see http://matplotlib.org/examples/user_interfaces/embedding_in_tk2.html
         fig = Figure(figsize=(8, 2), dpi=100)
         axis = fig.add_subplot(111)
@@ -799,10 +801,12 @@ class SynthGUI(tk.Frame):
 
     def generate_sample(self, oscillator: Oscillator, duration: float, use_fade: bool = False) -> Optional[Sample]:
         scale = 2**(8*self.synth.samplewidth-1)
+        oscillator.blocksize = render_blocksize
         blocks = oscillator.blocks()
+        num_frames = int(self.synth.samplerate*duration)
         try:
-            sample_blocks = list(next(blocks) for _ in range(int(self.synth.samplerate*duration/params.norm_osc_blocksize)))
-            float_frames = sum(sample_blocks, [])
+            sample_blocks = list(next(blocks) for _ in range(math.ceil(num_frames/render_blocksize)))
+            float_frames = sum(sample_blocks, [])[:num_frames]
             frames = [int(v*scale) for v in float_frames]
         except StopIteration:
             return None
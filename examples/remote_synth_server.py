@@ -8,7 +8,7 @@ Written by Irmen de Jong (irmen@razorvine.net) - License: GNU LGPL 3.
 """
 
 from typing import Any, Dict, Generator, List, Tuple
-from synthplayer import synth, sample, params
+from synthplayer import synth, sample
 import Pyro4
 from Pyro4.util import SerializerBase
 
@@ -32,8 +32,7 @@ class WaveSynthServer:
         self.synth = synth.WaveSynth()    # the synthesizer can be reconfigured by a call to setup()
 
     def setup(self, samplerate: int = 44100, samplewidth: int = 2, blocksize: int = 512) -> None:
-        params.norm_osc_blocksize = blocksize
-        self.synth = synth.WaveSynth(samplerate, samplewidth)
+        self.synth = synth.WaveSynth(samplerate, samplewidth, blocksize=blocksize)
 
     def sine(self, frequency: int, duration: float, amplitude: float = 0.9999, phase: float = 0.0, bias: float = 0.0) -> sample.Sample:
         return self.synth.sine(frequency, duration, amplitude, phase, bias)
@@ -1,14 +1,30 @@
+"""
+Benchmark suite for the oscillators, filters and some common oscillator graphs.
+Measures the throughput (samples per second) with both the python and the numpy engine,
+for several block sizes. Every run of a benchmark lasts a minimum amount of time, and all benchmarks
+are run several times: the fastest run of each one is used (like timeit does), so a temporary
+slowdown of the machine doesn't show up as a regression.
+The results can be written as JSON and compared against a stored baseline:
+the exit code is 1 if the throughput of any benchmark dropped by more than the threshold.
+
+Example:  python synth_performance.py --json results.json --baseline baseline.json --threshold 0.1
+"""
+
+import sys
+import json
 import time
+import argparse
 import itertools
 import platform
-from synthplayer import synth, params
+from typing import Callable, Dict, List, Tuple
+from synthplayer import synth, params, oscillators
+from synthplayer.oscillators import Oscillator
 
 
 samplerate = 44100
 frequency = 880
-num_blocks = samplerate*40//params.norm_osc_blocksize
 
-oscillators = [
+oscillators_to_test = [
                synth.Linear,        # baseline
                synth.FastSine,
                synth.FastPulse,
@@ -27,24 +43,157 @@ oscillators = [
                # synth.Harmonics,   # used by sawtoothH and squareH already
                synth.WhiteNoise,
                synth.Semicircle,
-               synth.Pointy
+               synth.Pointy,
+               synth.Wavetable
                ]
 
 
-if platform.python_implementation().lower() == "pypy":
-    print("PYPY WARMUP...")
-    for osctype in oscillators:
-        osc = osctype(frequency, samplerate=samplerate)
-        print(osctype.__name__)
-        dummy = list(itertools.islice(osc.blocks(), num_blocks))
-
-print("\nTESTING...")
-for osctype in oscillators:
-    osc = osctype(frequency, samplerate=samplerate)
-    print("testing {:20.20s}... ".format(osctype.__name__), end="")
-    start = time.time()
-    dummy = list(itertools.islice(osc.blocks(), num_blocks))
-    duration = time.time()-start
-    num_samples = num_blocks * params.norm_osc_blocksize
-    sample_duration = num_samples/samplerate
-    print("{:6.0f} K iterations/sec ({:.1f} x realtime @ {:d} hz)".format(num_samples/duration/1000, sample_duration/duration, samplerate))
+def lfo(freq: float = 5.0, amplitude: float = 0.1, bias: float = 0.0) -> Oscillator:
+    return synth.Sine(freq, amplitude, bias=bias, samplerate=samplerate)
+
+
+def source() -> Oscillator:
+    return synth.FastSawtooth(frequency, samplerate=samplerate)
+
+
+# the filters and common oscillator graphs, as functions that create them
+graphs_to_test = [
+    ("EnvelopeFilter", lambda: synth.EnvelopeFilter(source(), 0.1, 0.1, 1000, 0.5, 0.1)),
+    ("MixingFilter", lambda: synth.MixingFilter(source(), synth.FastSine(frequency*1.5, samplerate=samplerate))),
+    ("AmpModulationFilter", lambda: synth.AmpModulationFilter(source(), lfo(4, 1.0))),
+    ("DelayFilter", lambda: synth.DelayFilter(source(), 0.1)),
+    ("EchoFilter", lambda: synth.EchoFilter(source(), 0.0, 5, 0.1, 0.6)),
+    ("ClipFilter", lambda: synth.ClipFilter(source(), -0.5, 0.5)),
+    ("AbsFilter", lambda: synth.AbsFilter(source())),
+    ("BiquadFilter", lambda: synth.BiquadFilter(source(), "lowpass", 1200, 2.0)),
+    ("BiquadFilter+lfo", lambda: synth.BiquadFilter(source(), "lowpass", 1200, 2.0, cutoff_lfo=lfo(1, 0.5))),
+    ("ControlRateFilter", lambda: synth.ControlRateFilter(lfo(), 16)),
+    ("Sine+fm", lambda: synth.Sine(frequency, fm_lfo=lfo(), samplerate=samplerate)),
+    ("Sine+fm(control rate)", lambda: synth.Sine(frequency, fm_lfo=synth.ControlRateFilter(lfo(), 16), samplerate=samplerate)),
+    ("Pulse+pwm", lambda: synth.Pulse(frequency, pwm_lfo=lfo(0.5, 0.4, 0.5), samplerate=samplerate)),
+    ("FastPulse+pwm", lambda: synth.FastPulse(frequency, pwm_lfo=lfo(0.5, 0.4, 0.5), samplerate=samplerate)),
+    ("Harmonics+fm", lambda: synth.Harmonics(frequency, [(n, 1/n) for n in range(1, 16)], fm_lfo=lfo(), samplerate=samplerate)),
+    ("Wavetable+fm+morph", lambda: synth.Wavetable(frequency, "sine", fm_lfo=lfo(), morph_to=["sawtooth_h"],
+                                                   morph_lfo=lfo(0.5, 0.5, 0.5), samplerate=samplerate)),
+    ("voice", lambda: synth.EnvelopeFilter(synth.MixingFilter(
+        synth.Sine(frequency, fm_lfo=lfo(), samplerate=samplerate),
+        synth.Pulse(frequency*0.5, pwm_lfo=lfo(0.5, 0.4, 0.5), samplerate=samplerate),
+        gains=[0.5, 0.5]), 0.1, 0.1, 1000, 0.5, 0.1)),
+]   # type: List[Tuple[str, Callable[[], Oscillator]]]
+
+
+def benchmarks() -> List[Tuple[str, Callable[[], Oscillator]]]:
+    oscs = [(osctype.__name__, lambda osctype=osctype: osctype(frequency, samplerate=samplerate))
+            for osctype in oscillators_to_test]     # type: List[Tuple[str, Callable[[], Oscillator]]]
+    return oscs + graphs_to_test
+
+
+def measure(create: Callable[[], Oscillator], blocksize: int, min_time: float) -> float:
+    """
+    Returns the throughput in samples per second, of generating blocks for at least min_time seconds.
+    The blocksize is changed after the oscillator is created, so this also checks that the blocks follow it.
+    """
+    osc = create()
+    osc.blocksize = blocksize
+    blocks = osc.blocks()
+    first_block = next(blocks)
+    if len(first_block) != blocksize:
+        raise ValueError("blocks of {:d} values expected, got {:d}".format(blocksize, len(first_block)))
+    num_samples = 0
+    start = time.perf_counter()
+    duration = 0.0
+    while duration < min_time:
+        batch = sum(len(block) for block in itertools.islice(blocks, 16))
+        duration = time.perf_counter() - start
+        if not batch:
+            break
+        num_samples += batch
+    return num_samples / duration
+
+
+def run(blocksizes: List[int], min_time: float, repeat: int, engines: List[bool], name_filter: str) -> Dict[str, float]:
+    """
+    Runs all benchmarks repeat times, and returns the best throughput of each one.
+    The benchmarks are repeated as a whole, rather than one by one, so the runs of a benchmark are spread out in time.
+    """
+    results = {}    # type: Dict[str, float]
+    for use_numpy in engines:
+        params.oscillators_use_numpy = use_numpy
+        engine = "numpy" if use_numpy else "python"
+        print("\nTESTING ({:s} engine)...".format(engine))
+        selected = [(name, create) for name, create in benchmarks() if name_filter in name]
+        for run_number in range(1, repeat+1):
+            print("run {:d} of {:d}".format(run_number, repeat), end="\r", flush=True)
+            for name, create in selected:
+                for blocksize in blocksizes:
+                    key = "{:s}/{:s}/{:d}".format(engine, name, blocksize)
+                    results[key] = max(results.get(key, 0.0), measure(create, blocksize, min_time))
+        for name, _ in selected:
+            print("{:24.24s}".format(name), end="")
+            for blocksize in blocksizes:
+                throughput = results["{:s}/{:s}/{:d}".format(engine, name, blocksize)]
+                print("{:8.0f} K/s @{:<5d}".format(throughput/1000, blocksize), end="")
+            print()
+    return results
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], threshold: float) -> List[str]:
+    """Prints the changes compared to the baseline, and returns the benchmarks that regressed."""
+    regressions = []
+    print("\nCOMPARED TO THE BASELINE:")
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        ratio = results[key] / baseline[key]
+        regressed = ratio < 1.0 - threshold
+        if regressed:
+            regressions.append(key)
+        print("{:48.48s} {:6.2f} x {:s}".format(key, ratio, " REGRESSION" if regressed else ""))
+    return regressions
+
+
+def main(args: List[str]) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark the synthesizer oscillators and filters.")
+    ap.add_argument("-b", "--blocksizes", type=int, nargs="+", default=[64, params.norm_osc_blocksize, 4096],
+                    help="block sizes to measure")
+    ap.add_argument("-t", "--time", type=float, default=0.1, help="minimum duration of a benchmark run in seconds")
+    ap.add_argument("-r", "--repeat", type=int, default=5, help="number of runs per benchmark, the fastest one is used")
+    ap.add_argument("-e", "--engine", choices=["python", "numpy", "both"], default="both")
+    ap.add_argument("-k", "--filter", default="", help="only run the benchmarks with this text in their name")
+    ap.add_argument("-j", "--json", help="write the results to this json file")
+    ap.add_argument("--baseline", help="json results file to compare against")
+    ap.add_argument("--threshold", type=float, default=0.1,
+                    help="fraction the throughput may drop compared to the baseline (default 0.1)")
+    options = ap.parse_args(args)
+    engines = [False]
+    if oscillators.numpy is not None and options.engine != "python":
+        engines = [True] if options.engine == "numpy" else [False, True]
+    elif options.engine == "numpy":
+        print("numpy is not available")
+        return 2
+    if platform.python_implementation().lower() == "pypy":
+        print("PYPY WARMUP...")
+        run(options.blocksizes, options.time, 1, engines, options.filter)
+    results = run(options.blocksizes, options.time, options.repeat, engines, options.filter)
+    if options.json:
+        with open(options.json, "w") as out:
+            json.dump({
+                "python": platform.python_implementation() + " " + platform.python_version(),
+                "platform": platform.platform(),
+                "numpy": oscillators.numpy.__version__ if oscillators.numpy is not None else None,
+                "samplerate": samplerate,
+                "results": results
+            }, out, indent=2, sort_keys=True)
+    if options.baseline:
+        with open(options.baseline) as inp:
+            baseline = json.load(inp)["results"]
+        regressions = compare(results, baseline, options.threshold)
+        if regressions:
+            print("\n{:d} benchmark(s) are more than {:.0f}% slower than the baseline.".format(
+                len(regressions), options.threshold*100))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
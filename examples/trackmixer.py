@@ -11,7 +11,7 @@ import os
 import cmd
 import sys
 from configparser import ConfigParser
-from synthplayer.sample import Sample
+from synthplayer.sample import Sample, MixBuffer
 from synthplayer.playback import Output
 
 
@@ -49,11 +49,12 @@ class Mixer:
             total_seconds += len(bar) * 60.0 / self.bpm / self.ticks
         if verbose:
             print("Mixing {:d} patterns...".format(len(self.patterns)))
-        mixed = Sample().make_32bit()
+        mix_buffer = MixBuffer(samplewidth=4, is_float=True, seconds=total_seconds)
         for index, timestamp, sample in self.mixed_samples(tracker=False):
             if verbose:
                 print("\r{:3.0f} % ".format(timestamp/total_seconds*100), end="")
-            mixed.mix_at(timestamp, sample)
+            mix_buffer.add_at(int(timestamp*mix_buffer.samplerate), sample)
+        mixed = mix_buffer.to_sample()
         # chop/extend to get to the precise total duration (in case of silence in the last bars etc)
         missing = total_seconds-mixed.duration
         if missing > 0:
@@ -81,7 +82,7 @@ class Mixer:
         samples = self.mixed_samples()
         # get the first sample
         index, previous_timestamp, sample = next(samples)
-        mixed = Sample().make_32bit()
+        mixed = Sample().make_float()
         mixed.mix_at(previous_timestamp, sample)
         # continue mixing the following samples
         for index, timestamp, sample in samples:
@@ -96,7 +97,7 @@ class Mixer:
                 overflow = mixed.split(trigger_duration)
             mixed_duration += mixed.duration
             yield mixed
-            mixed = overflow if overflow else Sample().make_32bit()
+            mixed = overflow if overflow else Sample().make_float()
             mixed.mix(sample)
             previous_timestamp = timestamp
         # output the last remaining sample and extend it to the end of the duration if needed
@@ -201,7 +202,7 @@ class Song:
         """Reads the sample files for the instruments."""
         self.instruments = {}
         for name, file in sorted(instruments.items()):
-            self.instruments[name] = Sample(wave_file=os.path.join(samples_path, file)).normalize().make_32bit(scale_amplitude=False).lock()
+            self.instruments[name] = Sample(wave_file=os.path.join(samples_path, file)).normalize().make_float().lock()
 
     def read_patterns(self, songdef, names):
         """Reads and parses the pattern specs from the song."""
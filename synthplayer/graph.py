@@ -0,0 +1,374 @@
+"""
+Compiles a tree of oscillators and filters into a single evaluation plan.
+
+Normally every oscillator and filter in a tree such as
+EnvelopeFilter(MixingFilter(Sine(fm_lfo=...), Pulse(pwm_lfo=...)))
+is a separate generator, and every block of values is passed from node to node as a new list.
+The compiled plan instead evaluates the whole tree per block directly on numpy arrays,
+where every node reuses its own buffer. No intermediate generators or lists are created.
+Oscillators and filters that the compiler doesn't know (such as your own custom ones),
+are evaluated via their own blocks() method.
+
+The compiled plan requires numpy, without it (or when the numpy engine is switched off
+via params.oscillators_use_numpy) the compiled oscillator simply uses the original oscillator.
+
+Written by Irmen de Jong (irmen@razorvine.net) - License: GNU LGPL 3.
+"""
+
+import sys
+from abc import abstractmethod, ABC
+from math import pi
+from typing import Generator, List, Optional, Sequence, Any
+from .oscillators import *
+from .oscillators import use_numpy_engine, triangle_numpy, sawtooth_numpy, semicircle_numpy, pointy_numpy, numpy
+
+
+__all__ = ["compile", "CompiledOscillator"]
+
+
+class CompiledOscillator(Oscillator):
+    """
+    Oscillator that evaluates a whole tree of oscillators and filters via one compiled plan.
+    Use the compile() function to create it. Every call to blocks() starts a new plan from the beginning.
+    """
+    def __init__(self, oscillator: Oscillator) -> None:
+        super().__init__(oscillator.samplerate)
+        self.oscillator = oscillator
+
+    def inputs(self) -> List[Oscillator]:
+        return [self.oscillator]
+
+    def blocks(self) -> Generator[List[float], None, None]:
+        if not use_numpy_engine():
+            yield from self.oscillator.blocks()
+            return
+        for block in compile_node(self.oscillator, self.blocksize).render_blocks():
+            yield block.tolist()
+
+
+def compile(oscillator: Oscillator) -> CompiledOscillator:
+    """Compiles the oscillator (and all of its sources, LFOs etc.) into a single evaluation plan."""
+    if isinstance(oscillator, CompiledOscillator):
+        return oscillator
+    return CompiledOscillator(oscillator)
+
+
+class Node(ABC):
+    """
+    A node in a compiled plan. render() returns the next block of values,
+    as a view on the node's own buffer (that will be overwritten by the next render),
+    or None if there are no more values. The caller is allowed to modify the values in place.
+    """
+    def __init__(self, blocksize: int) -> None:
+        self.blocksize = blocksize
+        self.buffer = numpy.empty(blocksize)
+
+    @abstractmethod
+    def render(self) -> Optional['numpy.ndarray']:
+        pass
+
+    def render_blocks(self) -> Generator['numpy.ndarray', None, None]:
+        """Generates all rendered blocks (every one of them is a view on the reused buffer)"""
+        while True:
+            block = self.render()
+            if block is None:
+                return
+            yield block
+
+
+class OscillatorNode(Node):
+    """Fallback node that takes the blocks from the oscillator itself."""
+    def __init__(self, oscillator: Oscillator, blocksize: int) -> None:
+        super().__init__(blocksize)
+        self.blocks = oscillator.blocks()
+
+    def render(self) -> Optional['numpy.ndarray']:
+        block = next(self.blocks, None)
+        if block is None:
+            return None
+        if len(block) > len(self.buffer):
+            self.buffer = numpy.empty(len(block))
+        out = self.buffer[:len(block)]
+        out[:] = block
+        return out
+
+
+class LinearNode(Node):
+    def __init__(self, osc: Linear, blocksize: int) -> None:
+        super().__init__(blocksize)
+        self.value = osc.value
+        self.increment = osc.increment
+        self.min_value = osc.min_value
+        self.max_value = osc.max_value
+        self.ramp = numpy.arange(blocksize) * osc.increment
+
+    def render(self) -> Optional['numpy.ndarray']:
+        if not self.increment:
+            self.buffer.fill(self.value)
+            return self.buffer
+        numpy.add(self.ramp, self.value, out=self.buffer)
+        numpy.clip(self.buffer, self.min_value, self.max_value, out=self.buffer)
+        self.value = min(self.max_value, max(self.min_value, self.value + self.blocksize*self.increment))
+        return self.buffer
+
+
+class PhaseNode(Node):
+    """
+    Oscillator node that computes a waveform from the phase, that is optionally frequency modulated.
+    The phase is kept within one period of the waveform (see the numpy engine in the oscillators module).
+    """
+    def __init__(self, waveform: str, phase: float, step: float, period: float,
+                 amplitude: float, bias: float, blocksize: int,
+                 fm: Optional[Node] = None, pwm: Optional[Node] = None, pulsewidth: float = 0.1) -> None:
+        super().__init__(blocksize)
+        self.waveform = waveform
+        self.phase = phase
+        self.step = step
+        self.period = period
+        self.amplitude = amplitude
+        self.bias = bias
+        self.fm = fm
+        self.pwm = pwm
+        self.pulsewidth = pulsewidth
+        self.ramp = numpy.arange(blocksize) * step
+        self.steps = numpy.empty(blocksize) if fm else None     # type: Any
+
+    def render(self) -> Optional['numpy.ndarray']:
+        if self.fm:
+            fm_block = self.fm.render()
+            if fm_block is None:
+                return None
+            size = len(fm_block)
+            tt = self.buffer[:size]
+            steps = self.steps[:size]
+            numpy.add(fm_block, 1.0, out=steps)
+            steps *= self.step
+            numpy.cumsum(steps, out=tt)
+            next_phase = (self.phase + tt[-1]) % self.period
+            tt -= steps
+            tt += self.phase
+            self.phase = next_phase
+        else:
+            size = self.blocksize
+            tt = self.buffer
+            numpy.add(self.ramp, self.phase, out=tt)
+            self.phase = (self.phase + size*self.step) % self.period
+        return self.apply_waveform(tt)
+
+    def apply_waveform(self, tt: 'numpy.ndarray') -> Optional['numpy.ndarray']:
+        amplitude = self.amplitude
+        bias = self.bias
+        if self.waveform == "sine":
+            numpy.sin(tt, out=tt)
+            tt *= amplitude
+            tt += bias
+        elif self.waveform == "triangle":
+            triangle_numpy(tt, amplitude, bias)
+        elif self.waveform == "square":
+            # 0.0 for the first half of the cycle, 1.0 for the second half
+            tt *= 2.0
+            numpy.trunc(tt, out=tt)
+            tt %= 2.0
+            tt *= -2.0*amplitude
+            tt += bias+amplitude
+        elif self.waveform == "sawtooth":
+            sawtooth_numpy(tt, amplitude, bias)
+        elif self.waveform == "pulse":
+            pulsewidth = self.pulsewidth    # type: Any
+            if self.pwm:
+                pulsewidth = self.pwm.render()
+                if pulsewidth is None:
+                    return None
+                size = min(len(tt), len(pulsewidth))
+                tt = tt[:size]
+                pulsewidth = pulsewidth[:size]
+                epsilon = sys.float_info.epsilon
+                numpy.clip(pulsewidth, epsilon, 1.0-epsilon, out=pulsewidth)
+            tt %= 1.0
+            numpy.less(tt, pulsewidth, out=tt)
+            tt *= 2.0*amplitude
+            tt += bias-amplitude
+        elif self.waveform == "semicircle":
+            semicircle_numpy(tt, amplitude, bias)
+        elif self.waveform == "pointy":
+            pointy_numpy(tt, amplitude, bias)
+        else:
+            raise ValueError("invalid waveform: " + self.waveform)
+        return tt
+
+
+class MixingNode(Node):
+    def __init__(self, sources: List[Node], gains: Optional[Sequence[float]], blocksize: int) -> None:
+        super().__init__(blocksize)
+        self.sources = list(sources)   # type: List[Optional[Node]]
+        self.gains = list(gains) if gains else None
+
+    def render(self) -> Optional['numpy.ndarray']:
+        blocks = []
+        gains = []
+        for i, source in enumerate(self.sources):
+            if source:
+                block = source.render()
+                if block is None:
+                    self.sources[i] = None
+                else:
+                    blocks.append(block)
+                    gains.append(self.gains[i] if self.gains else 1.0)
+        if not blocks:
+            return None
+        # (sources that have ended contribute full blocks of silence)
+        size = min(min(len(b) for b in blocks), self.blocksize)
+        out = self.buffer[:size]
+        if self.gains:
+            numpy.multiply(blocks[0][:size], gains[0], out=out)
+            for block, gain in zip(blocks[1:], gains[1:]):
+                block = block[:size]
+                block *= gain
+                out += block
+        else:
+            numpy.copyto(out, blocks[0][:size])
+            for block in blocks[1:]:
+                out += block[:size]
+        return out
+
+
+class AmpModulationNode(Node):
+    def __init__(self, source: Node, modulator: Node, blocksize: int) -> None:
+        super().__init__(blocksize)
+        self.source = source
+        self.modulator = modulator
+
+    def render(self) -> Optional['numpy.ndarray']:
+        block = self.source.render()
+        if block is None:
+            return None
+        amp = self.modulator.render()
+        if amp is None:
+            return None
+        size = min(len(block), len(amp))
+        block = block[:size]
+        block *= amp[:size]
+        return block
+
+
+class EnvelopeNode(Node):
+    def __init__(self, envelope: EnvelopeFilter, source: Node, blocksize: int) -> None:
+        super().__init__(blocksize)
+        self.source = source
+        self.gains = EnvelopeGains(envelope.segments(), envelope._start, True)
+        self.stop_at_end = envelope._stop_at_end
+        self.ended = False
+
+    def render(self) -> Optional['numpy.ndarray']:
+        if self.ended:
+            if self.stop_at_end:
+                return None
+            self.buffer.fill(0.0)
+            return self.buffer
+        block = self.source.render()
+        if block is None:
+            return None
+        gains = self.gains.next(len(block))
+        size = len(gains)
+        if size < len(block):
+            # the envelope has ended somewhere in this block
+            self.ended = True
+            if not size:
+                return self.render()
+            if not self.stop_at_end:
+                self.buffer.fill(0.0)
+                numpy.multiply(block[:size], gains, out=self.buffer[:size])
+                return self.buffer
+            block = block[:size]
+        block *= gains
+        return block
+
+
+class ClipNode(Node):
+    def __init__(self, source: Node, minimum: float, maximum: float, blocksize: int) -> None:
+        super().__init__(blocksize)
+        self.source = source
+        self.min = minimum
+        self.max = maximum
+
+    def render(self) -> Optional['numpy.ndarray']:
+        block = self.source.render()
+        if block is not None:
+            numpy.minimum(block, self.max, out=block)
+            numpy.maximum(block, self.min, out=block)
+        return block
+
+
+class AbsNode(Node):
+    def __init__(self, source: Node, blocksize: int) -> None:
+        super().__init__(blocksize)
+        self.source = source
+
+    def render(self) -> Optional['numpy.ndarray']:
+        block = self.source.render()
+        if block is not None:
+            numpy.fabs(block, out=block)
+        return block
+
+
+def compile_node(osc: Oscillator, blocksize: int) -> Node:
+    """Creates the node (and the nodes for its sources) of the compiled plan for the given oscillator."""
+    # The exact types are checked, subclasses may have changed the way the values are computed.
+    osctype = type(osc)
+    two_pi = 2.0*pi
+
+    def fm_node(lfo: Optional[Oscillator]) -> Node:
+        # without a LFO, the phase is still integrated like the oscillator does, to get identical results
+        return compile_node(lfo or Linear(0.0), blocksize)
+
+    o = osc     # type: Any
+    if osctype is CompiledOscillator:
+        return compile_node(o.oscillator, blocksize)
+    if osctype is NullFilter:
+        return compile_node(o.sources[0], blocksize)
+    if osctype is Linear:
+        return LinearNode(o, blocksize)
+    if osctype is EnvelopeFilter:
+        return EnvelopeNode(o, compile_node(o.sources[0], blocksize), blocksize)
+    if osctype is MixingFilter:
+        return MixingNode([compile_node(src, blocksize) for src in o.sources], o.gains, blocksize)
+    if osctype is AmpModulationFilter:
+        return AmpModulationNode(compile_node(o.sources[0], blocksize), compile_node(o._modulator, blocksize), blocksize)
+    if osctype is ClipFilter:
+        return ClipNode(compile_node(o.sources[0], blocksize), o.min, o.max, blocksize)
+    if osctype is AbsFilter:
+        return AbsNode(compile_node(o.sources[0], blocksize), blocksize)
+    samplerate = o.samplerate
+    if osctype is Sine:
+        return PhaseNode("sine", o._phase*two_pi, two_pi*o.frequency/samplerate, two_pi,
+                         o.amplitude, o.bias, blocksize, fm=fm_node(o._fm_lfo))
+    if osctype in (Triangle, Square, Sawtooth):
+        return PhaseNode(osctype.__name__.lower(), o._phase, o.frequency/samplerate, 1.0,
+                         o.amplitude, o.bias, blocksize, fm=fm_node(o._fm_lfo))
+    if osctype is Pulse:
+        return PhaseNode("pulse", o._phase, o.frequency/samplerate, 1.0, o.amplitude, o.bias, blocksize,
+                         fm=fm_node(o._fm_lfo), pwm=compile_node(o._pwm_lfo or Linear(o.pulsewidth), blocksize))
+    if osctype is Semicircle:
+        return PhaseNode("semicircle", (o._phase*2.0 - o.frequency) % 2.0, 2.0*o.frequency/samplerate, 2.0,
+                         o.amplitude, o.bias, blocksize, fm=fm_node(o._fm_lfo))
+    if osctype is Pointy:
+        return PhaseNode("pointy", o._phase*two_pi, two_pi*o.frequency/samplerate, two_pi,
+                         o.amplitude, o.bias, blocksize, fm=fm_node(o._fm_lfo))
+    if osctype is FastSine:
+        return PhaseNode("sine", o._phase*two_pi, two_pi*o._frequency/samplerate, two_pi, o.amplitude, o.bias, blocksize)
+    if osctype in (FastTriangle, FastSquare, FastSawtooth):
+        return PhaseNode(osctype.__name__[4:].lower(), o._phase, o._frequency/samplerate, 1.0, o.amplitude, o.bias, blocksize)
+    if osctype is FastPulse:
+        return PhaseNode("pulse", o._phase, o._frequency/samplerate, 1.0, o.amplitude, o.bias, blocksize,
+                         pwm=compile_node(o._pwm_lfo, blocksize) if o._pwm_lfo else None, pulsewidth=o._pulsewidth)
+    if osctype is FastSemicircle:
+        return PhaseNode("semicircle", o._phase*2.0, 2.0*o._frequency/samplerate, 2.0, o.amplitude, o.bias, blocksize)
+    if osctype is FastPointy:
+        return PhaseNode("pointy", o._phase*two_pi, two_pi*o._frequency/samplerate, two_pi, o.amplitude, o.bias, blocksize)
+    # The fallback needs the blocks in the blocksize of the plan. They are taken from a copy of the oscillator
+    # so the blocksize of the oscillator itself is left untouched. A BroadcastFilter is meant to be shared
+    # with consumers outside the plan though, so that one gets the blocksize of the plan set on itself.
+    if not isinstance(osc, BroadcastFilter):
+        osc = osc.at_samplerate(osc.samplerate)
+    osc.blocksize = blocksize
+    return OscillatorNode(osc, blocksize)
@@ -0,0 +1,516 @@
+"""
+DSP kernels: the basic operations on raw sample frames that the Sample class and the mixers are built on.
+They work exactly like the functions of the same name in the audioop module (same arguments, same results),
+but audioop is deprecated and has been removed in Python 3.13. So there are several backends:
+
+- 'audioop' uses the audioop module itself (if it's available)
+- 'numpy' uses vectorized numpy code (if numpy is available)
+- 'array' is plain Python code using the array module, always available but slow
+
+All backends produce the same results. By default (params.dsp_kernels = "auto") the fastest available backend
+is chosen by a short benchmark when the kernels are first used. Use select() to choose a backend yourself.
+Sample values are signed integers of 1, 2, 3 or 4 bytes in the machine's native byte order.
+
+Written by Irmen de Jong (irmen@razorvine.net) - License: GNU LGPL 3.
+"""
+
+import sys
+import math
+import builtins
+import time
+import array
+import warnings
+from abc import abstractmethod, ABC
+from typing import Any, Dict, List, Optional, Tuple, Union
+from . import params
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import audioop
+except ImportError:
+    audioop = None      # type: ignore
+try:
+    import numpy
+except ImportError:
+    numpy = None        # type: ignore
+
+
+__all__ = ["KernelBackend", "AudioopBackend", "NumpyBackend", "ArrayBackend", "backends", "select", "backend", "benchmark",
+           "add", "mul", "bias", "max", "rms", "tomono", "tostereo", "lin2lin", "ratecv", "reverse", "byteswap"]
+
+
+Fragment = Union[bytes, bytearray, memoryview]
+RatecvState = Tuple[int, Tuple[Tuple[int, int], ...]]
+
+samplewidths_to_arraycode = {
+    1: 'b',
+    2: 'h',
+    4: 'l'    # or 'i' on 64 bit systems
+}
+
+# the actual array type code for the given sample width varies
+if array.array('i').itemsize == 4:
+    samplewidths_to_arraycode[4] = 'i'
+
+
+def check_fragment(fragment: Fragment, width: int, nchannels: int = 1) -> None:
+    if width not in (1, 2, 3, 4):
+        raise ValueError("Size should be 1, 2, 3 or 4")
+    if memoryview(fragment).nbytes % (width * nchannels):
+        raise ValueError("not a whole number of frames")
+
+
+def check_bias(bias: int) -> None:
+    # audioop takes the bias as a C int
+    if not -2**31 <= bias < 2**31:
+        raise OverflowError("Python int too large to convert to C int")
+
+
+def sample_limits(width: int) -> Tuple[int, int]:
+    """The minimum and maximum sample value for the sample width."""
+    return -2 ** (8 * width - 1), 2 ** (8 * width - 1) - 1
+
+
+class KernelBackend(ABC):
+    """
+    One implementation of the DSP kernels. The methods take the same arguments and return
+    the same results as the audioop functions of the same name.
+    """
+    name = ""
+
+    @abstractmethod
+    def add(self, fragment1: Fragment, fragment2: Fragment, width: int) -> bytes:
+        """The sum of the sample values of both fragments (clipped)."""
+
+    @abstractmethod
+    def mul(self, fragment: Fragment, width: int, factor: float) -> bytes:
+        """The sample values multiplied by the factor (rounded down and clipped)."""
+
+    @abstractmethod
+    def bias(self, fragment: Fragment, width: int, bias: int) -> bytes:
+        """The sample values with the bias added (wrapping around on overflow)."""
+
+    @abstractmethod
+    def max(self, fragment: Fragment, width: int) -> int:
+        """The maximum of the absolute sample values."""
+
+    @abstractmethod
+    def rms(self, fragment: Fragment, width: int) -> int:
+        """The root mean square of the sample values."""
+
+    @abstractmethod
+    def tomono(self, fragment: Fragment, width: int, lfactor: float, rfactor: float) -> bytes:
+        """The stereo fragment mixed into mono, with the given factors for the left and right channel."""
+
+    @abstractmethod
+    def tostereo(self, fragment: Fragment, width: int, lfactor: float, rfactor: float) -> bytes:
+        """The mono fragment as stereo, the left and right channel multiplied by the given factors."""
+
+    @abstractmethod
+    def lin2lin(self, fragment: Fragment, width: int, newwidth: int) -> bytes:
+        """The sample values converted to another sample width."""
+
+    @abstractmethod
+    def ratecv(self, fragment: Fragment, width: int, nchannels: int, inrate: int, outrate: int,
+               state: Optional[RatecvState], weightA: int = 1, weightB: int = 0) -> Tuple[bytes, RatecvState]:
+        """The fragment converted to another frame rate, and the state to pass to the conversion of the next fragment."""
+
+    @abstractmethod
+    def reverse(self, fragment: Fragment, width: int) -> bytes:
+        """The sample values in reverse order."""
+
+    @abstractmethod
+    def byteswap(self, fragment: Fragment, width: int) -> bytes:
+        """The sample values with their byte order swapped (big-endian to little-endian or vice versa)."""
+
+
+class AudioopBackend(KernelBackend):
+    """The kernels of the audioop module."""
+    name = "audioop"
+
+    def add(self, fragment1: Fragment, fragment2: Fragment, width: int) -> bytes:
+        return audioop.add(fragment1, fragment2, width)
+
+    def mul(self, fragment: Fragment, width: int, factor: float) -> bytes:
+        return audioop.mul(fragment, width, factor)
+
+    def bias(self, fragment: Fragment, width: int, bias: int) -> bytes:
+        return audioop.bias(fragment, width, bias)
+
+    def max(self, fragment: Fragment, width: int) -> int:
+        return audioop.max(fragment, width)
+
+    def rms(self, fragment: Fragment, width: int) -> int:
+        return audioop.rms(fragment, width)
+
+    def tomono(self, fragment: Fragment, width: int, lfactor: float, rfactor: float) -> bytes:
+        return audioop.tomono(fragment, width, lfactor, rfactor)
+
+    def tostereo(self, fragment: Fragment, width: int, lfactor: float, rfactor: float) -> bytes:
+        return audioop.tostereo(fragment, width, lfactor, rfactor)
+
+    def lin2lin(self, fragment: Fragment, width: int, newwidth: int) -> bytes:
+        return audioop.lin2lin(fragment, width, newwidth)
+
+    def ratecv(self, fragment: Fragment, width: int, nchannels: int, inrate: int, outrate: int,
+               state: Optional[RatecvState], weightA: int = 1, weightB: int = 0) -> Tuple[bytes, RatecvState]:
+        return audioop.ratecv(fragment, width, nchannels, inrate, outrate, state, weightA, weightB)
+
+    def reverse(self, fragment: Fragment, width: int) -> bytes:
+        return audioop.reverse(fragment, width)
+
+    def byteswap(self, fragment: Fragment, width: int) -> bytes:
+        return audioop.byteswap(fragment, width)
+
+
+class ArrayBackend(KernelBackend):
+    """The kernels in plain Python, using the array module (and int.from_bytes for 24 bits samples)."""
+    name = "array"
+
+    @staticmethod
+    def values(fragment: Fragment, width: int) -> Any:
+        check_fragment(fragment, width)
+        if width == 3:
+            data = bytes(fragment)
+            return [int.from_bytes(data[i:i+3], sys.byteorder, signed=True) for i in range(0, len(data), 3)]
+        values = array.array(samplewidths_to_arraycode[width])
+        values.frombytes(fragment)
+        return values
+
+    @staticmethod
+    def frames(values: Any, width: int) -> bytes:
+        if width == 3:
+            return b"".join(v.to_bytes(3, sys.byteorder, signed=True) for v in values)
+        return array.array(samplewidths_to_arraycode[width], values).tobytes()
+
+    @staticmethod
+    def fbound(value: float, minval: int, maxval: int) -> int:
+        """Clips the value to the range and rounds it down, just like audioop does."""
+        if value > maxval:
+            return maxval
+        if value < minval + 1:
+            return minval
+        return math.floor(value)
+
+    def add(self, fragment1: Fragment, fragment2: Fragment, width: int) -> bytes:
+        values1 = self.values(fragment1, width)
+        values2 = self.values(fragment2, width)
+        if len(values1) != len(values2):
+            raise ValueError("Lengths should be the same")
+        minval, maxval = sample_limits(width)
+        return self.frames([min(maxval, builtins.max(minval, v1+v2)) for v1, v2 in zip(values1, values2)], width)
+
+    def mul(self, fragment: Fragment, width: int, factor: float) -> bytes:
+        minval, maxval = sample_limits(width)
+        fbound = self.fbound
+        return self.frames([fbound(v*factor, minval, maxval) for v in self.values(fragment, width)], width)
+
+    def bias(self, fragment: Fragment, width: int, bias: int) -> bytes:
+        check_bias(bias)
+        minval, _ = sample_limits(width)
+        modulo = 2 ** (8 * width)
+        return self.frames([(v+bias-minval) % modulo + minval for v in self.values(fragment, width)], width)
+
+    def max(self, fragment: Fragment, width: int) -> int:
+        return builtins.max((abs(v) for v in self.values(fragment, width)), default=0)
+
+    def rms(self, fragment: Fragment, width: int) -> int:
+        values = self.values(fragment, width)
+        if not values:
+            return 0
+        sum_squares = 0.0
+        for v in values:
+            sum_squares += float(v) * float(v)
+        return int(math.sqrt(sum_squares / len(values)))
+
+    def tomono(self, fragment: Fragment, width: int, lfactor: float, rfactor: float) -> bytes:
+        check_fragment(fragment, width, 2)
+        values = self.values(fragment, width)
+        minval, maxval = sample_limits(width)
+        fbound = self.fbound
+        return self.frames([fbound(float(left)*lfactor + float(right)*rfactor, minval, maxval)
+                            for left, right in zip(values[0::2], values[1::2])], width)
+
+    def tostereo(self, fragment: Fragment, width: int, lfactor: float, rfactor: float) -> bytes:
+        minval, maxval = sample_limits(width)
+        fbound = self.fbound
+        stereo = []     # type: List[int]
+        for v in self.values(fragment, width):
+            stereo.append(fbound(v*lfactor, minval, maxval))
+            stereo.append(fbound(v*rfactor, minval, maxval))
+        return self.frames(stereo, width)
+
+    def lin2lin(self, fragment: Fragment, width: int, newwidth: int) -> bytes:
+        check_fragment(fragment, width)
+        check_fragment(b"", newwidth)
+        if width == newwidth:
+            return bytes(fragment)
+        shift_up, shift_down = 32 - 8 * width, 32 - 8 * newwidth
+        return self.frames([(v << shift_up) >> shift_down for v in self.values(fragment, width)], newwidth)
+
+    def ratecv(self, fragment: Fragment, width: int, nchannels: int, inrate: int, outrate: int,
+               state: Optional[RatecvState], weightA: int = 1, weightB: int = 0) -> Tuple[bytes, RatecvState]:
+        """This follows the algorithm of audioop.ratecv step by step (a simple linear interpolation)."""
+        d, inrate, outrate, weightA, weightB, prev, cur = ratecv_setup(fragment, width, nchannels, inrate, outrate,
+                                                                       state, weightA, weightB)
+        shift = 32 - 8 * width
+        values = [v << shift for v in self.values(fragment, width)]
+        output = []     # type: List[int]
+        index = 0
+        while True:
+            while d < 0:
+                if index >= len(values):
+                    return self.frames(output, width), (d, tuple(zip(prev, cur)))
+                for chan in range(nchannels):
+                    prev[chan] = cur[chan]
+                    cur[chan] = int((weightA * float(values[index]) + weightB * float(prev[chan])) / (weightA + weightB))
+                    index += 1
+                d += outrate
+            while d >= 0:
+                for chan in range(nchannels):
+                    output.append(int((float(prev[chan]) * d + float(cur[chan]) * (outrate - d)) / outrate) >> shift)
+                d -= inrate
+
+    def reverse(self, fragment: Fragment, width: int) -> bytes:
+        values = self.values(fragment, width)
+        return self.frames(values[::-1], width)
+
+    def byteswap(self, fragment: Fragment, width: int) -> bytes:
+        check_fragment(fragment, width)
+        data = bytes(fragment)
+        return b"".join(data[i:i+width][::-1] for i in range(0, len(data), width))
+
+
+class NumpyBackend(KernelBackend):
+    """The kernels as vectorized numpy operations."""
+    name = "numpy"
+
+    @staticmethod
+    def values(fragment: Fragment, width: int) -> 'numpy.ndarray':
+        check_fragment(fragment, width)
+        if width == 3:
+            data = numpy.frombuffer(fragment, dtype=numpy.uint8).reshape((-1, 3)).astype(numpy.int32)
+            if sys.byteorder == "big":
+                data = data[:, ::-1]
+            values = data[:, 0] | (data[:, 1] << 8) | (data[:, 2] << 16)
+            return (values ^ 0x800000) - 0x800000
+        return numpy.frombuffer(fragment, dtype={1: numpy.int8, 2: numpy.int16, 4: numpy.int32}[width])
+
+    @staticmethod
+    def frames(values: 'numpy.ndarray', width: int) -> bytes:
+        """The frames for the integer values (which must fit in the sample width)."""
+        if width == 3:
+            data = values.astype(numpy.int32).astype("<i4" if sys.byteorder == "little" else ">i4")
+            data = data.view(numpy.uint8).reshape((-1, 4))
+            return (data[:, :3] if sys.byteorder == "little" else data[:, 1:]).tobytes()
+        return values.astype({1: numpy.int8, 2: numpy.int16, 4: numpy.int32}[width]).tobytes()
+
+    @staticmethod
+    def fbound(values: 'numpy.ndarray', width: int) -> 'numpy.ndarray':
+        """Clips the float values to the range of the sample width and rounds them down, just like audioop does."""
+        minval, maxval = sample_limits(width)
+        return numpy.floor(numpy.clip(values, minval, maxval))
+
+    def add(self, fragment1: Fragment, fragment2: Fragment, width: int) -> bytes:
+        values1 = self.values(fragment1, width).astype(numpy.int64)
+        values2 = self.values(fragment2, width)
+        if len(values1) != len(values2):
+            raise ValueError("Lengths should be the same")
+        values1 += values2
+        return self.frames(numpy.clip(values1, *sample_limits(width)), width)
+
+    def mul(self, fragment: Fragment, width: int, factor: float) -> bytes:
+        return self.frames(self.fbound(self.values(fragment, width) * float(factor), width), width)
+
+    def bias(self, fragment: Fragment, width: int, bias: int) -> bytes:
+        check_bias(bias)
+        minval, _ = sample_limits(width)
+        values = self.values(fragment, width).astype(numpy.int64) + (bias - minval)
+        return self.frames(numpy.mod(values, 2 ** (8 * width)) + minval, width)
+
+    def max(self, fragment: Fragment, width: int) -> int:
+        values = self.values(fragment, width)
+        if not len(values):
+            return 0
+        return int(numpy.abs(values.astype(numpy.int64)).max())
+
+    def rms(self, fragment: Fragment, width: int) -> int:
+        values = self.values(fragment, width)
+        if not len(values):
+            return 0
+        # the squares are summed one after another (numpy.cumsum), like audioop does, for exactly the same rounding
+        sum_squares = 0.0
+        for start in range(0, len(values), 65536):
+            squares = numpy.square(values[start:start+65536], dtype=numpy.float64)
+            squares[0] += sum_squares
+            sum_squares = float(numpy.cumsum(squares)[-1])
+        return int(math.sqrt(sum_squares / len(values)))
+
+    def tomono(self, fragment: Fragment, width: int, lfactor: float, rfactor: float) -> bytes:
+        check_fragment(fragment, width, 2)
+        values = self.values(fragment, width).astype(numpy.float64)
+        return self.frames(self.fbound(values[0::2] * float(lfactor) + values[1::2] * float(rfactor), width), width)
+
+    def tostereo(self, fragment: Fragment, width: int, lfactor: float, rfactor: float) -> bytes:
+        values = self.values(fragment, width).astype(numpy.float64)
+        stereo = numpy.column_stack((self.fbound(values * float(lfactor), width), self.fbound(values * float(rfactor), width)))
+        return self.frames(stereo.ravel(), width)
+
+    def lin2lin(self, fragment: Fragment, width: int, newwidth: int) -> bytes:
+        check_fragment(fragment, width)
+        check_fragment(b"", newwidth)
+        if width == newwidth:
+            return bytes(fragment)
+        values = self.values(fragment, width).astype(numpy.int64)
+        return self.frames((values << (32 - 8 * width)) >> (32 - 8 * newwidth), newwidth)
+
+    def ratecv(self, fragment: Fragment, width: int, nchannels: int, inrate: int, outrate: int,
+               state: Optional[RatecvState], weightA: int = 1, weightB: int = 0) -> Tuple[bytes, RatecvState]:
+        """
+        The same linear interpolation as audioop.ratecv, but it calculates directly for every output frame
+        which input frames it interpolates between (and with what weight), instead of stepping through them.
+        """
+        d, inrate, outrate, weightA, weightB, prev, cur = ratecv_setup(fragment, width, nchannels, inrate, outrate,
+                                                                       state, weightA, weightB)
+        if weightB:
+            # the filter makes every input value depend on the previous one, that can't be vectorized
+            return backends["array"].ratecv(fragment, width, nchannels, inrate, outrate, state, weightA, weightB)
+        shift = 32 - 8 * width
+        inputs = self.values(fragment, width).astype(numpy.int64).reshape((-1, nchannels)) << shift
+        num_inputs = len(inputs)
+        # the consecutive input values, preceded by the previous and current values of the state
+        values = numpy.concatenate((numpy.array([prev, cur], dtype=numpy.int64), inputs))
+        num_outputs = (num_inputs * outrate + d) // inrate + 1 if num_inputs * outrate + d >= 0 else 0
+        outputs = numpy.arange(num_outputs, dtype=numpy.int64)
+        # the number of input frames consumed before each output frame, and the interpolation weight at that point
+        consumed = numpy.maximum(0, -((d - outputs * inrate) // outrate))
+        weight = (d + consumed * outrate - outputs * inrate)[:, numpy.newaxis].astype(numpy.float64)
+        interpolated = (values[consumed] * weight + values[consumed + 1] * (outrate - weight)) / outrate
+        output = numpy.trunc(interpolated).astype(numpy.int64) >> shift
+        d += num_inputs * outrate - num_outputs * inrate
+        prev, cur = values[num_inputs].tolist(), values[num_inputs + 1].tolist()
+        return self.frames(output.ravel(), width), (d, tuple(zip(prev, cur)))
+
+    def reverse(self, fragment: Fragment, width: int) -> bytes:
+        check_fragment(fragment, width)
+        return numpy.frombuffer(fragment, dtype=numpy.uint8).reshape((-1, width))[::-1].tobytes()
+
+    def byteswap(self, fragment: Fragment, width: int) -> bytes:
+        check_fragment(fragment, width)
+        return numpy.frombuffer(fragment, dtype=numpy.uint8).reshape((-1, width))[:, ::-1].tobytes()
+
+
+def ratecv_setup(fragment: Fragment, width: int, nchannels: int, inrate: int, outrate: int, state: Optional[RatecvState],
+                 weightA: int, weightB: int) -> Tuple[int, int, int, int, int, List[int], List[int]]:
+    """Checks the ratecv arguments and returns the initial d, the reduced rates and weights, and the previous and current values."""
+    if nchannels < 1:
+        raise ValueError("# of channels should be >= 1")
+    check_fragment(fragment, width, nchannels)
+    if weightA < 1 or weightB < 0:
+        raise ValueError("weightA should be >= 1, weightB should be >= 0")
+    if inrate <= 0 or outrate <= 0:
+        raise ValueError("sampling rate not > 0")
+    divisor = math.gcd(inrate, outrate)
+    inrate //= divisor
+    outrate //= divisor
+    divisor = math.gcd(weightA, weightB)
+    weightA //= divisor
+    weightB //= divisor
+    if state is None:
+        return -outrate, inrate, outrate, weightA, weightB, [0] * nchannels, [0] * nchannels
+    d, samples = state
+    if len(samples) != nchannels:
+        raise ValueError("illegal state argument")
+    return d, inrate, outrate, weightA, weightB, [s[0] for s in samples], [s[1] for s in samples]
+
+
+backends = {"array": ArrayBackend()}     # type: Dict[str, KernelBackend]
+if numpy:
+    backends["numpy"] = NumpyBackend()
+if audioop:
+    backends["audioop"] = AudioopBackend()
+
+current = None      # type: Optional[KernelBackend]
+
+
+def benchmark(backend: KernelBackend, num_frames: int = 8192) -> float:
+    """The time (in seconds) the backend takes for a mix of common operations on a 16 bits stereo fragment."""
+    fragment = bytes(range(256)) * (num_frames * 4 // 256)
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        mono = backend.tomono(fragment, 2, 0.5, 0.5)
+        backend.tostereo(mono, 2, 1.0, 0.5)
+        backend.add(fragment, backend.mul(fragment, 2, 0.8), 2)
+        backend.lin2lin(fragment, 2, 4)
+        backend.max(fragment, 2)
+        backend.rms(fragment, 2)
+        backend.ratecv(fragment, 2, 2, 44100, 22050, None)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def select(name: str = "auto") -> KernelBackend:
+    """
+    Selects the kernel backend to use: 'audioop', 'numpy', 'array', or 'auto' to pick the fastest one
+    (by a short benchmark; the slow 'array' backend is only used if it's the only one available).
+    """
+    global current
+    if name == "auto":
+        candidates = [backend for backend in backends.values() if backend.name != "array"] or [backends["array"]]
+        current = min(candidates, key=benchmark) if len(candidates) > 1 else candidates[0]
+    elif name in backends:
+        current = backends[name]
+    else:
+        raise ValueError("kernel backend not available: " + name)
+    return current
+
+
+def backend() -> KernelBackend:
+    """The current kernel backend (selected via params.dsp_kernels on first use)."""
+    return current or select(params.dsp_kernels)
+
+
+def add(fragment1: Fragment, fragment2: Fragment, width: int) -> bytes:
+    return backend().add(fragment1, fragment2, width)
+
+
+def mul(fragment: Fragment, width: int, factor: float) -> bytes:
+    return backend().mul(fragment, width, factor)
+
+
+def bias(fragment: Fragment, width: int, bias: int) -> bytes:
+    return backend().bias(fragment, width, bias)
+
+
+def max(fragment: Fragment, width: int) -> int:
+    return backend().max(fragment, width)
+
+
+def rms(fragment: Fragment, width: int) -> int:
+    return backend().rms(fragment, width)
+
+
+def tomono(fragment: Fragment, width: int, lfactor: float, rfactor: float) -> bytes:
+    return backend().tomono(fragment, width, lfactor, rfactor)
+
+
+def tostereo(fragment: Fragment, width: int, lfactor: float, rfactor: float) -> bytes:
+    return backend().tostereo(fragment, width, lfactor, rfactor)
+
+
+def lin2lin(fragment: Fragment, width: int, newwidth: int) -> bytes:
+    return backend().lin2lin(fragment, width, newwidth)
+
+
+def ratecv(fragment: Fragment, width: int, nchannels: int, inrate: int, outrate: int,
+           state: Optional[RatecvState], weightA: int = 1, weightB: int = 0) -> Tuple[bytes, RatecvState]:
+    return backend().ratecv(fragment, width, nchannels, inrate, outrate, state, weightA, weightB)
+
+
+def reverse(fragment: Fragment, width: int) -> bytes:
+    return backend().reverse(fragment, width)
+
+
+def byteswap(fragment: Fragment, width: int) -> bytes:
+    return backend().byteswap(fragment, width)
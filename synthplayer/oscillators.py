@@ -6,20 +6,29 @@ Creates various waveforms with adjustable parameters.
 Written by Irmen de Jong (irmen@razorvine.net) - License: GNU LGPL 3.
 """
 
+import array
+import bisect
+import collections
+import copy
 import itertools
 from math import pi, sin, cos, log, fabs, floor, sqrt
 import sys
 import random
-from typing import Generator, List, Sequence, Optional, Tuple, Iterator
+from typing import Generator, List, Sequence, Optional, Tuple, Iterator, Iterable, Union, Dict, Any
 from abc import abstractmethod, ABC
 from . import params
+try:
+    import numpy
+except ImportError:
+    numpy = None        # type: ignore
 
 
-__all__ = ["Oscillator", "OscillatorFromSingleSamples", "Filter", "Sine", "Triangle", "Square",
+__all__ = ["Oscillator", "BlockRenderer", "OscillatorFromSingleSamples", "Filter", "Sine", "Triangle", "Square",
            "SquareH", "Sawtooth", "SawtoothH", "Pulse", "Harmonics", "WhiteNoise", "Linear", "Semicircle", "Pointy",
-           "FastSine", "FastPulse", "FastTriangle", "FastSawtooth", "FastSquare", "FastSemicircle", "FastPointy",
-           "EnvelopeFilter", "MixingFilter", "AmpModulationFilter", "DelayFilter", "EchoFilter",
-           "ClipFilter", "AbsFilter", "NullFilter"]
+           "FastSine", "FastPulse", "FastTriangle", "FastSawtooth", "FastSquare", "FastSemicircle", "FastPointy", "Wavetable",
+           "EnvelopeFilter", "EnvelopeGains", "MixingFilter", "AmpModulationFilter", "DelayLine", "DelayFilter", "EchoFilter",
+           "ClipFilter", "AbsFilter", "NullFilter", "ControlRateFilter", "BroadcastFilter",
+           "BiquadFilter", "Biquad", "biquad_coefficients"]
 
 
 class Oscillator(ABC):
@@ -36,14 +45,148 @@ class Oscillator(ABC):
     rather than single individual values. When running this code using Pypy this
     results in a really big speedup. Also, usually, its not single values we're interested in,
     but rather a waveform.
+    If numpy is available, most oscillators compute their blocks with a vectorized engine instead,
+    which is a lot faster on CPython (see params.oscillators_use_numpy).
+    Instead of getting new lists of values from blocks(), you can also let the oscillator
+    write its values into a buffer that you provide and reuse, via render_into().
+    With blocks_from() the waveform starts at a later time instead of at the beginning.
     """
     def __init__(self, samplerate: int = 0) -> None:
         self.samplerate = samplerate or params.norm_samplerate
+        self._blocksize = 0
+        self._renderer = None   # type: Optional[BlockRenderer]
 
     @abstractmethod
     def blocks(self) -> Generator[List[float], None, None]:
         pass
 
+    @property
+    def blocksize(self) -> int:
+        """
+        The number of values in a block (params.norm_osc_blocksize if not set).
+        Setting it also sets it for all the inputs of this oscillator (its sources and LFOs),
+        so the whole oscillator graph uses the same block size. Set it before generating any blocks.
+        """
+        return self._blocksize or params.norm_osc_blocksize
+
+    @blocksize.setter
+    def blocksize(self, blocksize: int) -> None:
+        assert blocksize > 0
+        self._blocksize = blocksize
+        for osc in self.inputs():
+            osc.blocksize = blocksize
+
+    def inputs(self) -> List['Oscillator']:
+        """The oscillators that are used as input for this oscillator (such as its LFOs)."""
+        lfos = [getattr(self, name, None) for name in ("_fm_lfo", "_pwm_lfo", "_morph_lfo")]
+        return [lfo for lfo in lfos if lfo]
+
+    def blocks_from(self, start_time: float) -> Generator[List[float], None, None]:
+        """
+        Like blocks(), but the waveform starts at the given time (in seconds) instead of at the beginning.
+        Oscillators without modulation compute their phase at that time directly, and filters pass
+        the time on to their sources. Only where that is not possible, the values before it are generated and skipped.
+        """
+        return self._blocks_from(int(round(start_time*self.samplerate)))
+
+    def _blocks_from(self, samples: int) -> Generator[List[float], None, None]:
+        """blocks() starting at the given sample number (see blocks_from)"""
+        if samples <= 0:
+            return self.blocks()
+        frequency = getattr(self, "frequency", getattr(self, "_frequency", None))
+        if frequency is not None and hasattr(self, "_phase") and not self.inputs():
+            # not modulated: the phase at any time follows directly from the frequency
+            osc = copy.copy(self)
+            osc._phase = (self._phase + samples*frequency/self.samplerate) % 1.0     # type: ignore
+            return osc.blocks()
+        return skip_values(self.blocks(), samples, self.blocksize)
+
+    def constant_blocks(self, value: float) -> Generator[List[float], None, None]:
+        """Blocks of a constant value, used in place of an absent LFO."""
+        while True:
+            yield [value] * self.blocksize
+
+    def render_into(self, buffer: Any) -> int:
+        """
+        Writes the next values of the oscillator into the buffer, and returns the number of values written.
+        This is less than the size of the buffer only when the oscillator has ended.
+        Every call continues where the previous one left off. (See BlockRenderer)
+        """
+        if self._renderer is None:
+            self._renderer = BlockRenderer(self, len(buffer))
+        return self._renderer.render_into(buffer)
+
+    def at_samplerate(self, samplerate: int, _copies: Optional[Dict[int, 'Oscillator']] = None) -> 'Oscillator':
+        """
+        Returns a copy of the oscillator that runs at another sample rate, together with copies of all of its inputs
+        (its sources and LFOs), so the oscillator itself is left untouched. Inputs that are used more than once
+        in the oscillator graph are copied only once. The copy starts at the beginning, like blocks() does.
+        """
+        copies = {} if _copies is None else _copies
+        if id(self) in copies:
+            return copies[id(self)]
+        osc = copy.copy(self)
+        copies[id(self)] = osc
+        for name, value in list(vars(osc).items()):
+            if isinstance(value, Oscillator):
+                setattr(osc, name, value.at_samplerate(samplerate, copies))
+            elif isinstance(value, (list, tuple)) and value and all(isinstance(v, Oscillator) for v in value):
+                setattr(osc, name, type(value)(v.at_samplerate(samplerate, copies) for v in value))
+        osc.samplerate = samplerate
+        osc._renderer = None
+        # the block generators of the LFOs are created in __init__, so they must be recreated for the copied LFOs,
+        # and the constant ones in place of an absent LFO must follow the blocksize of the copy instead of the original
+        for generator, lfo in (("fm", "_fm_lfo"), ("pwm", "_pwm_lfo"), ("morph", "_morph_lfo"), ("modulator", "_modulator")):
+            if getattr(osc, lfo, None) is not None and hasattr(osc, generator):
+                setattr(osc, generator, getattr(osc, lfo).blocks())
+            elif generator == "fm" and hasattr(osc, "fm"):
+                osc.fm = osc.constant_blocks(0.0)      # type: ignore
+            elif generator == "pwm" and hasattr(osc, "pwm"):
+                osc.pwm = osc.constant_blocks(osc.pulsewidth)      # type: ignore
+        return osc
+
+
+class BlockRenderer:
+    """
+    Renders the values of an oscillator into buffers provided by the caller, so they can be reused:
+    an array.array('d'), a numpy float64 array, or a writable memoryview on one of those.
+    With the numpy engine the oscillator is evaluated via a compiled plan (see the graph module),
+    so no lists are created at all. Otherwise the values come from the oscillator's blocks().
+    """
+    def __init__(self, oscillator: Oscillator, blocksize: int = 0) -> None:
+        self.oscillator = oscillator
+        self.blocksize = blocksize or params.norm_osc_blocksize
+        self._blocks = None     # type: Any
+        self._pending = None    # type: Optional[Sequence[float]]
+        self._pending_offset = 0
+
+    def render_into(self, buffer: Any) -> int:
+        """Writes the next values into the buffer, returns how many were written (0 means the oscillator has ended)."""
+        if self._blocks is None:
+            if use_numpy_engine():
+                from .graph import compile_node
+                self._blocks = compile_node(self.oscillator, self.blocksize).render_blocks()
+            else:
+                self._blocks = self.oscillator.blocks()
+        if numpy is not None and not isinstance(buffer, numpy.ndarray):
+            buffer = numpy.frombuffer(buffer, dtype=numpy.float64)
+        size = len(buffer)
+        count = 0
+        while count < size:
+            if self._pending is None:
+                self._pending = next(self._blocks, None)
+                self._pending_offset = 0
+                if self._pending is None:
+                    break
+            amount = min(size - count, len(self._pending) - self._pending_offset)
+            values = self._pending[self._pending_offset:self._pending_offset+amount]
+            buffer[count:count+amount] = values if numpy is not None else array.array('d', values)
+            count += amount
+            self._pending_offset += amount
+            if self._pending_offset >= len(self._pending):
+                self._pending = None
+        return count
+
 
 class OscillatorFromSingleSamples(Oscillator):
     """
@@ -56,7 +199,7 @@ class OscillatorFromSingleSamples(Oscillator):
 
     def blocks(self) -> Generator[List[float], None, None]:
         while True:
-            block = list(itertools.islice(self.sample_source, params.norm_osc_blocksize))
+            block = list(itertools.islice(self.sample_source, self.blocksize))
             if block:
                 yield block
             else:
@@ -67,6 +210,24 @@ class Filter(Oscillator, ABC):
     def __init__(self, sources: Sequence[Oscillator]) -> None:
         super().__init__(sources[0].samplerate if sources else 0)
         self.sources = sources
+        self._start = 0     # sample number where the sources start (see blocks_from)
+
+    def source_blocks(self, index: int = 0) -> Generator[List[float], None, None]:
+        return self.sources[index]._blocks_from(self._start)
+
+    def _sample_wise_blocks_from(self, samples: int) -> Generator[List[float], None, None]:
+        """
+        blocks() starting at the given sample number, for filters that compute each value from
+        the values of their sources at the same moment: it's enough to start the sources there as well.
+        """
+        if samples <= 0:
+            return self.blocks()
+        osc = copy.copy(self)
+        osc._start = self._start + samples
+        return osc.blocks()
+
+    def inputs(self) -> List[Oscillator]:
+        return list(self.sources) + super().inputs()
 
 
 class EnvelopeFilter(Filter):
@@ -87,94 +248,287 @@ class EnvelopeFilter(Filter):
         self._stop_at_end = stop_at_end
 
     def blocks(self) -> Generator[List[float], None, None]:
-        src = self.single_samples()
-        try:
-            while True:
-                v = list(itertools.islice(src, params.norm_osc_blocksize))
-                if not v:
-                    return
-                yield v
-        except StopIteration:
-            return
+        numpy_engine = use_numpy_engine()
+        gains = EnvelopeGains(self.segments(), self._start, numpy_engine)
+        for block in self.source_blocks():
+            block_gains = gains.next(len(block))
+            size = len(block_gains)
+            if size:
+                if numpy_engine:
+                    values = numpy.multiply(block[:size], block_gains).tolist()
+                else:
+                    values = [v*g for v, g in zip(block, block_gains)]
+            if size < len(block):
+                # the envelope has ended somewhere in this block
+                if size:
+                    yield values if self._stop_at_end else values + [0.0]*(self.blocksize-size)
+                if not self._stop_at_end:
+                    while True:
+                        yield [0.0]*self.blocksize
+                return
+            yield values
 
-    def samples_from_source(self) -> Generator[float, None, None]:
-        try:
-            blocks = self.sources[0].blocks()
-            while True:
-                yield from next(blocks)
-        except StopIteration:
-            return
+    def _blocks_from(self, samples: int) -> Generator[List[float], None, None]:
+        return self._sample_wise_blocks_from(samples)
 
-    def single_samples(self) -> Generator[float, None, None]:
-        oscillator = self.samples_from_source()
-        time = 0.0
+    def segments(self) -> List[Tuple[int, int, float, float]]:
+        """
+        The ADSR segments of the envelope, as (first sample number, number of samples, start amplitude,
+        amplitude change per sample) tuples. The number of samples in a segment is counted with the same
+        repeated time additions as a per-sample loop, so the segment boundaries are exactly the same.
+        """
+        increment = 1/self.samplerate
         end_time_decay = self._attack + self._decay
         end_time_sustain = end_time_decay + self._sustain
         end_time_release = end_time_sustain + self._release
-        increment = 1/self.samplerate
-        if self._attack:
-            amp_change = 1.0/self._attack*increment
-            amp = 0.0
-            while time < self._attack:
-                yield next(oscillator)*amp
-                amp += amp_change
-                time += increment
+        segments = []   # type: List[Tuple[int, int, float, float]]
+        position = 0
+        time = 0.0
+
+        def segment(end_time: float, amp: float, amp_change: float) -> int:
+            nonlocal position, time
+            count, time = self._count_samples(time, end_time, increment)
+            if count:
+                segments.append((position, count, amp, amp_change))
+                position += count
+            return count
+
+        segment(self._attack, 0.0, 1.0/self._attack*increment if self._attack else 0.0)
         if self._decay:
-            amp = 1.0
-            amp_change = (self._sustain_level-1.0)/self._decay*increment
-            while time < end_time_decay:
-                yield next(oscillator)*amp
-                amp += amp_change
-                time += increment
-        while time < end_time_sustain:
-            yield next(oscillator)*self._sustain_level
-            time += increment
+            segment(end_time_decay, 1.0, (self._sustain_level-1.0)/self._decay*increment)
+        segment(end_time_sustain, self._sustain_level, 0.0)
         if self._release:
-            amp = self._sustain_level
             amp_change = (-self._sustain_level)/self._release*increment
-            while time < end_time_release:
-                yield next(oscillator)*amp
-                amp += amp_change
-                time += increment
+            count = segment(end_time_release, self._sustain_level, amp_change)
+            amp = self._sustain_level
+            while count > 0:
+                _, amp = EnvelopeGains.ramp(amp, amp_change, min(count, 4096), False)
+                count -= 4096
             if amp > 0.0:
-                yield next(oscillator)*amp
-        if not self._stop_at_end:
-            yield from itertools.repeat(0.0)
+                # only if the amplitude is still above zero, one more sample is produced
+                segments.append((position, 1, amp, 0.0))
+        return segments
+
+    @staticmethod
+    def _count_samples(time: float, end_time: float, increment: float) -> Tuple[int, float]:
+        """
+        How many samples (times incremented by increment) are there before end_time is reached?
+        Returns this count and the time after the last sample.
+        """
+        count = 0
+        while time < end_time:
+            if numpy is not None:
+                times, _ = EnvelopeGains.ramp(time, increment, 65536, True)
+                num_below = int(numpy.searchsorted(times, end_time))
+            else:
+                times, _ = EnvelopeGains.ramp(time, increment, 4096, False)
+                num_below = bisect.bisect_left(times, end_time)
+            count += num_below
+            if num_below < len(times):
+                return count, times[num_below]
+            time = times[-1] + increment
+        return count, time
+
+
+class EnvelopeGains:
+    """
+    The amplitude factors of an envelope (given as its segments, see EnvelopeFilter.segments),
+    block after block from the given sample number on. The ramps are computed with the same
+    repeated additions as a per-sample loop, so the values are exactly the same.
+    """
+    def __init__(self, segments: List[Tuple[int, int, float, float]], position: int = 0, use_numpy: bool = False) -> None:
+        self.segments = segments
+        self.end = segments[-1][0] + segments[-1][1] if segments else 0
+        self.use_numpy = use_numpy
+        self.index = 0
+        self.amp = segments[0][2] if segments else 0.0
+        self.position = 0
+        while position > self.position and self.position < self.end:
+            self.next(min(position - self.position, 65536))
+        self.position = max(self.position, position)
+
+    def next(self, size: int) -> Any:
+        """The gains for the next size samples (fewer if the envelope ends), as a numpy array or a list."""
+        parts = []     # type: List[Any]
+        size = max(0, min(size, self.end - self.position))
+        while size > 0:
+            start, count, _, amp_change = self.segments[self.index]
+            length = min(size, start + count - self.position)
+            if amp_change:
+                gains, self.amp = self.ramp(self.amp, amp_change, length, self.use_numpy)
+            else:
+                gains = numpy.full(length, self.amp) if self.use_numpy else [self.amp] * length
+            parts.append(gains)
+            self.position += length
+            size -= length
+            if self.position == start + count:
+                self.index += 1
+                if self.index < len(self.segments):
+                    self.amp = self.segments[self.index][2]
+        if self.use_numpy:
+            return numpy.concatenate(parts) if parts else numpy.empty(0)
+        return list(itertools.chain.from_iterable(parts))
+
+    @staticmethod
+    def ramp(amp: float, amp_change: float, count: int, use_numpy: bool) -> Tuple[Any, float]:
+        """amp, amp+amp_change, amp+amp_change+amp_change, ... (count values), and the amplitude after them."""
+        if use_numpy:
+            gains = numpy.full(count, amp_change)
+            gains[0] = amp
+            numpy.cumsum(gains, out=gains)
+            return gains, float(gains[-1]) + amp_change
+        ramp = list(itertools.accumulate(itertools.chain([amp], itertools.repeat(amp_change, count-1))))
+        return ramp, ramp[-1] + amp_change
 
 
 class MixingFilter(Filter):
-    """Mixes (adds) the wave from various sources together into one output wave."""
-    def __init__(self, *sources: Oscillator) -> None:
+    """
+    Mixes (adds) the wave from various sources together into one output wave.
+    Optionally every source can have its own gain (amplitude factor) in the mix.
+    """
+    def __init__(self, *sources: Oscillator, gains: Optional[Sequence[float]] = None) -> None:
         super().__init__(sources)
+        if gains is not None and len(gains) != len(sources):
+            raise ValueError("there must be a gain for every source")
+        self.gains = gains
 
     def blocks(self) -> Generator[List[float], None, None]:
-        sources = [src.blocks() for src in self.sources]
-        source_blocks = itertools.zip_longest(*sources, fillvalue=[0.0]*params.norm_osc_blocksize)
+        if use_numpy_engine():
+            yield from self.numpy_blocks()
+            return
+        sources = [self.source_blocks(i) for i in range(len(self.sources))]
+        source_blocks = itertools.zip_longest(*sources, fillvalue=[0.0]*self.blocksize)
+        gains = self.gains
         try:
             while True:
                 blocks = next(source_blocks)
-                yield [sum(v) for v in zip(*blocks)]
+                if gains:
+                    yield [sum(v*g for v, g in zip(values, gains)) for values in zip(*blocks)]
+                else:
+                    yield [sum(v) for v in zip(*blocks)]
         except StopIteration:
             return
 
+    def numpy_blocks(self) -> Generator[List[float], None, None]:
+        sources = [self.source_blocks(i) for i in range(len(self.sources))]    # type: List[Optional[Generator[List[float], None, None]]]
+        gains = numpy.array(self.gains if self.gains else [1.0] * len(sources))
+        while True:
+            blocks = []
+            active = []
+            for i, source in enumerate(sources):
+                if source:
+                    block = next(source, None)
+                    if block is None:
+                        sources[i] = None
+                    else:
+                        blocks.append(block)
+                        active.append(i)
+            if not blocks:
+                return
+            size = min(len(b) for b in blocks)
+            if len(blocks) < len(sources):
+                # sources that have ended contribute blocks of silence
+                size = min(size, self.blocksize)
+            blocks = [b[:size] for b in blocks] if any(len(b) > size for b in blocks) else blocks
+            if self.gains:
+                yield gains[active].dot(blocks).tolist()
+            else:
+                yield numpy.sum(blocks, axis=0).tolist()
+
+    def _blocks_from(self, samples: int) -> Generator[List[float], None, None]:
+        return self._sample_wise_blocks_from(samples)
+
 
 class AmpModulationFilter(Filter):
     """Modulate the amplitude of the wave of the oscillator by another oscillator (the modulator)."""
     def __init__(self, source: Oscillator, modulator: Oscillator) -> None:
         assert isinstance(source, Oscillator)
         super().__init__([source])
+        self._modulator = modulator
         self.modulator = modulator.blocks()
 
+    def inputs(self) -> List[Oscillator]:
+        return super().inputs() + [self._modulator]
+
     def blocks(self) -> Generator[List[float], None, None]:
-        source_blocks = self.sources[0].blocks()
+        source_blocks = self.source_blocks()
+        numpy_engine = use_numpy_engine()
         try:
             while True:
                 block = next(source_blocks)
                 amp = next(self.modulator)
-                yield [v*a for (v, a) in zip(block, amp)]
+                if numpy_engine:
+                    size = min(len(block), len(amp))
+                    yield numpy.multiply(block[:size], amp[:size]).tolist()
+                else:
+                    yield [v*a for (v, a) in zip(block, amp)]
         except StopIteration:
             return
 
+    def _blocks_from(self, samples: int) -> Generator[List[float], None, None]:
+        if samples <= 0:
+            return self.blocks()
+        osc = copy.copy(self)
+        osc._start = self._start + samples
+        osc.modulator = self._modulator._blocks_from(samples)
+        return osc.blocks()
+
+
+class DelayLine:
+    """
+    Fixed size circular buffer that remembers the most recent samples written to it,
+    to read delayed copies of that signal from (via one or more taps).
+    The memory it uses is bounded by the longest delay (plus one block).
+    """
+    def __init__(self, max_delay: int, blocksize: int = 0) -> None:
+        assert max_delay >= 0
+        self.size = max_delay + (blocksize or params.norm_osc_blocksize)
+        if use_numpy_engine():
+            self.buffer = numpy.zeros(self.size)    # type: Any
+        else:
+            self.buffer = [0.0] * self.size
+        self.position = 0
+
+    def write(self, block: Sequence[float]) -> None:
+        """Writes a block of samples into the delay line, overwriting the oldest ones."""
+        length = len(block)
+        assert length <= self.size
+        first = min(length, self.size - self.position)
+        self.buffer[self.position:self.position+first] = block[:first]
+        if first < length:
+            self.buffer[:length-first] = block[first:]
+        self.position = (self.position + length) % self.size
+
+    def read(self, delay: int, length: int) -> List[float]:
+        """Returns the last 'length' samples that were written, delayed by 'delay' samples."""
+        assert 0 <= delay and delay + length <= self.size
+        start = (self.position - length - delay) % self.size
+        end = start + length
+        if end <= self.size:
+            values = self.buffer[start:end]
+        elif numpy is not None and isinstance(self.buffer, numpy.ndarray):
+            values = numpy.concatenate((self.buffer[start:], self.buffer[:end-self.size]))
+        else:
+            values = self.buffer[start:] + self.buffer[:end-self.size]
+        return values if isinstance(values, list) else values.tolist()
+
+    def read_taps(self, taps: Sequence[Tuple[int, float]], length: int) -> List[float]:
+        """
+        Returns the last 'length' samples that were written, as a mix of delayed copies.
+        Every tap is a (delay, amplitude factor) tuple. All taps are read from the same buffer.
+        """
+        if isinstance(self.buffer, list):
+            result = [0.0] * length
+            for delay, amp in taps:
+                result = [r + v*amp for r, v in zip(result, self.read(delay, length))]
+            return result
+        delays = numpy.array([delay for delay, _ in taps], dtype=numpy.int64)
+        amps = numpy.array([amp for _, amp in taps])
+        assert delays.min() >= 0 and delays.max() + length <= self.size
+        starts = (self.position - length - delays) % self.size
+        indices = (starts.reshape(-1, 1) + numpy.arange(length)) % self.size
+        return amps.dot(self.buffer[indices]).tolist()
+
 
 class DelayFilter(Filter):
     """
@@ -188,33 +542,29 @@ class DelayFilter(Filter):
         self._seconds = seconds
 
     def blocks(self) -> Generator[List[float], None, None]:
-        blocks = self.sources[0].blocks()
-        if self._seconds == 0.0:
-            yield from blocks
-            return
-        elif self._seconds > 0.0:
-            amount = int(self.samplerate * self._seconds)
-            while amount >= params.norm_osc_blocksize:
-                yield [0.0] * params.norm_osc_blocksize
-                amount -= params.norm_osc_blocksize
-            if amount == 0:
-                yield from blocks
-            residue = [0.0] * amount
-        else:
-            amount = -int(self.samplerate * self._seconds)
-            while amount >= params.norm_osc_blocksize:
-                next(blocks)
-                amount -= params.norm_osc_blocksize
-            if amount == 0:
-                yield from blocks
-            residue = next(blocks)[:amount]
-        try:
-            while True:
-                sample_block = next(blocks)
-                yield residue + sample_block[:-len(residue)]
-                residue = sample_block[-len(residue):]
-        except StopIteration:
-            yield residue + [0.0] * (params.norm_osc_blocksize-len(residue))
+        return self._blocks_from(0)
+
+    def _blocks_from(self, samples: int) -> Generator[List[float], None, None]:
+        delay = int(self.samplerate * abs(self._seconds))
+        if self._seconds < 0.0:
+            delay = -delay
+        # skipping ahead (or past the delay) is the same as starting the source later
+        if samples >= delay:
+            return self.sources[0]._blocks_from(samples - delay)
+        return self.delayed_blocks(self.sources[0].blocks(), delay - samples)
+
+    def delayed_blocks(self, blocks: Iterator[List[float]], delay: int) -> Generator[List[float], None, None]:
+        delay_line = DelayLine(delay, self.blocksize)
+        for block in blocks:
+            delay_line.write(block)
+            yield delay_line.read(delay, len(block))
+        # flush the samples that are still in the delay line
+        remaining = delay
+        while remaining > 0:
+            length = min(remaining, self.blocksize)
+            delay_line.write([0.0] * length)
+            yield delay_line.read(delay, length)
+            remaining -= length
 
 
 class EchoFilter(Filter):
@@ -235,47 +585,35 @@ class EchoFilter(Filter):
         self._decay = amp_factor
         self.echo_duration = self._after + self._amount*self._delay
 
-    def blocks(self) -> Generator[List[float], None, None]:
-        src = self.single_samples()
-        try:
-            while True:
-                v = list(itertools.islice(src, params.norm_osc_blocksize))
-                if not v:
-                    return
-                yield v
-        except StopIteration:
-            return
-
-    def samples_from_source(self) -> Generator[float, None, None]:
-        try:
-            blks = self.sources[0].blocks()
-            while True:
-                yield from next(blks)
-        except StopIteration:
-            return
-
-    def single_samples(self) -> Generator[float, None, None]:
-        # first play the first part normally until the echos start
-        source_samples = self.samples_from_source()
-        yield from itertools.islice(source_samples, int(self.samplerate * self._after))
-        # now start mixing the echos
+    def taps(self) -> List[Tuple[int, float]]:
+        """The (delay in samples, amplitude factor) of the source itself and every echo."""
+        taps = [(0, 1.0)]
         amp = self._decay
-        echo_oscs = [OscillatorFromSingleSamples(src) for src in itertools.tee(source_samples, self._amount+1)]     # type: List[Oscillator]
-        echos = [echo_oscs[0]]
         echo_delay = self._delay
-        for echo in echo_oscs[1:]:
-            echo2 = AmpModulationFilter(DelayFilter(echo, echo_delay), Linear(amp))
-            # @todo sometimes mixing the echos causes pops and clicks. Perhaps solvable by using a (very fast) fadein on the echo osc?
-            echos.append(echo2)
+        for _ in range(self._amount):
+            taps.append((int(self.samplerate * echo_delay), amp))
             echo_delay += self._delay
             amp *= self._decay
-        echo_blocks = [echo.blocks() for echo in echos]
-        try:
-            while True:
-                blocks = [next(echoblock) for echoblock in echo_blocks]
-                yield from [sum(x) for x in zip(*blocks)]
-        except StopIteration:
-            return
+        return taps
+
+    def blocks(self) -> Generator[List[float], None, None]:
+        # first play the first part normally until the echos start,
+        # after that, all echos are read from a single delay line.
+        # @todo sometimes mixing the echos causes pops and clicks. Perhaps solvable by using a (very fast) fadein on the echo osc?
+        taps = self.taps()
+        delay_line = DelayLine(max(delay for delay, _ in taps), self.blocksize)
+        before_echos = int(self.samplerate * self._after)
+        for block in self.sources[0].blocks():
+            if before_echos >= len(block):
+                before_echos -= len(block)
+                yield block
+                continue
+            first_part = block[:before_echos]
+            block = block[before_echos:]
+            before_echos = 0
+            delay_line.write(block)
+            echoed = delay_line.read_taps(taps, len(block))
+            yield first_part + echoed if first_part else echoed
 
 
 class ClipFilter(Filter):
@@ -287,12 +625,19 @@ class ClipFilter(Filter):
         self.max = maximum
 
     def blocks(self) -> Generator[List[float], None, None]:
+        numpy_engine = use_numpy_engine()
         try:
-            for block in self.sources[0].blocks():
-                yield [max(min(v, self.max), self.min) for v in block]
+            for block in self.source_blocks():
+                if numpy_engine:
+                    yield numpy.maximum(numpy.minimum(block, self.max), self.min).tolist()
+                else:
+                    yield [max(min(v, self.max), self.min) for v in block]
         except StopIteration:
             return
 
+    def _blocks_from(self, samples: int) -> Generator[List[float], None, None]:
+        return self._sample_wise_blocks_from(samples)
+
 
 class AbsFilter(Filter):
     """Returns the absolute value of the samples from the source oscillator."""
@@ -301,12 +646,195 @@ class AbsFilter(Filter):
         super().__init__([source])
 
     def blocks(self) -> Generator[List[float], None, None]:
+        numpy_engine = use_numpy_engine()
         try:
-            for block in self.sources[0].blocks():
-                yield [fabs(v) for v in block]
+            for block in self.source_blocks():
+                if numpy_engine:
+                    yield numpy.fabs(block).tolist()
+                else:
+                    yield [fabs(v) for v in block]
         except StopIteration:
             return
 
+    def _blocks_from(self, samples: int) -> Generator[List[float], None, None]:
+        return self._sample_wise_blocks_from(samples)
+
+
+class BiquadFilter(Filter):
+    """
+    Biquad (second order IIR) filter: 'lowpass', 'highpass', 'bandpass', 'notch', 'peaking', 'lowshelf' or 'highshelf'.
+    The q determines the resonance (or the bandwidth), gain_db is only used by the peaking and shelving filters.
+    The cutoff frequency can be modulated by the cutoff_lfo (cutoff*(1+lfo), just like FM); the filter
+    coefficients are then recomputed once every control_rate samples.
+    """
+    def __init__(self, source: Oscillator, filter_type: str = "lowpass", cutoff: float = 1000.0, q: float = 0.7071,
+                 gain_db: float = 0.0, cutoff_lfo: Optional[Oscillator] = None, control_rate: int = 32) -> None:
+        assert isinstance(source, Oscillator)
+        if filter_type not in biquad_filter_types:
+            raise ValueError("invalid filter type")
+        assert q > 0 and control_rate >= 1
+        super().__init__([source])
+        self.filter_type = filter_type
+        self.cutoff = cutoff
+        self.q = q
+        self.gain_db = gain_db
+        self.control_rate = control_rate
+        self._cutoff_lfo = cutoff_lfo
+
+    def inputs(self) -> List[Oscillator]:
+        return super().inputs() + ([self._cutoff_lfo] if self._cutoff_lfo else [])
+
+    def coefficients(self, cutoff: float) -> Tuple[float, float, float, float, float]:
+        # keep the cutoff frequency within the range the filter can handle
+        cutoff = min(max(cutoff, 1.0), self.samplerate*0.49)
+        return biquad_coefficients(self.filter_type, cutoff, self.samplerate, self.q, self.gain_db)
+
+    def blocks(self) -> Generator[List[float], None, None]:
+        biquad = Biquad()
+        if not self._cutoff_lfo:
+            coefficients = self.coefficients(self.cutoff)
+            numpy_engine = use_numpy_engine()
+            for block in self.source_blocks():
+                if numpy_engine and len(block) >= 2*biquad.subblock:
+                    yield biquad.process_numpy(block, coefficients).tolist()
+                else:
+                    yield biquad.process(block, coefficients)
+            return
+        # with a modulated cutoff the coefficients change every control_rate values, that's too few for process_numpy
+        cutoff_blocks = self._cutoff_lfo.blocks()
+        control_rate = self.control_rate
+        for block in self.source_blocks():
+            cutoff_block = next(cutoff_blocks, None)
+            if cutoff_block is None:
+                return
+            filtered = []   # type: List[float]
+            for i in range(0, len(block), control_rate):
+                coefficients = self.coefficients(self.cutoff*(1.0+cutoff_block[min(i, len(cutoff_block)-1)]))
+                filtered.extend(biquad.process(block[i:i+control_rate], coefficients))
+            yield filtered
+
+
+class Biquad:
+    """
+    The state of a biquad filter (in transposed direct form II), so a signal can be filtered in consecutive blocks.
+    Numpy has no recursive filter operation, so process() handles the values in a single tight loop.
+    process_numpy() splits the values in sub blocks instead: the response within the sub blocks is computed
+    with matrix products, only the filter state is carried from one sub block to the next in a loop.
+    """
+    subblock = 64
+
+    def __init__(self) -> None:
+        self.z1 = self.z2 = 0.0
+        self._matrices = None   # type: Any
+        self._matrices_coefficients = None  # type: Optional[Tuple[float, float, float, float, float]]
+
+    def process(self, values: Iterable[float], coefficients: Tuple[float, float, float, float, float]) -> List[float]:
+        """Filters the values with the given coefficients (see biquad_coefficients)."""
+        b0, b1, b2, a1, a2 = coefficients
+        z1, z2 = self.z1, self.z2
+        result = []     # type: List[float]
+        append = result.append   # optimization
+        for x in values:
+            y = b0*x + z1
+            z1 = b1*x - a1*y + z2
+            z2 = b2*x - a2*y
+            append(y)
+        self.z1, self.z2 = z1, z2
+        return result
+
+    def process_numpy(self, values: Any, coefficients: Tuple[float, float, float, float, float]) -> 'numpy.ndarray':
+        """Like process(), but for a numpy array of values, and it returns a new numpy float64 array."""
+        values = numpy.asarray(values, dtype=numpy.float64)
+        size = self.subblock
+        num_subblocks = len(values) // size
+        if num_subblocks < 2:
+            return numpy.array(self.process(values.tolist(), coefficients))
+        response, input_to_state, state_to_output, transition = self._block_matrices(coefficients)
+        blocks = values[:num_subblocks*size].reshape(num_subblocks, size)
+        inputs = blocks @ input_to_state
+        states = numpy.empty((num_subblocks, 2))
+        t11, t12, t21, t22 = transition
+        z1, z2 = self.z1, self.z2
+        for i, (u1, u2) in enumerate(inputs.tolist()):
+            states[i] = z1, z2
+            z1, z2 = t11*z1 + t12*z2 + u1, t21*z1 + t22*z2 + u2
+        self.z1, self.z2 = z1, z2
+        result = (blocks @ response + states @ state_to_output).reshape(-1)
+        if len(values) > len(result):
+            result = numpy.concatenate((result, self.process(values[len(result):].tolist(), coefficients)))
+        return result
+
+    def _block_matrices(self, coefficients: Tuple[float, float, float, float, float]) -> Tuple[Any, Any, Any, Tuple[float, ...]]:
+        # The filter as a state space system: state' = A*state + B*x, y = C*state + D*x.
+        # For a sub block of n values: the output matrix for the values themselves (with the impulse response),
+        # the matrices from the values and from the initial state to the state and the output after the sub block.
+        if self._matrices_coefficients != coefficients:
+            b0, b1, b2, a1, a2 = coefficients
+            size = self.subblock
+            a = numpy.array([[-a1, 1.0], [-a2, 0.0]])
+            b = numpy.array([b1-a1*b0, b2-a2*b0])
+            powers = [numpy.identity(2)]
+            for _ in range(size):
+                powers.append(a @ powers[-1])
+            impulse = numpy.array([b0] + [(powers[k] @ b)[0] for k in range(size-1)])
+            response = numpy.zeros((size, size))
+            for j in range(size):
+                response[j, j:] = impulse[:size-j]
+            input_to_state = numpy.array([powers[size-1-j] @ b for j in range(size)])
+            state_to_output = numpy.array([powers[k][0] for k in range(size)]).T
+            self._matrices = response, input_to_state, state_to_output, tuple(powers[size].reshape(-1).tolist())
+            self._matrices_coefficients = coefficients
+        return self._matrices
+
+
+biquad_filter_types = ("lowpass", "highpass", "bandpass", "notch", "peaking", "lowshelf", "highshelf")
+
+
+def biquad_coefficients(filter_type: str, frequency: float, samplerate: float,
+                        q: float = 0.7071, gain_db: float = 0.0) -> Tuple[float, float, float, float, float]:
+    """
+    The coefficients (b0, b1, b2, a1, a2) of a biquad filter, normalized so that a0 is 1.
+    See the 'Audio EQ Cookbook' by Robert Bristow-Johnson.
+    """
+    w0 = 2.0*pi*frequency/samplerate
+    cos_w0 = cos(w0)
+    alpha = sin(w0)/(2.0*q)
+    amp = 10.0**(gain_db/40.0)
+    if filter_type == "lowpass":
+        b0, b1, b2 = (1.0-cos_w0)/2.0, 1.0-cos_w0, (1.0-cos_w0)/2.0
+        a0, a1, a2 = 1.0+alpha, -2.0*cos_w0, 1.0-alpha
+    elif filter_type == "highpass":
+        b0, b1, b2 = (1.0+cos_w0)/2.0, -(1.0+cos_w0), (1.0+cos_w0)/2.0
+        a0, a1, a2 = 1.0+alpha, -2.0*cos_w0, 1.0-alpha
+    elif filter_type == "bandpass":
+        b0, b1, b2 = alpha, 0.0, -alpha
+        a0, a1, a2 = 1.0+alpha, -2.0*cos_w0, 1.0-alpha
+    elif filter_type == "notch":
+        b0, b1, b2 = 1.0, -2.0*cos_w0, 1.0
+        a0, a1, a2 = 1.0+alpha, -2.0*cos_w0, 1.0-alpha
+    elif filter_type == "peaking":
+        b0, b1, b2 = 1.0+alpha*amp, -2.0*cos_w0, 1.0-alpha*amp
+        a0, a1, a2 = 1.0+alpha/amp, -2.0*cos_w0, 1.0-alpha/amp
+    elif filter_type == "lowshelf":
+        beta = 2.0*sqrt(amp)*alpha
+        b0 = amp*((amp+1.0)-(amp-1.0)*cos_w0+beta)
+        b1 = 2.0*amp*((amp-1.0)-(amp+1.0)*cos_w0)
+        b2 = amp*((amp+1.0)-(amp-1.0)*cos_w0-beta)
+        a0 = (amp+1.0)+(amp-1.0)*cos_w0+beta
+        a1 = -2.0*((amp-1.0)+(amp+1.0)*cos_w0)
+        a2 = (amp+1.0)+(amp-1.0)*cos_w0-beta
+    elif filter_type == "highshelf":
+        beta = 2.0*sqrt(amp)*alpha
+        b0 = amp*((amp+1.0)+(amp-1.0)*cos_w0+beta)
+        b1 = -2.0*amp*((amp-1.0)+(amp+1.0)*cos_w0)
+        b2 = amp*((amp+1.0)+(amp-1.0)*cos_w0-beta)
+        a0 = (amp+1.0)-(amp-1.0)*cos_w0+beta
+        a1 = 2.0*((amp-1.0)-(amp+1.0)*cos_w0)
+        a2 = (amp+1.0)-(amp-1.0)*cos_w0-beta
+    else:
+        raise ValueError("invalid filter type")
+    return b0/a0, b1/a0, b2/a0, a1/a0, a2/a0
+
 
 class NullFilter(Filter):
     """Wraps a single oscillator but does nothing."""
@@ -317,6 +845,143 @@ class NullFilter(Filter):
     def blocks(self) -> Generator[List[float], None, None]:
         return self.sources[0].blocks()
 
+    def _blocks_from(self, samples: int) -> Generator[List[float], None, None]:
+        return self.sources[0]._blocks_from(samples)
+
+
+class ControlRateFilter(Filter):
+    """
+    Evaluates a (slow) modulator oscillator only once every 'rate' samples, and linearly interpolates
+    between those values to produce the output at the full sample rate. Use it to wrap a LFO
+    (for instance the fm_lfo of Sine or the pwm_lfo of Pulse and FastPulse) to make it a lot cheaper.
+    The filter evaluates a copy of the oscillator (and of its own LFOs) that runs at samplerate/rate,
+    rounded to a whole number, so the oscillator you give it is not changed. (Note that values that are
+    defined per sample rather than per second, such as the increment of Linear, now apply per 'rate' samples.)
+    """
+    def __init__(self, source: Oscillator, rate: int = 16) -> None:
+        assert isinstance(source, Oscillator)
+        assert rate >= 1
+        super().__init__([source])
+        self.rate = rate
+        self.sources = [source.at_samplerate(max(1, int(round(self.samplerate / rate))))]
+
+    def blocks(self) -> Generator[List[float], None, None]:
+        if use_numpy_engine():
+            yield from self.numpy_blocks()
+            return
+        rate = self.rate
+        control_values = itertools.chain.from_iterable(self.sources[0].blocks())
+        previous = next(control_values, None)
+        if previous is None:
+            return
+        block = []  # type: List[float]
+        for value in control_values:
+            step = (value-previous)/rate
+            block.extend([previous + step*i for i in range(rate)])
+            previous = value
+            while len(block) >= self.blocksize:
+                yield block[:self.blocksize]
+                block = block[self.blocksize:]
+        block.append(previous)
+        while block:
+            yield block[:self.blocksize]
+            block = block[self.blocksize:]
+
+    def numpy_blocks(self) -> Generator[List[float], None, None]:
+        ramp = numpy.arange(self.rate, dtype=numpy.float64) / self.rate
+        previous = None     # type: Optional[float]
+        pending = numpy.empty(0)
+        for control_block in self.sources[0].blocks():
+            if previous is None:
+                previous = control_block[0]
+                control_block = control_block[1:]
+                if not control_block:
+                    continue
+            values = numpy.empty(len(control_block) + 1)
+            values[0] = previous
+            values[1:] = control_block
+            previous = control_block[-1]
+            steps = numpy.diff(values)
+            interpolated = (values[:-1, numpy.newaxis] + steps[:, numpy.newaxis] * ramp).ravel()
+            pending = numpy.concatenate((pending, interpolated)) if len(pending) else interpolated
+            offset = 0
+            while len(pending) - offset >= self.blocksize:
+                yield pending[offset:offset+self.blocksize].tolist()
+                offset += self.blocksize
+            pending = pending[offset:]
+        if previous is not None:
+            pending = numpy.append(pending, previous)
+            for offset in range(0, len(pending), self.blocksize):
+                yield pending[offset:offset+self.blocksize].tolist()
+
+
+class BroadcastFilter(Filter):
+    """
+    Shares a single oscillator (usually a LFO) between many consumers. Every call to blocks() returns
+    a new subscriber, but each block of the source is computed only once and the same block (list)
+    is handed to all subscribers, so they must not modify it. New subscribers start at the most recent block.
+    At most max_lag blocks are kept: a subscriber that falls further behind skips ahead to the oldest kept block.
+    """
+    def __init__(self, source: Oscillator, max_lag: int = 16) -> None:
+        assert isinstance(source, Oscillator)
+        assert max_lag >= 1
+        super().__init__([source])
+        self.max_lag = max_lag
+        self._source_blocks = None  # type: Optional[Generator[List[float], None, None]]
+        self._buffer = collections.deque()     # type: collections.deque
+        self._first = 0     # block number of the first block in the buffer
+        self._positions = {}    # type: Dict[int, int]
+        self._subscriber_ids = itertools.count()
+
+    def at_samplerate(self, samplerate: int, _copies: Optional[Dict[int, Oscillator]] = None) -> Oscillator:
+        copies = {} if _copies is None else _copies
+        if id(self) in copies:
+            return copies[id(self)]
+        osc = super().at_samplerate(samplerate, copies)
+        if isinstance(osc, BroadcastFilter):
+            # the copy has its own subscribers
+            osc._source_blocks = None
+            osc._buffer = collections.deque()
+            osc._first = 0
+            osc._positions = {}
+            osc._subscriber_ids = itertools.count()
+        return osc
+
+    def blocks(self) -> Generator[List[float], None, None]:
+        subscriber = next(self._subscriber_ids)
+        self._positions[subscriber] = self._first + max(0, len(self._buffer) - 1)
+        try:
+            while True:
+                position = max(self._positions[subscriber], self._first)
+                block = self._block(position)
+                if block is None:
+                    return
+                self._positions[subscriber] = position + 1
+                self._discard_old_blocks()
+                yield block
+        finally:
+            del self._positions[subscriber]
+
+    def _block(self, number: int) -> Optional[List[float]]:
+        while number >= self._first + len(self._buffer):
+            if self._source_blocks is None:
+                self._source_blocks = self.sources[0].blocks()
+            block = next(self._source_blocks, None)
+            if block is None:
+                return None
+            self._buffer.append(block)
+            if len(self._buffer) > self.max_lag:
+                self._buffer.popleft()
+                self._first += 1
+        return self._buffer[number - self._first]
+
+    def _discard_old_blocks(self) -> None:
+        # drop the blocks that every subscriber is done with, but keep the latest one for new subscribers
+        oldest_needed = min(self._positions.values())
+        while self._first < oldest_needed and len(self._buffer) > 1:
+            self._buffer.popleft()
+            self._first += 1
+
 
 class Sine(Oscillator):
     """Sine Wave oscillator."""
@@ -330,10 +995,14 @@ class Sine(Oscillator):
         self.frequency = frequency
         self.amplitude = amplitude
         self.bias = bias
-        self.fm = fm_lfo.blocks() if fm_lfo else Linear(0.0).blocks()
+        self._fm_lfo = fm_lfo
+        self.fm = fm_lfo.blocks() if fm_lfo else self.constant_blocks(0.0)
         self._phase = phase
 
     def blocks(self) -> Generator[List[float], None, None]:
+        if use_numpy_engine():
+            yield from self.numpy_blocks()
+            return
         phase_correction = self._phase*2*pi
         freq_previous = self.frequency
         increment = 2.0*pi/self.samplerate
@@ -345,7 +1014,7 @@ class Sine(Oscillator):
         while True:
             block = []  # type: List[float]
             fm_block = next(self.fm)
-            for i in range(params.norm_osc_blocksize):
+            for i in range(self.blocksize):
                 freq = frequency*(1.0+fm_block[i])
                 phase_correction += (freq_previous-freq)*t
                 freq_previous = freq
@@ -353,6 +1022,16 @@ class Sine(Oscillator):
                 t += increment
             yield block
 
+    def numpy_blocks(self) -> Generator[List[float], None, None]:
+        increment = 2.0*pi/self.samplerate
+        phase = self._phase*2.0*pi
+        while True:
+            tt, phase = fm_phases_numpy(phase, self.frequency, increment, next(self.fm), 2.0*pi)
+            numpy.sin(tt, out=tt)
+            tt *= self.amplitude
+            tt += self.bias
+            yield tt.tolist()
+
 
 class Triangle(Oscillator):
     """Perfect triangle wave oscillator (not using harmonics)."""
@@ -362,10 +1041,14 @@ class Triangle(Oscillator):
         self.frequency = frequency
         self.amplitude = amplitude
         self.bias = bias
-        self.fm = fm_lfo.blocks() if fm_lfo else Linear(0.0).blocks()
+        self._fm_lfo = fm_lfo
+        self.fm = fm_lfo.blocks() if fm_lfo else self.constant_blocks(0.0)
         self._phase = phase
 
     def blocks(self) -> Generator[List[float], None, None]:
+        if use_numpy_engine():
+            yield from self.numpy_blocks()
+            return
         phase_correction = self._phase
         freq_previous = self.frequency
         increment = 1.0/self.samplerate
@@ -377,7 +1060,7 @@ class Triangle(Oscillator):
         while True:
             block = []  # type: List[float]
             fm_block = next(self.fm)
-            for i in range(params.norm_osc_blocksize):
+            for i in range(self.blocksize):
                 freq = frequency * (1.0+fm_block[i])
                 phase_correction += (freq_previous-freq)*t
                 freq_previous = freq
@@ -386,6 +1069,13 @@ class Triangle(Oscillator):
                 t += increment
             yield block
 
+    def numpy_blocks(self) -> Generator[List[float], None, None]:
+        increment = 1.0/self.samplerate
+        phase = self._phase
+        while True:
+            tt, phase = fm_phases_numpy(phase, self.frequency, increment, next(self.fm), 1.0)
+            yield triangle_numpy(tt, self.amplitude, self.bias).tolist()
+
 
 class Square(Oscillator):
     """Perfect square wave [max/-max] oscillator (not using harmonics)."""
@@ -395,10 +1085,14 @@ class Square(Oscillator):
         self.frequency = frequency
         self.amplitude = amplitude
         self.bias = bias
-        self.fm = fm_lfo.blocks() if fm_lfo else Linear(0.0).blocks()
+        self._fm_lfo = fm_lfo
+        self.fm = fm_lfo.blocks() if fm_lfo else self.constant_blocks(0.0)
         self._phase = phase
 
     def blocks(self) -> Generator[List[float], None, None]:
+        if use_numpy_engine():
+            yield from self.numpy_blocks()
+            return
         phase_correction = self._phase
         freq_previous = self.frequency
         increment = 1.0/self.samplerate
@@ -410,7 +1104,7 @@ class Square(Oscillator):
         while True:
             block = []  # type: List[float]
             fm_block = next(self.fm)
-            for i in range(params.norm_osc_blocksize):
+            for i in range(self.blocksize):
                 freq = frequency*(1.0+fm_block[i])
                 phase_correction += (freq_previous-freq)*t
                 freq_previous = freq
@@ -419,6 +1113,13 @@ class Square(Oscillator):
                 t += increment
             yield block
 
+    def numpy_blocks(self) -> Generator[List[float], None, None]:
+        increment = 1.0/self.samplerate
+        phase = self._phase
+        while True:
+            tt, phase = fm_phases_numpy(phase, self.frequency, increment, next(self.fm), 1.0)
+            yield square_numpy(tt, self.amplitude, self.bias).tolist()
+
 
 class Sawtooth(Oscillator):
     """Perfect sawtooth waveform oscillator (not using harmonics)."""
@@ -428,10 +1129,14 @@ class Sawtooth(Oscillator):
         self.frequency = frequency
         self.amplitude = amplitude
         self.bias = bias
-        self.fm = fm_lfo.blocks() if fm_lfo else Linear(0.0).blocks()
+        self._fm_lfo = fm_lfo
+        self.fm = fm_lfo.blocks() if fm_lfo else self.constant_blocks(0.0)
         self._phase = phase
 
     def blocks(self) -> Generator[List[float], None, None]:
+        if use_numpy_engine():
+            yield from self.numpy_blocks()
+            return
         increment = 1.0/self.samplerate
         freq_previous = self.frequency
         phase_correction = self._phase
@@ -443,7 +1148,7 @@ class Sawtooth(Oscillator):
         while True:
             block = []  # type: List[float]
             fm_block = next(self.fm)
-            for i in range(params.norm_osc_blocksize):
+            for i in range(self.blocksize):
                 freq = frequency*(1.0+fm_block[i])
                 phase_correction += (freq_previous-freq)*t
                 freq_previous = freq
@@ -452,6 +1157,13 @@ class Sawtooth(Oscillator):
                 t += increment
             yield block
 
+    def numpy_blocks(self) -> Generator[List[float], None, None]:
+        increment = 1.0/self.samplerate
+        phase = self._phase
+        while True:
+            tt, phase = fm_phases_numpy(phase, self.frequency, increment, next(self.fm), 1.0)
+            yield sawtooth_numpy(tt, self.amplitude, self.bias).tolist()
+
 
 class Pulse(Oscillator):
     """
@@ -468,11 +1180,16 @@ class Pulse(Oscillator):
         self.amplitude = amplitude
         self.bias = bias
         self.pulsewidth = pulsewidth
-        self.fm = fm_lfo.blocks() if fm_lfo else Linear(0.0).blocks()
-        self.pwm = pwm_lfo.blocks() if pwm_lfo else Linear(pulsewidth).blocks()
+        self._fm_lfo = fm_lfo
+        self.fm = fm_lfo.blocks() if fm_lfo else self.constant_blocks(0.0)
+        self._pwm_lfo = pwm_lfo
+        self.pwm = pwm_lfo.blocks() if pwm_lfo else self.constant_blocks(pulsewidth)
         self._phase = phase
 
     def blocks(self) -> Generator[List[float], None, None]:
+        if use_numpy_engine():
+            yield from self.numpy_blocks()
+            return
         increment = 1.0/self.samplerate
         freq_previous = self.frequency
         phase_correction = self._phase
@@ -485,7 +1202,7 @@ class Pulse(Oscillator):
             block = []  # type: List[float]
             fm_block = next(self.fm)
             pwm_block = next_pwm_block(self.pwm)
-            for i in range(params.norm_osc_blocksize):
+            for i in range(self.blocksize):
                 freq = frequency*(1.0+fm_block[i])
                 phase_correction += (freq_previous-freq)*t
                 freq_previous = freq
@@ -494,11 +1211,20 @@ class Pulse(Oscillator):
                 t += increment
             yield block
 
+    def numpy_blocks(self) -> Generator[List[float], None, None]:
+        increment = 1.0/self.samplerate
+        phase = self._phase
+        while True:
+            tt, phase = fm_phases_numpy(phase, self.frequency, increment, next(self.fm), 1.0)
+            yield pulse_numpy(tt, next_pwm_block_numpy(self.pwm), self.amplitude, self.bias).tolist()
+
 
 class Harmonics(Oscillator):
     """
     Oscillator that produces a waveform based on harmonics.
     This is computationally intensive because many sine waves are added together.
+    Without FM however, the waveform is computed only once into a single cycle table
+    that is then simply played back, so the number of harmonics no longer matters.
     """
     def __init__(self, frequency: float, harmonics: List[Tuple[int, float]], amplitude: float = 1.0, phase: float = 0.0,
                  bias: float = 0.0, fm_lfo: Optional[Oscillator] = None, samplerate: int = 0) -> None:
@@ -506,17 +1232,45 @@ class Harmonics(Oscillator):
         self.frequency = frequency
         self.amplitude = amplitude
         self.bias = bias
-        self.fm = fm_lfo.blocks() if fm_lfo else Linear(0.0).blocks()
+        self._fm_lfo = fm_lfo
+        self.fm = fm_lfo.blocks() if fm_lfo else self.constant_blocks(0.0)
         self._phase = phase
+        self._use_table = fm_lfo is None and all(isinstance(h[0], int) for h in harmonics)
         self.harmonics = harmonics
 
+    def audible_harmonics(self) -> List[Tuple[int, float]]:
+        """only keep harmonics below the Nyquist frequency"""
+        return list(filter(lambda h: h[0] * self.frequency <= self.samplerate / 2, self.harmonics))
+
+    def table_oscillator(self, amplitude: float) -> 'Wavetable':
+        """
+        Oscillator that plays the harmonics from a precomputed single cycle table (only possible without FM).
+        The table only contains the harmonics below the Nyquist frequency, and is shared
+        by all notes that have the same harmonics left after this filtering.
+        """
+        table = wavetable("harmonics", harmonics=self.audible_harmonics())
+        osc = Wavetable(self.frequency, table, amplitude, self._phase, self.bias, samplerate=self.samplerate)
+        osc.blocksize = self.blocksize
+        return osc
+
+    def _blocks_from(self, samples: int) -> Generator[List[float], None, None]:
+        if all(isinstance(h[0], int) for h in self.harmonics):
+            return super()._blocks_from(samples)
+        # the phase can't be wrapped around if the harmonics are not whole multiples of the base frequency
+        return skip_values(self.blocks(), samples, self.blocksize)
+
     def blocks(self) -> Generator[List[float], None, None]:
+        if self._use_table:
+            yield from self.table_oscillator(self.amplitude).blocks()
+            return
+        if use_numpy_engine():
+            yield from self.numpy_blocks()
+            return
         increment = 2.0*pi/self.samplerate
         phase_correction = self._phase*2.0*pi
         freq_previous = self.frequency
         t = 0.0
-        # only keep harmonics below the Nyquist frequency
-        harmonics = list(filter(lambda h: h[0] * self.frequency <= self.samplerate / 2, self.harmonics))
+        harmonics = self.audible_harmonics()
         # optimizations:
         frequency = self.frequency
         amplitude = self.amplitude
@@ -524,7 +1278,7 @@ class Harmonics(Oscillator):
         while True:
             block = []  # type: List[float]
             fm_block = next(self.fm)
-            for i in range(params.norm_osc_blocksize):
+            for i in range(self.blocksize):
                 h = 0.0
                 freq = frequency*(1.0+fm_block[i])
                 phase_correction += (freq_previous-freq)*t
@@ -536,6 +1290,27 @@ class Harmonics(Oscillator):
                 t += increment
             yield block
 
+    def numpy_blocks(self) -> Generator[List[float], None, None]:
+        # all harmonics are evaluated at once as a (harmonics x samples) matrix of sines,
+        # that is then reduced to a single block by weighting it with the amplitudes.
+        harmonics = self.audible_harmonics()
+        numbers = numpy.array([h[0] for h in harmonics], dtype=float).reshape(-1, 1)
+        amplitudes = numpy.array([h[1] for h in harmonics], dtype=float) * self.amplitude
+        # the phase can only be wrapped around if all harmonics are whole multiples of the base frequency
+        period = 2.0*pi if all(float(k).is_integer() for k, _ in harmonics) else float("inf")
+        increment = 2.0*pi/self.samplerate
+        phase = self._phase*2.0*pi
+        sines = numpy.empty((len(harmonics), self.blocksize))
+        while True:
+            tt, phase = fm_phases_numpy(phase, self.frequency, increment, next(self.fm), period)
+            if len(tt) != sines.shape[1]:
+                sines = numpy.empty((len(harmonics), len(tt)))
+            numpy.multiply(numbers, tt, out=sines)
+            numpy.sin(sines, out=sines)
+            block = amplitudes.dot(sines)
+            block += self.bias
+            yield block.tolist()
+
 
 class SquareH(Harmonics):
     """
@@ -561,6 +1336,10 @@ class SawtoothH(Harmonics):
         super().__init__(frequency, harmonics, amplitude, phase+0.5, bias, fm_lfo=fm_lfo, samplerate=samplerate)
 
     def blocks(self) -> Generator[List[float], None, None]:
+        if self._use_table:
+            # the inverted harmonics waveform is just the table played with negative amplitude
+            yield from self.table_oscillator(-self.amplitude).blocks()
+            return
         try:
             for block in super().blocks():
                 yield [self.bias*2.0-y for y in block]
@@ -569,34 +1348,78 @@ class SawtoothH(Harmonics):
 
 
 class WhiteNoise(Oscillator):
-    """Oscillator that produces white noise (randomness) waveform."""
-    def __init__(self, frequency: float, amplitude: float = 1.0, bias: float = 0.0, samplerate: int = 0) -> None:
+    """
+    Oscillator that produces white noise (randomness) waveform.
+    If you provide a seed, the noise is reproducible (the same seed gives the same noise,
+    with or without the numpy engine). Otherwise the global random generator is used.
+    """
+    def __init__(self, frequency: float, amplitude: float = 1.0, bias: float = 0.0,
+                 samplerate: int = 0, seed: Optional[int] = None) -> None:
         super().__init__(samplerate)
         self.amplitude = amplitude
         self.bias = bias
         self.frequency = frequency
-
-    def random_values(self) -> Generator[float, None, None]:
-        cycles = int(self.samplerate / self.frequency)
-        if cycles < 1:
-            raise ValueError("whitenoise frequency cannot be bigger than the sample rate")
-        # optimizations:
-        amplitude = self.amplitude
-        bias = self.bias
+        self.seed = seed
+
+    def _blocks_from(self, samples: int) -> Generator[List[float], None, None]:
+        if self.seed is None:
+            return self.blocks()    # unseeded noise is different every time anyway
+        return skip_values(self.blocks(), samples, self.blocksize)
+
+    def random_blocks(self) -> Generator[Sequence[float], None, None]:
+        """
+        Generates blocks of random values between -amplitude and +amplitude (plus the bias).
+        A whole block is decoded from a single large random number of 32 bits per value.
+        """
+        rng = random if self.seed is None else random.Random(self.seed)     # type: Any
+        scale = 2.0*self.amplitude/2**32
+        offset = self.bias-self.amplitude
         while True:
-            value = random.uniform(-amplitude, amplitude) + bias
-            yield from [value] * cycles
+            size = self.blocksize
+            bits = rng.getrandbits(32*size).to_bytes(4*size, "little")
+            if use_numpy_engine():
+                values = numpy.frombuffer(bits, dtype="<u4") * scale     # type: Any
+                values += offset
+                yield values
+            else:
+                words = array.array("I", bits)
+                if sys.byteorder == "big":
+                    words.byteswap()    # decode little endian, just like the numpy path does
+                yield [v*scale+offset for v in words]
 
     def blocks(self) -> Generator[List[float], None, None]:
         cycles = int(self.samplerate / self.frequency)
         if cycles < 1:
             raise ValueError("whitenoise frequency cannot be bigger than the sample rate")
-        values = self.random_values()
+        random_blocks = self.random_blocks()
+        values = []     # type: Sequence[float]
+        index = 0
+        held = 0.0
+        hold = 0
         while True:
-            v = list(itertools.islice(values, params.norm_osc_blocksize))
-            if not v:
-                return
-            yield v
+            # every random value is held for the given number of cycles (sample-and-hold)
+            block = [held] * min(hold, self.blocksize)
+            hold -= len(block)
+            needed = self.blocksize - len(block)
+            while needed > 0:
+                if index >= len(values):
+                    values = next(random_blocks)
+                    index = 0
+                count = min(len(values)-index, -(-needed // cycles))
+                new_values = values[index:index+count]
+                index += count
+                if isinstance(new_values, list):
+                    if cycles == 1:
+                        block.extend(new_values)
+                    else:
+                        block.extend(itertools.islice(itertools.chain.from_iterable(
+                            itertools.repeat(v, cycles) for v in new_values), needed))
+                else:
+                    block.extend(numpy.repeat(new_values, cycles)[:needed].tolist())
+                held = float(new_values[-1])
+                hold = count*cycles - needed if count*cycles > needed else 0
+                needed = self.blocksize - len(block)
+            yield block
 
 
 class Linear(Oscillator):
@@ -609,6 +1432,11 @@ class Linear(Oscillator):
         self.min_value = min_value
         self.max_value = max_value
 
+    def _blocks_from(self, samples: int) -> Generator[List[float], None, None]:
+        osc = copy.copy(self)
+        osc.value = min(self.max_value, max(self.min_value, self.value + samples*self.increment))
+        return osc.blocks()
+
     def blocks(self) -> Generator[List[float], None, None]:
         # optimizations
         value = self.value
@@ -618,12 +1446,12 @@ class Linear(Oscillator):
         if incr:
             while True:
                 block = []  # type: List[float]
-                for _ in range(params.norm_osc_blocksize):
+                for _ in range(self.blocksize):
                     block.append(value)
                     value = min(maxv, max(minv, value+incr))
                 yield block
         else:
-            block = [value] * params.norm_osc_blocksize
+            block = [value] * self.blocksize
             while True:
                 yield list(block)
 
@@ -637,9 +1465,13 @@ class Semicircle(Oscillator):
         self.frequency = frequency
         self.amplitude = amplitude
         self.bias = bias
-        self.fm = fm_lfo.blocks() if fm_lfo else Linear(0.0).blocks()
+        self._fm_lfo = fm_lfo
+        self.fm = fm_lfo.blocks() if fm_lfo else self.constant_blocks(0.0)
 
     def blocks(self) -> Generator[List[float], None, None]:
+        if use_numpy_engine():
+            yield from self.numpy_blocks()
+            return
         phase_correction = self._phase * 2.0
         freq_previous = self.frequency
         increment = 2.0/self.samplerate
@@ -651,7 +1483,7 @@ class Semicircle(Oscillator):
         while True:
             block = []  # type: List[float]
             fm_block = next(self.fm)
-            for i in range(params.norm_osc_blocksize):
+            for i in range(self.blocksize):
                 freq = frequency*(1.0+fm_block[i])
                 phase_correction += (freq_previous-freq)*t
                 freq_previous = freq
@@ -661,6 +1493,13 @@ class Semicircle(Oscillator):
                 t += increment
             yield block
 
+    def numpy_blocks(self) -> Generator[List[float], None, None]:
+        increment = 2.0/self.samplerate
+        phase = (self._phase*2.0 - self.frequency) % 2.0     # the loop above starts at t=-1
+        while True:
+            tt, phase = fm_phases_numpy(phase, self.frequency, increment, next(self.fm), 2.0)
+            yield semicircle_numpy(tt, self.amplitude, self.bias).tolist()
+
 
 class Pointy(Oscillator):
     """Pointy Wave ('inverted cosine', 'W2') oscillator."""
@@ -670,10 +1509,14 @@ class Pointy(Oscillator):
         self.frequency = frequency
         self.amplitude = amplitude
         self.bias = bias
-        self.fm = fm_lfo.blocks() if fm_lfo else Linear(0.0).blocks()
+        self._fm_lfo = fm_lfo
+        self.fm = fm_lfo.blocks() if fm_lfo else self.constant_blocks(0.0)
         self._phase = phase
 
     def blocks(self) -> Generator[List[float], None, None]:
+        if use_numpy_engine():
+            yield from self.numpy_blocks()
+            return
         two_pi = 2*pi
         phase_correction = self._phase*two_pi
         freq_previous = self.frequency
@@ -686,7 +1529,7 @@ class Pointy(Oscillator):
         while True:
             block = []
             fm_block = next(self.fm)
-            for i in range(params.norm_osc_blocksize):
+            for i in range(self.blocksize):
                 freq = frequency*(1.0+fm_block[i])
                 phase_correction += (freq_previous-freq)*t
                 freq_previous = freq
@@ -699,6 +1542,14 @@ class Pointy(Oscillator):
                 t += increment
             yield block
 
+    def numpy_blocks(self) -> Generator[List[float], None, None]:
+        two_pi = 2.0*pi
+        increment = two_pi/self.samplerate
+        phase = self._phase*two_pi
+        while True:
+            tt, phase = fm_phases_numpy(phase, self.frequency, increment, next(self.fm), two_pi)
+            yield pointy_numpy(tt, self.amplitude, self.bias).tolist()
+
 
 class FastSine(Oscillator):
     """Fast sine wave oscillator. Some parameters cannot be changed."""
@@ -711,6 +1562,9 @@ class FastSine(Oscillator):
         self.bias = bias
 
     def blocks(self) -> Generator[List[float], None, None]:
+        if use_numpy_engine():
+            yield from self.numpy_blocks()
+            return
         rate = self.samplerate / self._frequency
         increment = 2.0*pi/rate
         t = self._phase*2.0*pi
@@ -719,11 +1573,21 @@ class FastSine(Oscillator):
         bias = self.bias
         while True:
             block = []
-            for _ in range(params.norm_osc_blocksize):
+            for _ in range(self.blocksize):
                 block.append(sin(t)*amplitude+bias)
                 t += increment
             yield block
 
+    def numpy_blocks(self) -> Generator[List[float], None, None]:
+        increment = 2.0*pi*self._frequency/self.samplerate
+        phase = self._phase*2.0*pi
+        while True:
+            tt, phase = linear_phases_numpy(phase, increment, 2.0*pi, self.blocksize)
+            numpy.sin(tt, out=tt)
+            tt *= self.amplitude
+            tt += self.bias
+            yield tt.tolist()
+
 
 class FastTriangle(Oscillator):
     """Fast perfect triangle wave oscillator (not using harmonics). Some parameters cannot be changed."""
@@ -736,6 +1600,9 @@ class FastTriangle(Oscillator):
         self.bias = bias
 
     def blocks(self) -> Generator[List[float], None, None]:
+        if use_numpy_engine():
+            yield from self.numpy_blocks()
+            return
         freq = self._frequency
         t = self._phase/freq
         increment = 1.0/self.samplerate
@@ -744,11 +1611,18 @@ class FastTriangle(Oscillator):
         bias = self.bias
         while True:
             block = []
-            for _ in range(params.norm_osc_blocksize):
+            for _ in range(self.blocksize):
                 block.append(4.0*amplitude*(fabs((t*freq+0.75) % 1.0 - 0.5)-0.25)+bias)
                 t += increment
             yield block
 
+    def numpy_blocks(self) -> Generator[List[float], None, None]:
+        increment = self._frequency/self.samplerate
+        phase = self._phase
+        while True:
+            tt, phase = linear_phases_numpy(phase, increment, 1.0, self.blocksize)
+            yield triangle_numpy(tt, self.amplitude, self.bias).tolist()
+
 
 class FastSquare(Oscillator):
     """Fast perfect square wave [max/-max] oscillator (not using harmonics). Some parameters cannot be changed."""
@@ -761,6 +1635,9 @@ class FastSquare(Oscillator):
         self.bias = bias
 
     def blocks(self) -> Generator[List[float], None, None]:
+        if use_numpy_engine():
+            yield from self.numpy_blocks()
+            return
         freq = self._frequency
         t = self._phase/freq
         increment = 1.0/self.samplerate
@@ -769,11 +1646,18 @@ class FastSquare(Oscillator):
         bias = self.bias
         while True:
             block = []  # type: List[float]
-            for _ in range(params.norm_osc_blocksize):
+            for _ in range(self.blocksize):
                 block.append((-amplitude if int(t*freq*2) % 2 else amplitude)+bias)
                 t += increment
             yield block
 
+    def numpy_blocks(self) -> Generator[List[float], None, None]:
+        increment = self._frequency/self.samplerate
+        phase = self._phase
+        while True:
+            tt, phase = linear_phases_numpy(phase, increment, 1.0, self.blocksize)
+            yield square_numpy(tt, self.amplitude, self.bias).tolist()
+
 
 class FastSawtooth(Oscillator):
     """Fast perfect sawtooth waveform oscillator (not using harmonics). Some parameters canot be changed."""
@@ -786,6 +1670,9 @@ class FastSawtooth(Oscillator):
         self.bias = bias
 
     def blocks(self) -> Generator[List[float], None, None]:
+        if use_numpy_engine():
+            yield from self.numpy_blocks()
+            return
         freq = self._frequency
         t = self._phase/freq
         increment = 1.0/self.samplerate
@@ -794,12 +1681,19 @@ class FastSawtooth(Oscillator):
         bias = self.bias
         while True:
             block = []  # type: List[float]
-            for _ in range(params.norm_osc_blocksize):
+            for _ in range(self.blocksize):
                 tt = t*freq
                 block.append(bias+2.0*amplitude*(tt - floor(0.5+tt)))
                 t += increment
             yield block
 
+    def numpy_blocks(self) -> Generator[List[float], None, None]:
+        increment = self._frequency/self.samplerate
+        phase = self._phase
+        while True:
+            tt, phase = linear_phases_numpy(phase, increment, 1.0, self.blocksize)
+            yield sawtooth_numpy(tt, self.amplitude, self.bias).tolist()
+
 
 class FastPulse(Oscillator):
     """
@@ -816,24 +1710,27 @@ class FastPulse(Oscillator):
         self._frequency = frequency
         self._phase = phase
         self._pulsewidth = pulsewidth
-        self._pwm = pwm_lfo
+        self._pwm_lfo = pwm_lfo
         self.amplitude = amplitude
         self.bias = bias
 
     def blocks(self) -> Generator[List[float], None, None]:
+        if use_numpy_engine():
+            yield from self.numpy_blocks()
+            return
         # optimizations:
         amplitude = self.amplitude
         frequency = self._frequency
         bias = self.bias
-        if self._pwm:
+        if self._pwm_lfo:
             # loop without FM, but with PWM
-            pwm = self._pwm.blocks()
+            pwm = self._pwm_lfo.blocks()
             t = self._phase/self._frequency
             increment = 1.0/self.samplerate
             while True:
                 block = []  # type: List[float]
                 pwm_block = next_pwm_block(pwm)
-                for i in range(params.norm_osc_blocksize):
+                for i in range(self.blocksize):
                     block.append((amplitude if t*frequency % 1.0 < pwm_block[i] else -amplitude)+bias)
                     t += increment
                 yield block
@@ -844,11 +1741,45 @@ class FastPulse(Oscillator):
             increment = 1.0/self.samplerate
             while True:
                 block = []
-                for _ in range(params.norm_osc_blocksize):
+                for _ in range(self.blocksize):
                     block.append((amplitude if t*frequency % 1.0 < pulsewidth else -amplitude)+bias)
                     t += increment
                 yield block
 
+    def numpy_blocks(self) -> Generator[List[float], None, None]:
+        increment = self._frequency/self.samplerate
+        phase = self._phase
+        pwm = self._pwm_lfo.blocks() if self._pwm_lfo else None
+        while True:
+            tt, phase = linear_phases_numpy(phase, increment, 1.0, self.blocksize)
+            pulsewidth = next_pwm_block_numpy(pwm) if pwm else self._pulsewidth
+            yield pulse_numpy(tt, pulsewidth, self.amplitude, self.bias).tolist()
+
+
+def skip_values(blocks: Iterator[Sequence[float]], count: int, blocksize: int) -> Generator[List[float], None, None]:
+    """
+    Skips the first count values of the blocks (by generating them). The values after that are
+    regrouped into blocks of the given size again, only the last block can be shorter.
+    """
+    for block in blocks:
+        if count < len(block):
+            break
+        count -= len(block)
+    else:
+        return
+    if count == 0:
+        yield list(block)
+        yield from blocks   # type: ignore
+        return
+    pending = list(block[count:])
+    for block in blocks:
+        pending.extend(block)
+        while len(pending) >= blocksize:
+            yield pending[:blocksize]
+            del pending[:blocksize]
+    if pending:
+        yield pending
+
 
 def next_pwm_block(pwm: Generator[List[float], None, None]) -> List[float]:
     epsilon = sys.float_info.epsilon
@@ -856,6 +1787,103 @@ def next_pwm_block(pwm: Generator[List[float], None, None]) -> List[float]:
     return [min(1.0-epsilon, max(epsilon, p)) for p in pwm_block]
 
 
+# The vectorized (numpy) block engine.
+# Every block is computed as a few array expressions instead of a Python loop per sample.
+# The phase values are kept wrapped within one period of the waveform,
+# so the results are the same as the per-sample code (within floating point tolerance).
+
+def use_numpy_engine() -> bool:
+    """Should the oscillators use the vectorized block engine? (requires numpy)"""
+    return numpy is not None and params.oscillators_use_numpy
+
+
+def linear_phases_numpy(phase: float, increment: float, period: float, blocksize: int) -> Tuple['numpy.ndarray', float]:
+    """
+    Returns the phase values for one block of a non-modulated oscillator,
+    and the phase to start the next block with.
+    """
+    tt = numpy.arange(blocksize, dtype=numpy.float64)
+    tt *= increment
+    tt += phase
+    return tt, (phase + blocksize*increment) % period
+
+
+def fm_phases_numpy(phase: float, frequency: float, increment: float,
+                    fm_block: Sequence[float], period: float) -> Tuple['numpy.ndarray', float]:
+    """
+    Returns the phase values for one block of a frequency modulated oscillator,
+    and the phase to start the next block with.
+    The phase is integrated by a cumulative sum over the modulated frequency; the phase of a sample
+    is the running total of the frequencies of the samples before it. This is what the phase_correction
+    update in the per-sample loops boils down to.
+    """
+    steps = numpy.asarray(fm_block, dtype=numpy.float64) + 1.0
+    steps *= frequency*increment
+    tt = numpy.cumsum(steps)
+    next_phase = (phase + tt[-1]) % period
+    tt -= steps
+    tt += phase
+    return tt, next_phase
+
+
+def next_pwm_block_numpy(pwm: Generator[List[float], None, None]) -> 'numpy.ndarray':
+    epsilon = sys.float_info.epsilon
+    return numpy.clip(next(pwm), epsilon, 1.0-epsilon)
+
+
+def triangle_numpy(tt: 'numpy.ndarray', amplitude: float, bias: float) -> 'numpy.ndarray':
+    tt += 0.75
+    tt %= 1.0
+    tt -= 0.5
+    numpy.fabs(tt, out=tt)
+    tt -= 0.25
+    tt *= 4.0*amplitude
+    tt += bias
+    return tt
+
+
+def square_numpy(tt: 'numpy.ndarray', amplitude: float, bias: float) -> 'numpy.ndarray':
+    tt *= 2.0
+    numpy.trunc(tt, out=tt)
+    return numpy.where(tt % 2.0, bias-amplitude, bias+amplitude)
+
+
+def sawtooth_numpy(tt: 'numpy.ndarray', amplitude: float, bias: float) -> 'numpy.ndarray':
+    tt -= numpy.floor(tt + 0.5)
+    tt *= 2.0*amplitude
+    tt += bias
+    return tt
+
+
+def pulse_numpy(tt: 'numpy.ndarray', pulsewidth: Union[float, 'numpy.ndarray'],
+                amplitude: float, bias: float) -> 'numpy.ndarray':
+    tt %= 1.0
+    return numpy.where(tt < pulsewidth, bias+amplitude, bias-amplitude)
+
+
+def semicircle_numpy(tt: 'numpy.ndarray', amplitude: float, bias: float) -> 'numpy.ndarray':
+    tt %= 2.0
+    tt -= 1.0
+    tt *= tt
+    numpy.subtract(1.0, tt, out=tt)
+    numpy.sqrt(tt, out=tt)
+    tt *= amplitude
+    tt += bias
+    return tt
+
+
+def pointy_numpy(tt: 'numpy.ndarray', amplitude: float, bias: float) -> 'numpy.ndarray':
+    negative = tt % (2.0*pi) > pi
+    numpy.cos(tt, out=tt)
+    numpy.fabs(tt, out=tt)
+    numpy.subtract(1.0, tt, out=tt)
+    tt *= tt
+    tt *= amplitude
+    numpy.negative(tt, out=tt, where=negative)
+    tt += bias
+    return tt
+
+
 class FastSemicircle(Oscillator):
     """Fast semicircle half wave ('W3') oscillator. Some parameters cannot be changed."""
     def __init__(self, frequency: float, amplitude: float = 1.0, phase: float = 0.0,
@@ -867,6 +1895,9 @@ class FastSemicircle(Oscillator):
         self.bias = bias
 
     def blocks(self) -> Generator[List[float], None, None]:
+        if use_numpy_engine():
+            yield from self.numpy_blocks()
+            return
         rate = self.samplerate / self._frequency
         increment = 2.0/rate
         t = -1.0 + self._phase * 2
@@ -875,13 +1906,20 @@ class FastSemicircle(Oscillator):
         bias = self.bias
         while True:
             block = []  # type: List[float]
-            for _ in range(params.norm_osc_blocksize):
+            for _ in range(self.blocksize):
                 block.append(sqrt(1.0 - t*t) * amplitude + bias)
                 t += increment
                 if t >= 1.0:
                     t -= 2.0
             yield block
 
+    def numpy_blocks(self) -> Generator[List[float], None, None]:
+        increment = 2.0*self._frequency/self.samplerate
+        phase = self._phase*2.0
+        while True:
+            tt, phase = linear_phases_numpy(phase, increment, 2.0, self.blocksize)
+            yield semicircle_numpy(tt, self.amplitude, self.bias).tolist()
+
 
 class FastPointy(Oscillator):
     """Fast pointy wave ('inverted cosine', 'W2') oscillator. Some parameters cannot be changed."""
@@ -894,6 +1932,9 @@ class FastPointy(Oscillator):
         self.bias = bias
 
     def blocks(self) -> Generator[List[float], None, None]:
+        if use_numpy_engine():
+            yield from self.numpy_blocks()
+            return
         rate = self.samplerate / self._frequency
         two_pi = 2.0*pi
         increment = two_pi/rate
@@ -903,7 +1944,7 @@ class FastPointy(Oscillator):
         bias = self.bias
         while True:
             block = []  # type: List[float]
-            for _ in range(params.norm_osc_blocksize):
+            for _ in range(self.blocksize):
                 t %= two_pi
                 vv = 1.0-abs(cos(t))
                 if t > pi:
@@ -913,6 +1954,212 @@ class FastPointy(Oscillator):
                 t += increment
             yield block
 
+    def numpy_blocks(self) -> Generator[List[float], None, None]:
+        two_pi = 2.0*pi
+        increment = two_pi*self._frequency/self.samplerate
+        phase = self._phase*two_pi
+        while True:
+            tt, phase = linear_phases_numpy(phase, increment, two_pi, self.blocksize)
+            yield pointy_numpy(tt, self.amplitude, self.bias).tolist()
+
+
+# The shared wavetable store.
+# Tables are computed only once per process, so all Wavetable oscillators that play the same waveform share one table.
+_wavetables = {}            # type: Dict[Tuple[Any, ...], Tuple[float, ...]]
+# the tables as numpy arrays, keyed by the id of the table in _wavetables
+_wavetables_numpy = {}      # type: Dict[int, numpy.ndarray]
+
+
+def wavetable(waveform: str, pulsewidth: float = 0.1, harmonics: Optional[Sequence[Tuple[int, float]]] = None,
+              num_harmonics: int = 16, size: int = 0) -> Tuple[float, ...]:
+    """
+    Returns the (shared) single cycle table for the given waveform.
+    Waveforms: sine, triangle, square, sawtooth, pulse (uses pulsewidth), semicircle, pointy,
+    harmonics (uses harmonics), square_h and sawtooth_h (use num_harmonics).
+    """
+    size = size or params.wavetable_size
+    if waveform == "pulse":
+        assert 0 <= pulsewidth <= 1
+        key = (waveform, size, pulsewidth)     # type: Tuple[Any, ...]
+    elif waveform == "harmonics":
+        if harmonics is None:
+            raise ValueError("harmonics waveform requires a list of harmonics")
+        key = (waveform, size, tuple(map(tuple, harmonics)))
+    elif waveform in ("square_h", "sawtooth_h"):
+        key = (waveform, size, num_harmonics)
+        if waveform == "square_h":
+            harmonics = [(n, 1.0/n) for n in range(1, num_harmonics*2, 2)]  # only the odd harmonics
+        else:
+            harmonics = [(n, 1.0/n) for n in range(1, num_harmonics+1)]  # all harmonics
+    else:
+        key = (waveform, size)
+    table = _wavetables.get(key)
+    if table is None:
+        if waveform == "sine":
+            osc = FastSine(1, samplerate=size)      # type: Optional[Oscillator]
+        elif waveform == "triangle":
+            osc = FastTriangle(1, samplerate=size)
+        elif waveform == "square":
+            osc = FastSquare(1, samplerate=size)
+        elif waveform == "sawtooth":
+            osc = FastSawtooth(1, samplerate=size)
+        elif waveform == "pulse":
+            osc = FastPulse(1, pulsewidth=pulsewidth, samplerate=size)
+        elif waveform == "semicircle":
+            osc = FastSemicircle(1, samplerate=size)
+        elif waveform == "pointy":
+            osc = FastPointy(1, samplerate=size)
+        elif waveform in ("harmonics", "square_h", "sawtooth_h"):
+            osc = None
+        else:
+            raise ValueError("invalid waveform: " + waveform)
+        if osc:
+            # render exactly one cycle of the waveform
+            table = tuple(itertools.islice(itertools.chain.from_iterable(osc.blocks()), size))
+        else:
+            table = harmonics_table(harmonics, size)    # type: ignore
+            if waveform == "sawtooth_h":
+                # shift by half a cycle and invert, like the SawtoothH oscillator does
+                table = tuple(-v for v in table[size//2:] + table[:size//2])
+        table = _wavetables.setdefault(key, table)
+    return table
+
+
+def harmonics_table(harmonics: Sequence[Tuple[int, float]], size: int) -> Tuple[float, ...]:
+    """
+    Computes one cycle of the waveform made of the given (integer) harmonics, in a table of the given size.
+    Harmonics that don't fit in the table (k >= size/2) are dropped.
+    Uses an inverse FFT if numpy is available.
+    """
+    harmonics = [(k, amp) for k, amp in harmonics if 0 < k < size/2]
+    if numpy:
+        # harmonic k with amplitude a is the frequency bin k with value -a*i*size/2
+        spectrum = numpy.zeros(size//2+1, dtype=numpy.complex128)
+        for k, amp in harmonics:
+            spectrum[k] -= 1j*amp*size/2
+        return tuple(numpy.fft.irfft(spectrum, size).tolist())
+    return tuple(sum(sin(2.0*pi*k*i/size)*amp for k, amp in harmonics) for i in range(size))
+
+
+def wavetable_numpy(table: Sequence[float]) -> 'numpy.ndarray':
+    """
+    Returns the table as a numpy array, with the first value repeated at the end for the interpolation.
+    Tables from the shared wavetable store also share their numpy array.
+    """
+    na = _wavetables_numpy.get(id(table))
+    if na is None:
+        na = numpy.array(list(table) + [table[0]], dtype=numpy.float64)
+        if any(t is table for t in _wavetables.values()):
+            na.flags.writeable = False
+            na = _wavetables_numpy.setdefault(id(table), na)
+    return na
+
+
+class Wavetable(Oscillator):
+    """
+    Oscillator that plays a single cycle waveform table, using a phase accumulator and linear interpolation.
+    The waveform is the name of a table from the shared wavetable store (see the wavetable function),
+    or your own sequence of values. Every waveform costs the same to play, so complex timbres
+    are as cheap as a simple sine wave.
+    Optional FM. Optional table morphing: the morph_lfo crossfades between the waveform (at 0)
+    and the tables from morph_to (the last one at 1), much like PWM does for the pulse wave.
+    The morph_lfo oscillator will be clipped between 0 and 1.
+    """
+    def __init__(self, frequency: float, waveform: Union[str, Sequence[float]] = "sine", amplitude: float = 1.0,
+                 phase: float = 0.0, bias: float = 0.0, fm_lfo: Optional[Oscillator] = None,
+                 morph_to: Sequence[Union[str, Sequence[float]]] = (), morph_lfo: Optional[Oscillator] = None,
+                 samplerate: int = 0) -> None:
+        super().__init__(samplerate)
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.bias = bias
+        self._fm_lfo = fm_lfo
+        self._morph_lfo = morph_lfo if morph_to else None
+        self.fm = fm_lfo.blocks() if fm_lfo else None
+        self.morph = morph_lfo.blocks() if morph_lfo and morph_to else None
+        self._phase = phase
+        self.tables = [wavetable(t) if isinstance(t, str) else t for t in [waveform] + list(morph_to)]
+        if any(len(t) != len(self.tables[0]) for t in self.tables):
+            raise ValueError("all wavetables must have the same size")
+
+    def blocks(self) -> Generator[List[float], None, None]:
+        if use_numpy_engine():
+            yield from self.numpy_blocks()
+            return
+        tables = self.tables
+        table = tables[0]
+        size = len(table)
+        last_table = len(tables)-1
+        increment = self.frequency*size/self.samplerate
+        position = (self._phase % 1.0)*size
+        steps = [increment] * self.blocksize
+        # optimizations:
+        amplitude = self.amplitude
+        bias = self.bias
+        while True:
+            block = []  # type: List[float]
+            if self.fm:
+                steps = [increment*(1.0+f) for f in next(self.fm)]
+            # note: indexing with idx-size and idx+1-size wraps around the end of the table
+            if self.morph:
+                morph_block = next_pwm_block(self.morph)
+                for i in range(self.blocksize):
+                    idx = int(position)
+                    frac = position-idx
+                    m = morph_block[i]*last_table
+                    k = int(m)
+                    ta = tables[k]
+                    tb = tables[k+1]
+                    va = ta[idx-size]
+                    va += (ta[idx+1-size]-va)*frac
+                    vb = tb[idx-size]
+                    vb += (tb[idx+1-size]-vb)*frac
+                    block.append((va+(vb-va)*(m-k))*amplitude+bias)
+                    position = (position+steps[i]) % size
+            else:
+                for i in range(self.blocksize):
+                    idx = int(position)
+                    v = table[idx-size]
+                    block.append((v+(table[idx+1-size]-v)*(position-idx))*amplitude+bias)
+                    position = (position+steps[i]) % size
+            yield block
+
+    def numpy_blocks(self) -> Generator[List[float], None, None]:
+        size = len(self.tables[0])
+        increment = size/self.samplerate
+        phase = (self._phase % 1.0)*size
+        if self.morph:
+            tables = numpy.vstack([wavetable_numpy(t) for t in self.tables])
+        else:
+            tables = wavetable_numpy(self.tables[0])
+        while True:
+            if self.fm:
+                tt, phase = fm_phases_numpy(phase, self.frequency, increment, next(self.fm), size)
+            else:
+                tt, phase = linear_phases_numpy(phase, self.frequency*increment, size, self.blocksize)
+            tt %= size
+            idx = tt.astype(numpy.intp)
+            numpy.minimum(idx, size-1, out=idx)
+            tt -= idx
+            if self.morph:
+                m = next_pwm_block_numpy(self.morph)
+                m *= len(self.tables)-1
+                k = m.astype(numpy.intp)
+                m -= k
+                va = tables[k, idx]
+                va += (tables[k, idx+1]-va)*tt
+                vb = tables[k+1, idx]
+                vb += (tables[k+1, idx+1]-vb)*tt
+                vb -= va
+                vb *= m
+                va += vb
+            else:
+                va = tables[idx]
+                va += (tables[idx+1]-va)*tt
+            va *= self.amplitude
+            va += self.bias
+            yield va.tolist()
+
 
 def plot_waveforms() -> None:
     import matplotlib.pyplot as plot
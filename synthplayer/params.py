@@ -13,9 +13,24 @@ norm_samplewidth = 2
 # smaller = less latency but more overhead
 norm_frames_per_chunk = norm_samplerate // 30
 
-# oscillator block size (samples)
+# default oscillator block size (samples), an oscillator graph can use its own via its blocksize property
 norm_osc_blocksize = 512
 
+# number of samples in a single cycle waveform table (used by the Wavetable oscillator)
+wavetable_size = 2048
+
+# should the oscillators use the vectorized (numpy) block engine, if numpy is available?
+# (much faster on CPython, set this to False to always use the per-sample Python code)
+oscillators_use_numpy = True
+
+# should new samples store their frames in a numpy array (frames * channels) instead of in bytes, if numpy is available?
+# (most operations then work in place on the array, and clipping or splitting a sample creates views instead of copies)
+sample_numpy_storage = False
+
+# which implementation of the DSP kernels (see the kernels module) the samples use: 'audioop', 'numpy', 'array',
+# or 'auto' to pick the fastest one that is available. Change it before the first use, or call kernels.select()
+dsp_kernels = "auto"
+
 # should the output sound mixer fade samples to prevent click/pop noise?
 # (it wil incur a slight performance hit)
 auto_sample_pop_prevention = False
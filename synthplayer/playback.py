@@ -80,7 +80,9 @@ class Output:
         time.sleep(0.1)     # allow the mixer thread/stream to warm up (if any)
 
     def play_sample(self, sample: Sample, repeat: bool = False, delay: float = 0.0) -> int:
-        """Play a single sample (asynchronously)."""
+        """Play a single sample (asynchronously). Floating point samples are converted to the output's sample width."""
+        if sample.is_float:
+            sample = sample.copy().make_16bit(False) if self.samplewidth == 2 else sample.copy().make_32bit()
         assert sample.samplewidth == self.samplewidth
         assert sample.samplerate == self.samplerate
         assert sample.nchannels == self.nchannels
@@ -98,7 +100,11 @@ class Output:
     def normalized_samples(self, samples: Iterable[Sample], global_amplification: int = 26000) -> Generator[Sample, None, None]:
         """Generator that produces samples normalized to 16 bit using a single amplification value for all."""
         for sample in samples:
-            if sample.samplewidth != 2:
+            if sample.is_float:
+                # the same amplification as for 32 bits samples that contain 16 bits values (see below),
+                # relative to the floating point range of -1.0 ... 1.0
+                sample = sample.amplify(global_amplification/2**16).make_16bit(False)
+            elif sample.samplewidth != 2:
                 # We can't use automatic global max amplitude because we're streaming
                 # the samples individually. So use a fixed amplification value instead
                 # that will be used to amplify all samples in stream by the same amount.
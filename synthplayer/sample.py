@@ -7,44 +7,185 @@ Written by Irmen de Jong (irmen@razorvine.net) - License: GNU LGPL 3.
 
 import sys
 import wave
-import audioop
 import array
 import math
 import itertools
-from typing import Callable, Generator, Iterable, Any, Tuple, Union, Optional, BinaryIO, Sequence, Iterator
-from . import params
-from .oscillators import Oscillator
+from typing import Callable, Generator, Iterable, Any, Tuple, Union, Optional, BinaryIO, Sequence, Iterator, Dict
+from . import params, kernels
+from .kernels import samplewidths_to_arraycode
+from .oscillators import Oscillator, BlockRenderer, Biquad, biquad_coefficients, biquad_filter_types
 try:
     import numpy
 except ImportError:
     numpy = None
 
 
-__all__ = ["Sample", "LevelMeter"]
+__all__ = ["Sample", "MixBuffer", "LevelMeter"]
 
 
-samplewidths_to_arraycode = {
-    1: 'b',
-    2: 'h',
-    4: 'l'    # or 'i' on 64 bit systems
-}
+def float_values(frames: kernels.Fragment) -> Any:
+    """The values of 32 bits floating point sample frames, as a numpy array (if available) or an array('f')."""
+    if numpy:
+        return numpy.frombuffer(frames, dtype="<f4")
+    values = array.array('f', frames)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
 
-# the actual array type code for the given sample width varies
-if array.array('i').itemsize == 4:
-    samplewidths_to_arraycode[4] = 'i'
+
+def float_frames(values: Iterable[float]) -> bytes:
+    """The 32 bits floating point sample frames for the given values."""
+    if numpy:
+        return numpy.asarray(values, dtype="<f4").tobytes()
+    values = array.array('f', values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+# numpy data types of the integer sample formats (24 bits samples can't be represented by numpy)
+numpy_sample_types = {1: numpy.int8, 2: numpy.int16, 4: numpy.int32} if numpy else {}    # type: Dict[int, Any]
+
+# the in place numpy operations on integer samples process this many frames at a time, to keep temporary arrays small
+numpy_chunk_frames = 65536
+
+
+def multiply_values(values: 'numpy.ndarray', factor: Any, truncate: bool = False) -> None:
+    """
+    Multiplies the numpy array of sample values in place by the factor (a number, or an array that broadcasts per frame).
+    Integer values are rounded down (or truncated) and clipped to their range, just like kernels.mul does.
+    """
+    if values.dtype.kind == 'f':
+        values *= factor
+        return
+    info = numpy.iinfo(values.dtype)
+    rounding = numpy.trunc if truncate else numpy.floor
+    for start in range(0, len(values), numpy_chunk_frames):
+        chunk = values[start:start+numpy_chunk_frames]
+        chunk_factor = factor if numpy.ndim(factor) == 0 else factor[start:start+numpy_chunk_frames]
+        result = rounding(numpy.multiply(chunk, chunk_factor, dtype=numpy.float64))
+        numpy.clip(result, info.min, info.max, out=result)
+        chunk[...] = result
+
+
+def add_values(values: 'numpy.ndarray', other: 'numpy.ndarray') -> None:
+    """Adds the other sample values in place to the numpy array. Integer values are clipped, just like kernels.add does."""
+    if values.dtype.kind == 'f':
+        values += other
+        return
+    info = numpy.iinfo(values.dtype)
+    wider = {1: numpy.int16, 2: numpy.int32, 4: numpy.int64}[values.itemsize]
+    for start in range(0, len(values), numpy_chunk_frames):
+        chunk = values[start:start+numpy_chunk_frames]
+        result = chunk.astype(wider)
+        result += other[start:start+numpy_chunk_frames]
+        numpy.clip(result, info.min, info.max, out=result)
+        chunk[...] = result
+
+
+# the curves of the volume changes of the fades and the envelope
+gain_curves = ("linear", "exponential")
+
+# the exponential curve changes the volume in decibels linearly, from or to this (-60 dB) instead of complete silence
+exponential_curve_floor = 0.001
+
+
+def gain_ramp(num_frames: int, start: float, end: float, curve: str = "linear") -> Any:
+    """
+    The gain for each frame of a volume change from start towards end, as a numpy array (if available) or a list.
+    A 'linear' curve changes the gain by the same amount every frame, an 'exponential' one
+    changes the volume by the same number of decibels every frame (so it sounds more even).
+    """
+    if curve not in gain_curves:
+        raise ValueError("invalid curve")
+
+    def gain(t: Any) -> Any:
+        if curve == "linear":
+            return start + (end-start) * t
+        floor = exponential_curve_floor
+        if end >= start:
+            return start + (end-start) * (floor ** (1.0-t) - floor) / (1.0-floor)
+        return end + (start-end) * (floor ** t - floor) / (1.0-floor)
+
+    if numpy:
+        return gain(numpy.arange(num_frames) / max(num_frames, 1))
+    if curve == "linear":
+        change = end-start
+        return [start + change*(i/num_frames) for i in range(num_frames)]
+    return [gain(i/num_frames) for i in range(num_frames)]
+
+
+def modulator_chunks(source: Union[Oscillator, Iterable[float]], num_values: int) -> Iterator[Any]:
+    """
+    The next values of a modulator (an oscillator, or a sequence or iterable of numbers), in chunks of
+    numpy_chunk_frames values, each a numpy array (if available) or a Python sequence.
+    An oscillator is rendered in large blocks (see BlockRenderer), chunk by chunk, so that a long sample
+    can be modulated without computing all the values at once. A ValueError is raised when the modulator
+    doesn't have enough values (for an oscillator or iterator that only happens when the chunk is reached).
+    """
+    is_sequence = isinstance(source, (list, tuple, array.array)) or (numpy and isinstance(source, numpy.ndarray))
+    if is_sequence and len(source) < num_values:    # type: ignore
+        raise ValueError("not enough modulator values")
+
+    def chunks() -> Generator[Any, None, None]:
+        renderer = BlockRenderer(source, max(source.blocksize, numpy_chunk_frames)) if isinstance(source, Oscillator) else None
+        iterator = None if renderer or is_sequence else iter(source)
+        for start in range(0, num_values, numpy_chunk_frames):
+            size = min(numpy_chunk_frames, num_values - start)
+            if renderer:
+                values = numpy.empty(size) if numpy else array.array('d', bytes(8 * size))
+                if renderer.render_into(values) < size:
+                    raise ValueError("not enough modulator values")
+                yield values
+            elif is_sequence:
+                values = source[start:start+size]   # type: ignore
+                yield numpy.asarray(values, dtype=float) if numpy else list(values)
+            else:
+                collected = list(itertools.islice(iterator, size))     # type: ignore
+                if len(collected) < size:
+                    raise ValueError("not enough modulator values")
+                yield numpy.array(collected) if numpy else collected
+
+    return chunks()
+
+
+def waveform_chunks(waveform: Any, num_values: int) -> Generator[Any, None, None]:
+    """
+    The values of the waveform scaled so that its maximum amplitude is 1.0, cycled to get num_values of them,
+    in chunks of numpy_chunk_frames values, each a numpy array (if available) or an array('d').
+    """
+    if numpy:
+        values = numpy.asarray(waveform, dtype=float)
+        values = values / max(values.max(), abs(values.min()))
+        for start in range(0, num_values, numpy_chunk_frames):
+            yield numpy.take(values, numpy.arange(start, min(start+numpy_chunk_frames, num_values)), mode="wrap")
+        return
+    biggest = max(max(waveform), abs(min(waveform)))
+    cycled = itertools.cycle([v/biggest for v in waveform])
+    for start in range(0, num_values, numpy_chunk_frames):
+        yield array.array('d', itertools.islice(cycled, min(numpy_chunk_frames, num_values - start)))
 
 
 class Sample:
     """
-    Audio sample data. Supports integer sample formats of 2, 3 and 4 bytes per sample (no floating-point).
+    Audio sample data. Supports integer sample formats of 2, 3 and 4 bytes per sample,
+    and a 32 bits floating point format (values between -1.0 and 1.0, see make_float).
+    The floating point format avoids clipping and integer conversions while mixing and processing samples;
+    it is converted to integer sample values only when written to a wav file or played on an output device.
     Most operations modify the sample data in place (if it's not locked) and return the sample object,
     so you can easily chain several operations.
+    The frames are stored as bytes, or in a numpy array with shape frames * channels (see use_numpy_storage).
+    Copies of a sample share the frames until one of them is modified (copy on write): the first modification
+    gives the sample its own (mutable) copy of the frames, and later operations modify that in place where they can.
     """
     def __init__(self, wave_file: Optional[Union[str, BinaryIO]] = None, name: str = "",
                  samplerate: int = 0, nchannels: int = 0, samplewidth: int = 0) -> None:
         """Creates a new empty sample, or loads it from a wav file."""
         self.name = name
         self.__locked = False
+        self.__float = False
+        self.__numpy_storage = bool(numpy) and params.sample_numpy_storage
+        self.__own_frames = None    # type: Optional[bytearray]
         self.__samplerate = self.__nchannels = self.__samplewidth = 0
         if params.norm_nchannels not in (1, 2):
             raise ValueError("norm_nchannels has invalid value, can only be 1 or 2")
@@ -61,37 +202,68 @@ class Sample:
             self.__samplerate = samplerate or params.norm_samplerate
             self.__nchannels = nchannels or params.norm_nchannels
             self.__samplewidth = samplewidth or params.norm_samplewidth
-            self.__frames = b""
+            self.__set_frames(b"")
             self.__filename = ""
 
     def __repr__(self) -> str:
         locked = " (locked)" if self.__locked else ""
-        return "<Sample '{6:s}' at 0x{0:x}, {1:g} seconds, {2:d} channels, {3:d} bits, rate {4:d}{5:s}>"\
-            .format(id(self), self.duration, self.__nchannels, 8*self.__samplewidth, self.__samplerate, locked, self.name)
+        float_format = " float" if self.__float else ""
+        return "<Sample '{6:s}' at 0x{0:x}, {1:g} seconds, {2:d} channels, {3:d} bits{7:s}, rate {4:d}{5:s}>"\
+            .format(id(self), self.duration, self.__nchannels, 8*self.__samplewidth, self.__samplerate, locked, self.name, float_format)
 
     def __eq__(self, other: Any) -> bool:
         if not isinstance(other, Sample):
             return False
         return self.__samplewidth == other.__samplewidth and \
+            self.__float == other.__float and \
             self.__samplerate == other.__samplerate and \
             self.__nchannels == other.__nchannels and \
-            self.__frames == other.__frames
+            self.__frame_data() == other.__frame_data()
 
     @classmethod
     def from_raw_frames(cls, frames: Union[bytes, list, memoryview], samplewidth: int, samplerate: int,
-                        numchannels: int, name: str = "") -> 'Sample':
-        """Creates a new sample directly from the raw sample data."""
+                        numchannels: int, name: str = "", is_float: bool = False) -> 'Sample':
+        """Creates a new sample directly from the raw sample data. (is_float: 32 bits floating point frames)"""
         assert 1 <= numchannels <= 2
         assert 1 <= samplewidth <= 4
         assert samplerate > 1
+        assert samplewidth == 4 or not is_float
         s = cls(name=name)
-        if isinstance(frames, (list, memoryview)):
-            s.__frames = bytes(frames)
-        else:
-            s.__frames = frames
+        s.__float = is_float
         s.__samplerate = int(samplerate)
         s.__samplewidth = int(samplewidth)
         s.__nchannels = int(numchannels)
+        if isinstance(frames, (list, memoryview)):
+            s.__set_frames(bytes(frames))
+        else:
+            s.__set_frames(frames)
+        return s
+
+    @classmethod
+    def from_numpy(cls, frames: 'numpy.ndarray', samplerate: int, name: str = "") -> 'Sample':
+        """
+        Creates a new sample with numpy storage that uses the given array of sample values, without copying it.
+        The array has shape frames * channels (or is one-dimensional for a mono sample), and data type
+        int8, int16 or int32 for integer samples, or float32 for the floating point format.
+        """
+        assert samplerate > 1
+        if not numpy:
+            raise RuntimeError("numpy is not available")
+        if frames.ndim == 1:
+            frames = frames.reshape((-1, 1))
+        if frames.ndim != 2 or not 1 <= frames.shape[1] <= 2:
+            raise ValueError("the array must have shape frames * channels, with 1 or 2 channels")
+        if frames.dtype.kind == 'f':
+            frames = frames.astype("<f4", copy=False)
+        elif frames.dtype.kind != 'i' or frames.itemsize not in numpy_sample_types:
+            raise TypeError("the sample values must be int8, int16, int32 or float32")
+        s = cls(name=name)
+        s.__numpy_storage = True
+        s.__float = frames.dtype.kind == 'f'
+        s.__samplerate = int(samplerate)
+        s.__samplewidth = frames.itemsize
+        s.__nchannels = frames.shape[1]
+        s.__set_frames(frames)
         return s
 
     @classmethod
@@ -114,13 +286,30 @@ class Sample:
         samplewidth = array_or_list.itemsize
         frames = array_or_list.tobytes()
         if sys.byteorder == "big":
-            frames = audioop.byteswap(frames, samplewidth)
+            frames = kernels.byteswap(frames, samplewidth)
         return Sample.from_raw_frames(frames, samplewidth, samplerate, numchannels, name=name)
 
     @classmethod
     def from_osc_block(cls, block: Iterable[float], samplerate: int, amplitude_scale: Optional[float] = None,
-                       samplewidth: int = params.norm_samplewidth) -> 'Sample':
+                       samplewidth: int = params.norm_samplewidth, as_float: bool = False) -> 'Sample':
+        """
+        Create a sample from a block of oscillator values. The block can be a list,
+        or a buffer such as an array('d') or numpy array (or a memoryview on those).
+        With as_float, the sample gets the floating point format and the values are taken as they are
+        (multiplied by the amplitude_scale if that's given), so no conversion to integers is done.
+        """
+        if as_float:
+            values = block if amplitude_scale is None else [v * amplitude_scale for v in block]
+            return cls.from_raw_frames(float_frames(values), 4, samplerate, 1, is_float=True)
         amplitude_scale = amplitude_scale or 2 ** (8 * samplewidth - 1)
+        if numpy:
+            values = numpy.asarray(block, dtype=numpy.float64)
+            if amplitude_scale != 1.0:
+                values = values * amplitude_scale
+            intvalues = values.astype(numpy.int64)    # truncates, just like int() does
+            if len(intvalues) and (intvalues.min() < -32768 or intvalues.max() > 32767):
+                return cls.from_raw_frames(intvalues.astype("<i4").tobytes(), 4, samplerate, 1)
+            return cls.from_raw_frames(intvalues.astype("<i2").tobytes(), 2, samplerate, 1)
         if amplitude_scale and amplitude_scale != 1.0:
             block = [amplitude_scale * v for v in block]
         intblk = list(map(int, block))
@@ -128,28 +317,38 @@ class Sample:
 
     @classmethod
     def from_oscillator(cls, osc: Oscillator, duration: float, amplitude_scale: Optional[float] = None,
-                        samplewidth: int = params.norm_samplewidth) -> 'Sample':
-        amplitude_scale = amplitude_scale or 2 ** (8 * samplewidth - 1)
+                        samplewidth: int = params.norm_samplewidth, as_float: bool = False) -> 'Sample':
+        """Create a sample from the values of the oscillator. (as_float: see from_osc_block)"""
+        if not as_float:
+            amplitude_scale = amplitude_scale or 2 ** (8 * samplewidth - 1)
         required_samples = int(duration * osc.samplerate)
-        num_blocks, last_block = divmod(required_samples, params.norm_osc_blocksize)
-        if last_block > 0:
-            num_blocks += 1
-        block_gen = osc.blocks()
-        sample = cls(None, osc.__class__.__name__, samplerate=osc.samplerate, nchannels=1, samplewidth=samplewidth)
-        if num_blocks > 0:
-            for block in block_gen:
-                num_blocks -= 1
-                if num_blocks == 0:
-                    block = block[:last_block]
-                sample.join(Sample.from_osc_block(block, osc.samplerate, amplitude_scale, samplewidth))
-                if num_blocks == 0:
-                    break
+        sample = cls(None, osc.__class__.__name__, samplerate=osc.samplerate, nchannels=1, samplewidth=4 if as_float else samplewidth)
+        sample.__float = as_float
+        # the oscillator values are rendered into a single reused buffer
+        renderer = BlockRenderer(osc, osc.blocksize)
+        buffer = memoryview(array.array('d', bytes(8 * osc.blocksize)))
+        while required_samples > 0:
+            count = renderer.render_into(buffer[:min(required_samples, len(buffer))])
+            if count == 0:
+                break
+            sample.join(Sample.from_osc_block(buffer[:count], osc.samplerate, amplitude_scale, samplewidth, as_float))
+            required_samples -= count
         return sample
 
     @property
     def samplewidth(self) -> int:
         return self.__samplewidth
 
+    @property
+    def is_float(self) -> bool:
+        """Is the sample in the 32 bits floating point format? (see make_float)"""
+        return self.__float
+
+    @property
+    def numpy_storage(self) -> bool:
+        """Are the frames stored in a numpy array? (see use_numpy_storage)"""
+        return numpy is not None and isinstance(self.__frames, numpy.ndarray)
+
     @property
     def samplerate(self) -> int:
         """You can also set this to a new value, but that will directly affect the pitch and the duration of the sample."""
@@ -170,15 +369,25 @@ class Sample:
 
     @property
     def duration(self) -> float:
-        return len(self.__frames) / self.__samplerate / self.__samplewidth / self.__nchannels
+        return self.__num_bytes() / self.__samplerate / self.__samplewidth / self.__nchannels
 
     @property
-    def maximum(self) -> int:
-        return audioop.max(self.__frames, self.samplewidth)     # type: ignore
+    def maximum(self) -> Union[int, float]:
+        if self.__float:
+            values = float_values(self.__frame_data())
+            return float(max(abs(max(values)), abs(min(values)))) if len(values) else 0.0
+        return kernels.max(self.__frame_data(), self.samplewidth)     # type: ignore
 
     @property
     def rms(self) -> float:
-        return audioop.rms(self.__frames, self.samplewidth)     # type: ignore
+        if self.__float:
+            values = float_values(self.__frame_data())
+            if not len(values):
+                return 0.0
+            if numpy:
+                return float(numpy.sqrt(numpy.mean(numpy.square(values, dtype=numpy.float64))))
+            return math.sqrt(sum(v*v for v in values) / len(values))
+        return kernels.rms(self.__frame_data(), self.samplewidth)     # type: ignore
 
     @property
     def level_db_peak(self) -> Tuple[float, float]:
@@ -196,31 +405,159 @@ class Sample:
         This method is probably only useful if processed on very short sample fragments in sequence,
         so the db levels could be used to show a level meter for the duration of the sample.
         """
+        if self.__float:
+            # measured on the sample values as they will be converted to 32 bits integers
+            channels = [self] if self.nchannels == 1 else [self.copy().left(), self.copy().right()]
+            levels = [(channel.rms if rms_mode else channel.maximum)*2**31 for channel in channels]
+            peak_left, peak_right = (levels[0]+1)/2**31, (levels[-1]+1)/2**31
+            return max(20.0*math.log(peak_left, 10), -60.0), max(20.0*math.log(peak_right, 10), -60.0)
         maxvalue = 2**(8*self.__samplewidth-1)
+        frames = self.__frame_data()
         if self.nchannels == 1:
             if rms_mode:
-                peak_left = peak_right = (audioop.rms(self.__frames, self.__samplewidth)+1)/maxvalue
+                peak_left = peak_right = (kernels.rms(frames, self.__samplewidth)+1)/maxvalue
             else:
-                peak_left = peak_right = (audioop.max(self.__frames, self.__samplewidth)+1)/maxvalue
+                peak_left = peak_right = (kernels.max(frames, self.__samplewidth)+1)/maxvalue
         else:
-            left_frames = audioop.tomono(self.__frames, self.__samplewidth, 1, 0)
-            right_frames = audioop.tomono(self.__frames, self.__samplewidth, 0, 1)
+            left_frames = kernels.tomono(frames, self.__samplewidth, 1, 0)
+            right_frames = kernels.tomono(frames, self.__samplewidth, 0, 1)
             if rms_mode:
-                peak_left = (audioop.rms(left_frames, self.__samplewidth)+1)/maxvalue
-                peak_right = (audioop.rms(right_frames, self.__samplewidth)+1)/maxvalue
+                peak_left = (kernels.rms(left_frames, self.__samplewidth)+1)/maxvalue
+                peak_right = (kernels.rms(right_frames, self.__samplewidth)+1)/maxvalue
             else:
-                peak_left = (audioop.max(left_frames, self.__samplewidth)+1)/maxvalue
-                peak_right = (audioop.max(right_frames, self.__samplewidth)+1)/maxvalue
+                peak_left = (kernels.max(left_frames, self.__samplewidth)+1)/maxvalue
+                peak_right = (kernels.max(right_frames, self.__samplewidth)+1)/maxvalue
         # cut off at the bottom at -60 instead of all the way down to -infinity
         return max(20.0*math.log(peak_left, 10), -60.0), max(20.0*math.log(peak_right, 10), -60.0)
 
     def __len__(self) -> int:
         """returns the number of sample frames (not the number of bytes!)"""
-        return len(self.__frames) // self.__samplewidth // self.__nchannels
+        return self.__num_bytes() // self.__samplewidth // self.__nchannels
 
     def view_frame_data(self) -> memoryview:
-        """return a memoryview on the raw frame data."""
-        return memoryview(self.__frames)
+        """return a memoryview on the raw frame data. (also without copying with the numpy storage)"""
+        return memoryview(self.__shared_frame_data())
+
+    def use_numpy_storage(self, enabled: bool = True) -> 'Sample':
+        """
+        Store the frames in a numpy array with shape frames * channels (or back in bytes, if not enabled).
+        Most operations then modify the array in place instead of creating new bytes for every change,
+        and clip, split, left, right and reverse only create a view on the array.
+        Copies of the sample share the array until one of them is modified.
+        24 bits samples can't be represented by numpy, they keep using bytes until they're converted.
+        New samples use the numpy storage if params.sample_numpy_storage is set.
+        """
+        if enabled and not numpy:
+            raise RuntimeError("numpy is not available")
+        frames = self.__frames
+        self.__numpy_storage = enabled
+        self.__set_frames(frames)
+        return self
+
+    def __set_frames(self, frames: Any) -> None:
+        """
+        Stores the frames (bytes or a numpy array of sample values) in the sample's storage.
+        The format of the sample (sample width, channels, float) must already be set to that of the frames.
+        With the numpy storage, bytes are wrapped in a read-only array (without copying them).
+        """
+        if self.__numpy_storage and (self.__float or self.__samplewidth in numpy_sample_types):
+            if not isinstance(frames, numpy.ndarray):
+                frames = numpy.frombuffer(frames, dtype=self.__numpy_dtype())
+                frames.flags.writeable = False
+            self.__frames = frames.reshape((-1, self.__nchannels))
+        elif numpy and isinstance(frames, numpy.ndarray):
+            self.__frames = frames.tobytes()
+        else:
+            self.__frames = frames
+
+    def __numpy_dtype(self) -> Any:
+        if self.__float:
+            return numpy.dtype("<f4")
+        if self.__samplewidth not in numpy_sample_types:
+            raise ValueError("24 bits samples can't be represented by a numpy array")
+        return numpy.dtype(numpy_sample_types[self.__samplewidth])
+
+    def __frame_data(self) -> Union[bytes, memoryview]:
+        """The raw frame bytes. With the numpy storage a memoryview on the array (if it's not contiguous, it's copied once)."""
+        if self.numpy_storage:
+            if not self.__frames.flags.c_contiguous:
+                self.__frames = numpy.ascontiguousarray(self.__frames)
+            return memoryview(self.__frames).cast('B')
+        return self.__frames
+
+    def __num_bytes(self) -> int:
+        return self.__frames.nbytes if self.numpy_storage else len(self.__frames)
+
+    def __values(self) -> 'numpy.ndarray':
+        """The sample values as a numpy array with shape frames * channels (read-only for the bytes storage), not copied."""
+        if self.numpy_storage:
+            return self.__frames
+        values = numpy.frombuffer(self.__frames, dtype=self.__numpy_dtype()).reshape((-1, self.__nchannels))
+        values.flags.writeable = False
+        return values
+
+    def __writable_values(self) -> 'numpy.ndarray':
+        """
+        The sample values as a numpy array with shape frames * channels, to modify them in place: the numpy storage
+        array or a view on the frames bytearray. They are copied first if they are shared with other samples.
+        """
+        if self.numpy_storage:
+            if not self.__frames.flags.writeable:
+                self.__frames = self.__frames.copy()
+            return self.__frames
+        return numpy.frombuffer(self.__writable_frames(), dtype=self.__numpy_dtype()).reshape((-1, self.__nchannels))
+
+    def __numpy_compatible(self) -> bool:
+        """Can the sample values be used as a numpy array? (numpy is available and they're not 24 bits values)"""
+        return bool(numpy) and (self.__float or self.__samplewidth in numpy_sample_types)
+
+    def __writable_frames(self) -> bytearray:
+        """
+        The raw frame bytes (not for the numpy storage) as a bytearray that only this sample uses, to modify it in place.
+        Shared frames are copied first, but only once: after that the sample owns the bytearray (copy on write).
+        """
+        if self.__frames is not self.__own_frames:
+            self.__frames = self.__own_frames = bytearray(self.__frames)
+        return self.__own_frames
+
+    def __extend_frames(self, frames: Any) -> None:
+        """Adds the raw frame bytes at the end of the frames (not for the numpy storage), in place if possible."""
+        own_frames = self.__writable_frames()
+        try:
+            own_frames += frames
+        except BufferError:
+            # the bytearray is still being viewed (for instance when a sample is mixed into itself), so it can't grow
+            self.__frames = self.__own_frames = own_frames + frames
+
+    def __share_frames(self) -> None:
+        """Other code gets a view on the frames, so they mustn't be modified in place anymore (the next write copies them)."""
+        if self.numpy_storage:
+            if self.__frames.flags.writeable:
+                self.__frames = self.__frames.view()
+                self.__frames.flags.writeable = False
+        else:
+            self.__own_frames = None
+
+    def __shared_frame_data(self) -> Union[bytes, memoryview]:
+        """The raw frame bytes (see __frame_data) to hand out to other code, so the sample doesn't modify them anymore."""
+        self.__frame_data()     # makes the numpy storage array contiguous first, that would replace it
+        self.__share_frames()
+        return self.__frame_data()
+
+    def __slice(self, start: int, end: Optional[int] = None) -> Any:
+        """The frames between the raw frame bytes indexes (see frame_idx). A view with the numpy storage."""
+        if self.numpy_storage:
+            framesize = self.__samplewidth * self.__nchannels
+            return self.__frames[start // framesize: None if end is None else end // framesize]
+        return self.__frames[start:end]
+
+    def __concatenate(self, *frames: Any) -> Any:
+        """The frames (of this sample's format) joined together, in the sample's storage."""
+        if self.numpy_storage:
+            return numpy.concatenate([f if isinstance(f, numpy.ndarray) else
+                                      numpy.frombuffer(f, dtype=self.__numpy_dtype()).reshape((-1, self.__nchannels))
+                                      for f in frames])
+        return b"".join(f.tobytes() if numpy and isinstance(f, numpy.ndarray) else f for f in frames)
 
     def chunked_frame_data(self, chunksize: int, repeat: bool = False,
                            stopcondition: Callable[[], bool] = lambda: False) -> Generator[memoryview, None, None]:
@@ -232,7 +569,7 @@ class Sample:
         """
         if repeat:
             # continuously repeated
-            bdata = self.__frames
+            bdata = bytes(self.__frame_data())
             if len(bdata) < chunksize:
                 bdata = bdata * int(math.ceil(chunksize / len(bdata)))
             length = len(bdata)
@@ -244,28 +581,51 @@ class Sample:
                 i = (i + chunksize) % length
         else:
             # one-shot
-            mdata = memoryview(self.__frames)
+            mdata = memoryview(self.__shared_frame_data())
             i = 0
             while i < len(mdata) and not stopcondition():
                 yield mdata[i: i + chunksize]
                 i += chunksize
 
     def get_frame_array(self) -> 'array.ArrayType[int]':
-        """Returns the sample values as array. Warning: this can copy large amounts of data."""
-        return Sample.get_array(self.samplewidth, self.__frames)
-
-    def get_frames_numpy_float(self) -> 'numpy.array':
+        """
+        Returns the sample values as array (an array('f') for the floating point format).
+        Warning: this can copy large amounts of data.
+        """
+        if self.__float:
+            float_values = array.array('f')
+            float_values.frombytes(self.__frame_data())
+            if sys.byteorder == "big":
+                float_values.byteswap()
+            return float_values   # type: ignore
+        values = Sample.get_array(self.samplewidth)
+        values.frombytes(self.__frame_data())
+        return values
+
+    def get_frames_numpy_float(self) -> 'numpy.ndarray':
         """return the sample values as a numpy float32 array (0.0 ... 1.0) with shape frames * channels.
-         (if numpy is available)"""
+         (if numpy is available) For a floating point sample this is a read-only view on the frames, not a copy."""
         if numpy:
+            if self.__float:
+                self.__share_frames()
+                values = self.__values().view()
+                values.flags.writeable = False
+                return values.astype(numpy.float32, copy=False)
             maxsize = 2**(8*self.__samplewidth-1)
-            datatype = {
-                1: numpy.int8,
-                2: numpy.int16,
-                4: numpy.int32
-            }[self.samplewidth]
-            na = numpy.frombuffer(self.__frames, dtype=datatype).reshape((-1, self.nchannels))
-            return na.astype(numpy.float32) / float(maxsize)
+            return self.__values().astype(numpy.float32) / float(maxsize)
+        else:
+            raise RuntimeError("numpy is not available")
+
+    def get_frames_numpy(self) -> 'numpy.ndarray':
+        """
+        return the sample values as a numpy array with shape frames * channels, in the sample's own data type.
+        This doesn't copy the frames: with the numpy storage it is the storage array itself, so modifying it
+        modifies the sample (make a copy of the sample first, if it might be shared). Otherwise it is read-only.
+        """
+        if numpy:
+            if not self.numpy_storage:
+                self.__share_frames()
+            return self.__values()
         else:
             raise RuntimeError("numpy is not available")
 
@@ -287,7 +647,12 @@ class Sample:
         """Overwrite the current sample with a copy of the other."""
         if self.__locked:
             raise RuntimeError("cannot modify a locked sample")
+        # the samples share the frames until one of them modifies them (and gets its own copy)
+        other.__share_frames()
+        self.__numpy_storage = other.__numpy_storage
         self.__frames = other.__frames
+        self.__own_frames = None
+        self.__float = other.__float
         self.__samplewidth = other.__samplewidth
         self.__samplerate = other.__samplerate
         self.__nchannels = other.__nchannels
@@ -313,6 +678,7 @@ class Sample:
                 raise IOError("only supports sample sizes of 2, 3 or 4 bytes")
             if not 1 <= w.getnchannels() <= 2:
                 raise IOError("only supports mono or stereo channels")
+            self.__float = False
             self.__nchannels = w.getnchannels()
             self.__samplerate = w.getframerate()
             self.__samplewidth = w.getsampwidth()
@@ -320,21 +686,26 @@ class Sample:
             if nframes*self.__nchannels*self.__samplewidth > 2**26:
                 # Requested number of frames is way to large. Probably dealing with a stream.
                 # Try to read it in chunks of 1 Mb each and hope the stream is not infinite.
-                self.__frames = bytearray()
+                frames = bytearray()
                 while True:
                     chunk = w.readframes(1024*1024)
-                    self.__frames.extend(chunk)
+                    frames.extend(chunk)
                     if not chunk:
                         break
+                self.__set_frames(frames)
             else:
-                self.__frames = w.readframes(nframes)
+                self.__set_frames(w.readframes(nframes))
             return self
 
     def write_wav(self, file_or_stream: Union[str, BinaryIO]) -> None:
-        """Write a wav file with the current sample data. You can use a filename or a stream object."""
+        """
+        Write a wav file with the current sample data. You can use a filename or a stream object.
+        Floating point samples are written as integer samples of the default sample width.
+        """
+        samplewidth = params.norm_samplewidth if self.__float else self.samplewidth
         with wave.open(file_or_stream, "wb") as out:
-            out.setparams((self.nchannels, self.samplewidth, self.samplerate, 0, "NONE", "not compressed"))
-            out.writeframes(self.__frames)
+            out.setparams((self.nchannels, samplewidth, self.samplerate, 0, "NONE", "not compressed"))
+            out.writeframes(self.__output_frames())
 
     @classmethod
     def wave_write_begin(cls, filename: str, first_sample: 'Sample') -> wave.Wave_write:
@@ -344,14 +715,14 @@ class Sample:
         """
         out = wave.open(filename, "wb")     # type: wave.Wave_write
         out.setnchannels(first_sample.nchannels)
-        out.setsampwidth(first_sample.samplewidth)
+        out.setsampwidth(params.norm_samplewidth if first_sample.is_float else first_sample.samplewidth)
         out.setframerate(first_sample.samplerate)
         return out
 
     @classmethod
     def wave_write_append(cls, out: wave.Wave_write, sample: 'Sample') -> None:
         """Part of the sample stream output api: write more sample data to an open output stream."""
-        out.writeframesraw(sample.__frames)
+        out.writeframesraw(sample.__output_frames())
 
     @classmethod
     def wave_write_end(cls, out: wave.Wave_write) -> None:
@@ -361,7 +732,58 @@ class Sample:
 
     def write_frames(self, stream: BinaryIO) -> None:
         """Write the raw sample data to the output stream."""
-        stream.write(self.__frames)
+        stream.write(self.__frame_data())
+
+    def __output_frames(self) -> kernels.Fragment:
+        """The frames to write to a file: floating point samples are converted to the default sample width."""
+        if self.__float:
+            return self.__integer_frames(params.norm_samplewidth, 2 ** (8 * params.norm_samplewidth - 1))
+        return self.__frame_data()
+
+    def __integer_frames(self, samplewidth: int, scale: float) -> bytes:
+        """The floating point frames converted to integers of the given width (clipped to fit)."""
+        maxvalue = 2 ** (8 * samplewidth - 1)
+        if numpy:
+            values = float_values(self.__frame_data()) * numpy.float64(scale)
+            numpy.clip(values, -maxvalue, maxvalue-1, out=values)
+            return values.astype({1: "i1", 2: "<i2", 4: "<i4"}[samplewidth]).tobytes()
+        values = [int(max(-maxvalue, min(maxvalue-1, v*scale))) for v in float_values(self.__frame_data())]
+        frames = Sample.get_array(samplewidth, values).tobytes()
+        if sys.byteorder == "big":
+            frames = kernels.byteswap(frames, samplewidth)
+        return frames
+
+    def make_float(self) -> 'Sample':
+        """
+        Convert to the 32 bits floating point format, where the full integer range is scaled to -1.0 ... 1.0.
+        Mixing floating point samples can't overflow, so there is no need to create headroom first,
+        and it avoids repeated conversions between integers and floats while processing the sample.
+        The sample is converted back to integers when it is written to a file or played.
+        """
+        if self.__locked:
+            raise RuntimeError("cannot modify a locked sample")
+        if self.__float:
+            return self
+        scale = 1.0/2**(8*self.samplewidth-1)
+        if numpy:
+            datatype = numpy_sample_types.get(self.samplewidth)
+            if datatype:
+                values = numpy.frombuffer(self.__frame_data(), dtype=datatype) * scale
+            else:
+                values = numpy.frombuffer(kernels.lin2lin(self.__frame_data(), self.samplewidth, 4), dtype=numpy.int32) * (scale/256)
+            frames = values.astype("<f4")
+        else:
+            frames = self.__frame_data() if self.samplewidth != 3 else kernels.lin2lin(self.__frame_data(), 3, 4)
+            scale = scale if self.samplewidth != 3 else scale/256
+            frames = float_frames([v*scale for v in Sample.get_array(4 if self.samplewidth == 3 else self.samplewidth, frames)])
+        self.__samplewidth = 4
+        self.__float = True
+        self.__set_frames(frames)
+        return self
+
+    def __require_integer_format(self) -> None:
+        if self.__float:
+            raise ValueError("this operation is not supported for floating point samples, convert them to integers first")
 
     def normalize(self) -> 'Sample':
         """
@@ -371,20 +793,17 @@ class Sample:
         if self.__locked:
             raise RuntimeError("cannot modify a locked sample")
         self.resample(params.norm_samplerate)
-        if self.samplewidth != params.norm_samplewidth:
+        if self.samplewidth != params.norm_samplewidth and not self.__float:
             # Convert to desired sample size.
-            self.__frames = audioop.lin2lin(self.__frames, self.samplewidth, params.norm_samplewidth)
+            frames = kernels.lin2lin(self.__frame_data(), self.samplewidth, params.norm_samplewidth)
             self.__samplewidth = params.norm_samplewidth
+            self.__set_frames(frames)
         if params.norm_nchannels not in (1, 2):
             raise ValueError("norm_nchannels has invalid value, can only be 1 or 2")
         if self.nchannels == 1 and params.norm_nchannels == 2:
-            # convert to stereo
-            self.__frames = audioop.tostereo(self.__frames, self.samplewidth, 1, 1)
-            self.__nchannels = 2
+            self.stereo()
         elif self.nchannels == 2 and params.norm_nchannels == 1:
-            # convert to mono
-            self.__frames = audioop.tomono(self.__frames, self.__samplewidth, 1, 1)
-            self.__nchannels = 1
+            self.mono()
         return self
 
     def resample(self, samplerate: int) -> 'Sample':
@@ -396,7 +815,8 @@ class Sample:
             raise RuntimeError("cannot modify a locked sample")
         if samplerate == self.__samplerate:
             return self
-        self.__frames = audioop.ratecv(self.__frames, self.samplewidth, self.nchannels, self.samplerate, samplerate, None)[0]
+        self.__require_integer_format()
+        self.__set_frames(kernels.ratecv(self.__frame_data(), self.samplewidth, self.nchannels, self.samplerate, samplerate, None)[0])
         self.__samplerate = samplerate
         return self
 
@@ -411,8 +831,10 @@ class Sample:
         assert speed > 0
         if speed == 1.0:
             return self
+        self.__require_integer_format()
         rate = self.samplerate
-        self.__frames = audioop.ratecv(self.__frames, self.samplewidth, self.nchannels, int(self.samplerate*speed), rate, None)[0]
+        frames = kernels.ratecv(self.__frame_data(), self.samplewidth, self.nchannels, int(self.samplerate*speed), rate, None)[0]
+        self.__set_frames(frames)
         self.__samplerate = rate
         return self
 
@@ -425,19 +847,26 @@ class Sample:
         """
         if self.__locked:
             raise RuntimeError("cannot modify a locked sample")
-        self.__frames = self.get_32bit_frames(scale_amplitude)
+        if self.samplewidth == 4 and not self.__float:
+            return self
+        frames = self.get_32bit_frames(scale_amplitude)
         self.__samplewidth = 4
+        self.__float = False
+        self.__set_frames(frames)
         return self
 
     def get_32bit_frames(self, scale_amplitude: bool = True) -> bytes:
         """Returns the raw sample frames scaled to 32 bits. See make_32bit method for more info."""
+        if self.__float:
+            return self.__integer_frames(4, 2**31 if scale_amplitude else 2**15)
         if self.samplewidth == 4:
-            return self.__frames
-        frames = audioop.lin2lin(self.__frames, self.samplewidth, 4)   # type: bytes
+            # a copy, the frames of the numpy storage are a view on the array that is modified in place
+            return bytes(self.__frame_data())
+        frames = kernels.lin2lin(self.__frame_data(), self.samplewidth, 4)   # type: bytes
         if not scale_amplitude:
             # we need to scale back the sample amplitude to fit back into 24/16/8 bit range
             factor = 1.0/2**(8*abs(self.samplewidth-4))
-            frames = audioop.mul(frames, 4, factor)
+            frames = kernels.mul(frames, 4, factor)
         return frames
 
     def make_16bit(self, maximize_amplitude: bool = True) -> 'Sample':
@@ -451,27 +880,39 @@ class Sample:
         assert self.samplewidth >= 2
         if maximize_amplitude:
             self.amplify_max()
-        if self.samplewidth > 2:
-            self.__frames = audioop.lin2lin(self.__frames, self.samplewidth, 2)
+        if self.__float:
+            frames = self.__integer_frames(2, 2**15)
+            self.__float = False
             self.__samplewidth = 2
+            self.__set_frames(frames)
+        elif self.samplewidth > 2:
+            frames = kernels.lin2lin(self.__frame_data(), self.samplewidth, 2)
+            self.__samplewidth = 2
+            self.__set_frames(frames)
         return self
 
     def amplify_max(self) -> 'Sample':
         """Amplify the sample to maximum volume without clipping or overflow happening."""
         if self.__locked:
             raise RuntimeError("cannot modify a locked sample")
-        max_amp = audioop.max(self.__frames, self.samplewidth)
-        max_target = 2 ** (8 * self.samplewidth - 1) - 2
+        max_amp = self.maximum
+        max_target = 1.0 if self.__float else 2 ** (8 * self.samplewidth - 1) - 2
         if max_amp > 0:
             factor = max_target/max_amp
-            self.__frames = audioop.mul(self.__frames, self.samplewidth, factor)
+            self.amplify(factor)
         return self
 
     def amplify(self, factor: float) -> 'Sample':
         """Amplifies (multiplies) the sample by the given factor. May cause clipping/overflow if factor is too large."""
         if self.__locked:
             raise RuntimeError("cannot modify a locked sample")
-        self.__frames = audioop.mul(self.__frames, self.samplewidth, factor)
+        if self.__numpy_compatible():
+            multiply_values(self.__writable_values(), numpy.float32(factor) if self.__float else factor)
+        elif self.__float:
+            values = float_values(self.__frames)
+            self.__frames = float_frames(values * numpy.float32(factor) if numpy else [v*factor for v in values])
+        else:
+            self.__frames = kernels.mul(self.__frames, self.samplewidth, factor)
         return self
 
     def at_volume(self, volume: float) -> 'Sample':
@@ -492,7 +933,7 @@ class Sample:
         assert end_seconds >= start_seconds
         start = self.frame_idx(start_seconds)
         end = self.frame_idx(end_seconds)
-        self.__frames = self.__frames[start:end]
+        self.__frames = self.__slice(start, end)
         return self
 
     def split(self, seconds: float) -> 'Sample':
@@ -500,12 +941,13 @@ class Sample:
         if self.__locked:
             raise RuntimeError("cannot modify a locked sample")
         end = self.frame_idx(seconds)
-        if end != len(self.__frames):
+        if end != self.__num_bytes():
+            start, end = self.__slice(0, end), self.__slice(end)
             chopped = self.copy()
-            chopped.__frames = self.__frames[end:]
-            self.__frames = self.__frames[:end]
+            chopped.__frames = end
+            self.__frames = start
             return chopped
-        return Sample.from_raw_frames(b"", self.__samplewidth, self.__samplerate, self.__nchannels)
+        return Sample.from_raw_frames(b"", self.__samplewidth, self.__samplerate, self.__nchannels, is_float=self.__float)
 
     def add_silence(self, seconds: float, at_start: bool = False) -> 'Sample':
         """Add silence at the end (or at the start)"""
@@ -513,9 +955,11 @@ class Sample:
             raise RuntimeError("cannot modify a locked sample")
         required_extra = self.frame_idx(seconds)
         if at_start:
-            self.__frames = b"\0"*required_extra + self.__frames
+            self.__frames = self.__concatenate(b"\0"*required_extra, self.__frames)
+        elif self.numpy_storage:
+            self.__frames = self.__concatenate(self.__frames, b"\0"*required_extra)
         else:
-            self.__frames += b"\0"*required_extra
+            self.__extend_frames(b"\0"*required_extra)
         return self
 
     def join(self, other: 'Sample') -> 'Sample':
@@ -523,86 +967,148 @@ class Sample:
         if self.__locked:
             raise RuntimeError("cannot modify a locked sample")
         assert self.samplewidth == other.samplewidth
+        assert self.is_float == other.is_float
         assert self.samplerate == other.samplerate
         assert self.nchannels == other.nchannels
-        self.__frames += other.__frames
+        if self.numpy_storage:
+            self.__frames = self.__concatenate(self.__frames, other.__values())
+        else:
+            self.__extend_frames(other.__frame_data())
         return self
 
-    def fadeout(self, seconds: float, target_volume: float = 0.0) -> 'Sample':
-        """Fade the end of the sample out to the target volume (usually zero) in the given time."""
+    def fadeout(self, seconds: float, target_volume: float = 0.0, curve: str = "linear") -> 'Sample':
+        """
+        Fade the end of the sample out to the target volume (usually zero) in the given time.
+        The curve of the volume change is 'linear' or 'exponential' (see gain_ramp).
+        """
         if self.__locked:
             raise RuntimeError("cannot modify a locked sample")
-        if not self.__frames:
-            return self
-        seconds = min(seconds, self.duration)
-        i = self.frame_idx(self.duration-seconds)
-        begin = self.__frames[:i]
-        end = self.__frames[i:]  # we fade this chunk
-        numsamples = len(end)/self.__samplewidth
-        decrease = 1.0-target_volume
-        _sw = self.__samplewidth     # optimization
-        _getsample = audioop.getsample   # optimization
-        faded = Sample.get_array(_sw, [int(_getsample(end, _sw, i)*(1.0-i*decrease/numsamples)) for i in range(int(numsamples))])
-        end = faded.tobytes()
-        if sys.byteorder == "big":
-            end = audioop.byteswap(end, self.__samplewidth)
-        self.__frames = begin + end
+        num_frames = len(self)
+        start = num_frames - min(int(self.__samplerate*seconds), num_frames)
+        self.__apply_gains((start, num_frames, gain_ramp(num_frames-start, 1.0, target_volume, curve)))
         return self
 
-    def fadein(self, seconds: float, start_volume: float = 0.0) -> 'Sample':
-        """Fade the start of the sample in from the starting volume (usually zero) in the given time."""
+    def fadein(self, seconds: float, start_volume: float = 0.0, curve: str = "linear") -> 'Sample':
+        """
+        Fade the start of the sample in from the starting volume (usually zero) in the given time.
+        The curve of the volume change is 'linear' or 'exponential' (see gain_ramp).
+        """
         if self.__locked:
             raise RuntimeError("cannot modify a locked sample")
-        if not self.__frames:
-            return self
-        seconds = min(seconds, self.duration)
-        i = self.frame_idx(seconds)
-        begin = self.__frames[:i]  # we fade this chunk
-        end = self.__frames[i:]
-        numsamples = len(begin)/self.__samplewidth
-        increase = 1.0-start_volume
-        _sw = self.__samplewidth     # optimization
-        _getsample = audioop.getsample   # optimization
-        _incr = increase/numsamples    # optimization
-        faded = Sample.get_array(_sw, [int(_getsample(begin, _sw, i)*(i*_incr+start_volume)) for i in range(int(numsamples))])
-        begin = faded.tobytes()
-        if sys.byteorder == "big":
-            begin = audioop.byteswap(begin, self.__samplewidth)
-        self.__frames = begin + end
+        end = min(int(self.__samplerate*seconds), len(self))
+        self.__apply_gains((0, end, gain_ramp(end, start_volume, 1.0, curve)))
         return self
 
+    def __apply_gains(self, *segments: Tuple[int, int, Any]) -> None:
+        """
+        Multiplies the sample values in each segment (start frame, end frame, gains) by the gain for each frame,
+        or by a single gain for all of them. The gains can also be a tuple with the gains for each channel.
+        Integer values are clipped, and truncated (or rounded down for a single gain, like amplify does).
+        The values are modified in place (see __writable_values).
+        """
+        segments = tuple((start, end, gains) for start, end, gains in segments
+                         if end > start and not (isinstance(gains, (int, float)) and gains == 1.0))
+        if not segments:
+            return
+        if self.__numpy_compatible():
+            values = self.__writable_values()
+            for start, end, gains in segments:
+                if isinstance(gains, tuple):
+                    factor = numpy.column_stack(gains)
+                else:
+                    factor = numpy.reshape(gains, (-1, 1)) if numpy.ndim(gains) == 1 else gains
+                multiply_values(values[start:end], factor, truncate=not self.__float and numpy.ndim(gains) > 0)
+            return
+        framesize = self.__samplewidth * self.__nchannels
+        for start, end, gains in segments:
+            region = self.__frames[start*framesize:end*framesize]
+            if isinstance(gains, tuple):
+                region = self.__ramp_frames(region, *gains)
+            elif not isinstance(gains, (int, float)):
+                region = self.__ramp_frames(region, gains)
+            elif self.__float:
+                region = float_frames([v*gains for v in float_values(region)])
+            else:
+                region = kernels.mul(region, self.__samplewidth, gains)
+            self.__writable_frames()[start*framesize:end*framesize] = region
+
+    def __ramp_frames(self, frames: kernels.Fragment, *channel_gains: Any) -> bytes:
+        """
+        The frames (not numpy compatible) multiplied by a gain for each frame, see __apply_gains.
+        There is one sequence of gains for all channels, or one for each channel.
+        """
+        nchannels = self.__nchannels
+        # 24 bits values are processed as 32 bits values, there is no Python array type for them
+        samplewidth = 4 if self.__samplewidth == 3 else self.__samplewidth
+        if self.__float:
+            values = array.array('f', float_values(frames))
+        else:
+            values = Sample.get_array(samplewidth)
+            values.frombytes(frames if samplewidth == self.__samplewidth else kernels.lin2lin(frames, 3, 4))
+            if sys.byteorder == "big":
+                values.byteswap()
+        for channel in range(nchannels):
+            channel_values = values[channel::nchannels] if nchannels > 1 else values
+            gains = channel_gains[channel] if len(channel_gains) > 1 else channel_gains[0]
+            if numpy and isinstance(gains, numpy.ndarray):
+                gains = gains.tolist()
+            if self.__float:
+                result = [v*g for v, g in zip(channel_values, gains)]
+            elif max(map(abs, gains)) <= 1.0:
+                # the values can't grow, so there's no need to clip them
+                result = [int(v*g) for v, g in zip(channel_values, gains)]
+            else:
+                minvalue, maxvalue = -2 ** (8 * samplewidth - 1), 2 ** (8 * samplewidth - 1) - 1
+                result = [max(minvalue, min(maxvalue, int(v*g))) for v, g in zip(channel_values, gains)]
+            values[channel::nchannels] = array.array(values.typecode, result)
+        if self.__float:
+            return float_frames(values)
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values.tobytes() if samplewidth == self.__samplewidth else kernels.lin2lin(values.tobytes(), 4, 3)
+
     def modulate_amp(self, modulation_source: Union[Oscillator, Sequence[float], 'Sample', Iterator[float]]) -> 'Sample':
         """
         Perform amplitude modulation by another waveform or oscillator.
         You can use a Sample (or array of sample values) or an oscillator as modulator.
         If you use a Sample (or array), it will be cycled if needed and its maximum amplitude
         is scaled to be 1.0, effectively using it as if it was an oscillator.
+        Every frame is multiplied by the next modulator value, all channels by the same value.
         """
         if self.__locked:
             raise RuntimeError("cannot modify a locked sample")
-        frames = self.get_frame_array()
-        if isinstance(modulation_source, (Sample, list, array.array)):
+        num_frames = len(self)
+        if isinstance(modulation_source, Sample):
             # modulator is a waveform, turn that into an 'oscillator' ran
-            if isinstance(modulation_source, Sample):
-                modulation_source = modulation_source.get_frame_array()
-            biggest = max(max(modulation_source), abs(min(modulation_source)))
-            actual_modulator = (v/biggest for v in itertools.cycle(modulation_source))   # type: ignore
-        elif isinstance(modulation_source, Oscillator):
-            actual_modulator = itertools.chain.from_iterable(modulation_source.blocks())    # type: ignore
+            waveform = modulation_source.get_frames_numpy().ravel() if numpy else modulation_source.get_frame_array()
+            chunks = waveform_chunks(waveform, num_frames)      # type: Iterator[Any]
+        elif isinstance(modulation_source, (list, array.array)):
+            chunks = waveform_chunks(modulation_source, num_frames)
         else:
-            actual_modulator = iter(modulation_source)  # type: ignore
-        for i in range(len(frames)):
-            frames[i] = int(frames[i] * next(actual_modulator))
-        self.__frames = frames.tobytes()
-        if sys.byteorder == "big":
-            self.__frames = audioop.byteswap(self.__frames, self.__samplewidth)
+            chunks = modulator_chunks(modulation_source, num_frames)   # type: ignore
+        # the gains are computed and applied chunk by chunk, to keep the memory use low for long samples
+        start = 0
+        for gains in chunks:
+            self.__apply_gains((start, start+len(gains), gains))
+            start += len(gains)
         return self
 
     def reverse(self) -> 'Sample':
         """Reverse the sound."""
         if self.__locked:
             raise RuntimeError("cannot modify a locked sample")
-        self.__frames = audioop.reverse(self.__frames, self.__samplewidth)
+        framesize = self.__samplewidth * self.__nchannels
+        # the frames are reversed, not the individual sample values (that would swap the stereo channels)
+        if self.numpy_storage:
+            self.__frames = self.__frames[::-1]
+        elif framesize <= 4:
+            self.__frames = kernels.reverse(self.__frames, framesize)
+        elif framesize == 8:
+            frames = array.array('q', self.__frames)
+            frames.reverse()
+            self.__frames = frames.tobytes()
+        else:
+            self.__frames = b"".join(self.__frames[i:i+framesize] for i in range(len(self.__frames)-framesize, -1, -framesize))
         return self
 
     def invert(self) -> 'Sample':
@@ -621,28 +1127,39 @@ class Sample:
             raise RuntimeError("cannot modify a locked sample")
         if seconds > 0:
             if keep_length:
-                num_frames = len(self.__frames)
+                num_frames = self.__num_bytes()
                 self.add_silence(seconds, at_start=True)
-                self.__frames = self.__frames[:num_frames]
+                self.__frames = self.__slice(0, num_frames)
                 return self
             else:
                 return self.add_silence(seconds, at_start=True)
         elif seconds < 0:
             seconds = -seconds
             if keep_length:
-                num_frames = len(self.__frames)
+                num_frames = self.__num_bytes()
                 self.add_silence(seconds)
-                self.__frames = self.__frames[len(self.__frames)-num_frames:]
+                self.__frames = self.__slice(self.__num_bytes()-num_frames)
                 return self
             else:
-                self.__frames = self.__frames[self.frame_idx(seconds):]
+                self.__frames = self.__slice(self.frame_idx(seconds))
         return self
 
     def bias(self, bias: int) -> 'Sample':
         """Add a bias constant to each sample value."""
         if self.__locked:
             raise RuntimeError("cannot modify a locked sample")
-        self.__frames = audioop.bias(self.__frames, self.__samplewidth, bias)
+        if self.__numpy_compatible():
+            values = self.__writable_values()
+            if self.__float:
+                values += numpy.float32(bias)
+            else:
+                # integer values wrap around, just like kernels.bias does
+                numpy.add(values, numpy.int64(bias), out=values, casting="unsafe")
+        elif self.__float:
+            values = float_values(self.__frames)
+            self.__frames = float_frames(values + numpy.float32(bias) if numpy else [v+bias for v in values])
+        else:
+            self.__frames = kernels.bias(self.__frames, self.__samplewidth, bias)
         return self
 
     def mono(self, left_factor: float = 1.0, right_factor: float = 1.0) -> 'Sample':
@@ -652,8 +1169,16 @@ class Sample:
         if self.__nchannels == 1:
             return self
         if self.__nchannels == 2:
-            self.__frames = audioop.tomono(self.__frames, self.__samplewidth, left_factor, right_factor)
+            if self.__float:
+                values = float_values(self.__frame_data())
+                if numpy:
+                    frames = float_frames(values[0::2] * left_factor + values[1::2] * right_factor)
+                else:
+                    frames = float_frames([left*left_factor + right*right_factor for left, right in zip(values[0::2], values[1::2])])
+            else:
+                frames = kernels.tomono(self.__frame_data(), self.__samplewidth, left_factor, right_factor)
             self.__nchannels = 1
+            self.__set_frames(frames)
             return self
         raise ValueError("sample must be stereo or mono already")
 
@@ -662,6 +1187,10 @@ class Sample:
         if self.__locked:
             raise RuntimeError("cannot modify a locked sample")
         assert self.__nchannels == 2
+        if self.numpy_storage:
+            self.__nchannels = 1
+            self.__frames = self.__frames[:, 0:1]
+            return self
         return self.mono(1.0, 0)
 
     def right(self) -> 'Sample':
@@ -669,6 +1198,10 @@ class Sample:
         if self.__locked:
             raise RuntimeError("cannot modify a locked sample")
         assert self.__nchannels == 2
+        if self.numpy_storage:
+            self.__nchannels = 1
+            self.__frames = self.__frames[:, 1:2]
+            return self
         return self.mono(0, 1.0)
 
     def stereo(self, left_factor: float = 1.0, right_factor: float = 1.0) -> 'Sample':
@@ -681,13 +1214,26 @@ class Sample:
         if self.__locked:
             raise RuntimeError("cannot modify a locked sample")
         if self.__nchannels == 2:
+            if self.__numpy_compatible():
+                values = self.__writable_values()
+                multiply_values(values[:, 0:1], left_factor)
+                multiply_values(values[:, 1:2], right_factor)
+                return self
             # first split the left and right channels and then remix them
             right = self.copy().right()
             self.left().amplify(left_factor)
             return self.stereo_mix(right, 'R', right_factor)
         if self.__nchannels == 1:
-            self.__frames = audioop.tostereo(self.__frames, self.__samplewidth, left_factor, right_factor)
+            if self.__float:
+                values = float_values(self.__frame_data())
+                if numpy:
+                    frames = float_frames(numpy.column_stack((values * left_factor, values * right_factor)).ravel())
+                else:
+                    frames = float_frames(itertools.chain.from_iterable((v*left_factor, v*right_factor) for v in values))
+            else:
+                frames = kernels.tostereo(self.__frame_data(), self.__samplewidth, left_factor, right_factor)
             self.__nchannels = 2
+            self.__set_frames(frames)
             return self
         raise ValueError("sample must be mono or stereo")
 
@@ -703,6 +1249,7 @@ class Sample:
         assert other.__nchannels == 1
         assert other.__samplerate == self.__samplerate
         assert other.__samplewidth == self.__samplewidth
+        assert other.__float == self.__float
         assert other_channel in ('L', 'R')
         if self.__nchannels == 1:
             # turn self into stereo first
@@ -727,29 +1274,20 @@ class Sample:
             raise RuntimeError("cannot modify a locked sample")
         if not lfo:
             return self.stereo((1-panning)/2, (1+panning)/2)
-        if isinstance(lfo, Oscillator):
-            lfo = itertools.chain.from_iterable(lfo.blocks())
-        else:
-            lfo = iter(lfo)
-        if self.__nchannels == 2:
-            right = self.copy().right().get_frame_array()
-            left = self.copy().left().get_frame_array()
-            stereo = self.get_frame_array()
-            for i in range(len(right)):
-                panning = next(lfo)
-                left_s = left[i]*(1-panning)/2
-                right_s = right[i]*(1+panning)/2
-                stereo[i*2] = int(left_s)
-                stereo[i*2+1] = int(right_s)
-        else:
-            mono = self.get_frame_array()
-            stereo = mono+mono
-            for i, sample in enumerate(mono):
-                panning = next(lfo)
-                stereo[i*2] = int(sample*(1-panning)/2)
-                stereo[i*2+1] = int(sample*(1+panning)/2)
-            self.__nchannels = 2
-        self.__frames = Sample.from_array(stereo, self.__samplerate, 2).__frames
+        if self.__nchannels not in (1, 2):
+            raise ValueError("sample must be mono or stereo")
+        chunks = modulator_chunks(lfo, len(self))
+        if self.__nchannels == 1:
+            self.stereo()
+        # the gains are computed and applied chunk by chunk, to keep the memory use low for long samples
+        start = 0
+        for pannings in chunks:
+            if numpy:
+                left, right = (1-pannings)/2, (1+pannings)/2
+            else:
+                left, right = [(1-p)/2 for p in pannings], [(1+p)/2 for p in pannings]
+            self.__apply_gains((start, start+len(pannings), (left, right)))
+            start += len(pannings)
         return self
 
     def echo(self, length: float, amount: int, delay: float, decay: float) -> 'Sample':
@@ -764,7 +1302,7 @@ class Sample:
         if amount > 0:
             length = max(0, self.duration - length)
             echo = self.copy()
-            echo.__frames = self.__frames[self.frame_idx(length):]
+            echo.__frames = echo.__slice(self.frame_idx(length))
             echo_amp = decay
             for _ in range(amount):
                 if echo_amp < 1.0/(2**(8*self.__samplewidth-1)):
@@ -776,24 +1314,67 @@ class Sample:
                 echo_amp *= decay
         return self
 
-    def envelope(self, attack: float, decay: float, sustainlevel: float, release: float) -> 'Sample':
-        """Apply an ADSR volume envelope. A,D,R are in seconds, Sustainlevel is a factor."""
+    def envelope(self, attack: float, decay: float, sustainlevel: float, release: float, curve: str = "linear") -> 'Sample':
+        """
+        Apply an ADSR volume envelope. A,D,R are in seconds, Sustainlevel is a factor.
+        The curve of the volume changes is 'linear' or 'exponential' (see gain_ramp).
+        """
         if self.__locked:
             raise RuntimeError("cannot modify a locked sample")
         assert attack >= 0 and decay >= 0 and release >= 0
         assert 0 <= sustainlevel <= 1
-        D = self.split(attack)   # self = A
-        S = D.split(decay)
-        if sustainlevel < 1:
-            S.amplify(sustainlevel)   # apply the sustain level to S now so that R gets it as well
-        R = S.split(S.duration - release)
-        if attack > 0:
-            self.fadein(attack)
-        if decay > 0:
-            D.fadeout(decay, sustainlevel)
-        if release > 0:
-            R.fadeout(release)
-        self.join(D).join(S).join(R)
+        num_frames = len(self)
+        a = min(int(self.__samplerate*attack), num_frames)
+        d = min(int(self.__samplerate*decay), num_frames-a)
+        r = min(int(self.__samplerate*release), num_frames-a-d)
+        self.__apply_gains((0, a, gain_ramp(a, 0.0, 1.0, curve)),
+                           (a, a+d, gain_ramp(d, 1.0, sustainlevel, curve)),
+                           (a+d, num_frames-r, sustainlevel),
+                           (num_frames-r, num_frames, gain_ramp(r, sustainlevel, 0.0, curve)))
+        return self
+
+    def biquad_filter(self, filter_type: str = "lowpass", cutoff: float = 1000.0, q: float = 0.7071, gain_db: float = 0.0) -> 'Sample':
+        """
+        Filters the sample with a biquad filter: 'lowpass', 'highpass', 'bandpass', 'notch', 'peaking', 'lowshelf'
+        or 'highshelf' (see the BiquadFilter oscillator). Integer sample values are clipped if they overflow.
+        """
+        if self.__locked:
+            raise RuntimeError("cannot modify a locked sample")
+        if filter_type not in biquad_filter_types:
+            raise ValueError("invalid filter type")
+        cutoff = min(max(cutoff, 1.0), self.__samplerate*0.49)
+        coefficients = biquad_coefficients(filter_type, cutoff, self.__samplerate, q, gain_db)
+        nchannels = self.__nchannels
+        # 24 bits values are filtered as 32 bits values, there is no numpy or Python array type for them
+        samplewidth = 4 if self.__samplewidth == 3 else self.__samplewidth
+        frames = self.__frame_data() if samplewidth == self.__samplewidth else kernels.lin2lin(self.__frame_data(), 3, 4)
+        maxvalue = 2 ** (8 * samplewidth - 1)
+        values = filtered = None    # type: Any
+        if numpy:
+            dtype = numpy.dtype("<f4" if self.__float else numpy_sample_types[samplewidth]).newbyteorder("<")
+            values = numpy.frombuffer(frames, dtype=dtype).reshape((-1, nchannels))
+            filtered = numpy.stack([Biquad().process_numpy(values[:, c], coefficients) for c in range(nchannels)], axis=1)
+            if not self.__float:
+                filtered = numpy.clip(filtered, -maxvalue, maxvalue-1)
+            frames = filtered.astype(dtype).tobytes()
+        else:
+            if self.__float:
+                values = float_values(frames)
+            else:
+                values = Sample.get_array(samplewidth)
+                values.frombytes(frames)
+                if sys.byteorder == "big":
+                    values.byteswap()
+            channels = [Biquad().process(values[c::nchannels], coefficients) for c in range(nchannels)]
+            filtered = channels[0] if nchannels == 1 else list(itertools.chain.from_iterable(zip(*channels)))
+            if self.__float:
+                frames = float_frames(filtered)
+            else:
+                values = Sample.get_array(samplewidth, [int(max(-maxvalue, min(maxvalue-1, v))) for v in filtered])
+                if sys.byteorder == "big":
+                    values.byteswap()
+                frames = values.tobytes()
+        self.__set_frames(frames if samplewidth == self.__samplewidth else kernels.lin2lin(frames, 4, 3))
         return self
 
     def mix(self, other: 'Sample', other_seconds: Optional[float] = None, pad_shortest: bool = True) -> 'Sample':
@@ -805,19 +1386,25 @@ class Sample:
         if self.__locked:
             raise RuntimeError("cannot modify a locked sample")
         assert self.samplewidth == other.samplewidth
+        assert self.is_float == other.is_float
         assert self.samplerate == other.samplerate
         assert self.nchannels == other.nchannels
-        frames1 = self.__frames
+        if self.__numpy_compatible():
+            other_values = other.__mixed_values(other_seconds)
+            if pad_shortest or len(other_values) == len(self):
+                self.__mix_in_place(0, other_values)
+                return self
+        frames1 = self.__frame_data()
         if other_seconds:
-            frames2 = other.__frames[:other.frame_idx(other_seconds)]
+            frames2 = other.__frame_data()[:other.frame_idx(other_seconds)]
         else:
-            frames2 = other.__frames
+            frames2 = other.__frame_data()
         if pad_shortest:
             if len(frames1) < len(frames2):
-                frames1 += b"\0"*(len(frames2)-len(frames1))
+                frames1 = bytes(frames1) + b"\0"*(len(frames2)-len(frames1))
             elif len(frames2) < len(frames1):
-                frames2 += b"\0"*(len(frames1)-len(frames2))
-        self.__frames = audioop.add(frames1, frames2, self.samplewidth)
+                frames2 = bytes(frames2) + b"\0"*(len(frames1)-len(frames2))
+        self.__set_frames(self.__add_frames(frames1, frames2))
         return self
 
     def mix_at(self, seconds: float, other: 'Sample', other_seconds: Optional[float] = None) -> 'Sample':
@@ -830,21 +1417,57 @@ class Sample:
         if self.__locked:
             raise RuntimeError("cannot modify a locked sample")
         assert self.samplewidth == other.samplewidth
+        assert self.is_float == other.is_float
         assert self.samplerate == other.samplerate
         assert self.nchannels == other.nchannels
         start_frame_idx = self.frame_idx(seconds)
+        if self.__numpy_compatible():
+            self.__mix_in_place(start_frame_idx // self.__samplewidth // self.__nchannels, other.__mixed_values(other_seconds))
+            return self
         if other_seconds:
-            other_frames = other.__frames[:other.frame_idx(other_seconds)]
+            other_frames = other.__frame_data()[:other.frame_idx(other_seconds)]
         else:
-            other_frames = other.__frames
-        # Mix the frames. Unfortunately audioop requires splitting and copying the sample data, which is slow.
+            other_frames = other.__frame_data()
+        # Mix the frames. Unfortunately the kernels require splitting and copying the sample data, which is slow.
         pre, to_mix, post = self._mix_split_frames(len(other_frames), start_frame_idx)
         self.__frames = b""  # allow for garbage collection
-        mixed = audioop.add(to_mix, other_frames, self.samplewidth)
+        mixed = self.__add_frames(to_mix, other_frames)
         del to_mix  # more garbage collection
         self.__frames = self._mix_join_frames(pre, mixed, post)
         return self
 
+    def __mixed_values(self, seconds: Optional[float]) -> 'numpy.ndarray':
+        """The sample values (of the first number of seconds, if given) as a numpy array, to be mixed into another sample."""
+        values = self.__values()
+        if seconds:
+            return values[:self.frame_idx(seconds) // self.__samplewidth // self.__nchannels]
+        return values
+
+    def __mix_in_place(self, start: int, values: 'numpy.ndarray') -> None:
+        """Adds the values to the sample values in place, from the given frame onwards. The sample grows if needed."""
+        end = start + len(values)
+        if end > len(self):
+            if self.numpy_storage:
+                grown = numpy.zeros((end, self.__nchannels), dtype=self.__frames.dtype)
+                grown[:len(self.__frames)] = self.__frames
+                self.__frames = grown
+            else:
+                self.__extend_frames(bytes((end - len(self)) * self.__samplewidth * self.__nchannels))
+        destination = self.__writable_values()[start:end]
+        if numpy.shares_memory(values, destination):
+            # mixing a sample into itself: the values would change while they're being added
+            values = values.copy()
+        add_values(destination, values)
+
+    def __add_frames(self, frames1: kernels.Fragment, frames2: kernels.Fragment) -> bytes:
+        if self.__float:
+            values1 = float_values(frames1)
+            values2 = float_values(frames2)
+            if numpy:
+                return float_frames(values1 + values2)
+            return float_frames([v1+v2 for v1, v2 in zip(values1, values2)])
+        return kernels.add(frames1, frames2, self.samplewidth)
+
     def _mix_join_frames(self, pre: bytes, mid: bytes, post: bytes) -> bytes:
         # warning: slow due to copying (but only significant when not streaming)
         return pre + mid + post
@@ -862,7 +1485,121 @@ class Sample:
         required_length = start_frame_idx + other_length
         if required_length > len(self.__frames):
             # we need to extend the current sample buffer to make room for the mixed sample at the end
-            self.__frames += b"\0" * (required_length - len(self.__frames))
+            self.__extend_frames(b"\0" * (required_length - len(self.__frames)))
+
+
+class MixBuffer:
+    """
+    Mixes many samples together at arbitrary positions, for instance to render a song.
+    Unlike Sample.mix_at, adding a sample only touches the frames that it overlaps, instead of
+    copying all the frames every time. The values are accumulated in a preallocated buffer that grows
+    as needed (doubling its size), as 32 bits integers (64 bits for 32 bits samples) or floats,
+    so integer values only get clipped once, when the result is converted to a sample (see to_sample).
+    """
+    def __init__(self, samplerate: int = 0, nchannels: int = 0, samplewidth: int = 0,
+                 is_float: bool = False, seconds: float = 0.0) -> None:
+        """
+        Creates a new empty mix buffer for samples in the given format (the defaults are in params).
+        Room for the given number of seconds is allocated up front.
+        """
+        self.samplerate = samplerate or params.norm_samplerate
+        self.nchannels = nchannels or params.norm_nchannels
+        self.samplewidth = samplewidth or params.norm_samplewidth
+        self.is_float = is_float
+        if is_float and self.samplewidth != 4:
+            raise ValueError("floating point samples must have samplewidth 4")
+        if self.samplewidth == 3:
+            raise ValueError("24 bits samples can't be mixed in a mix buffer")
+        self.__length = 0
+        self.__capacity = int(self.samplerate * seconds)
+        self.__values = None  # type: Any
+        if numpy:
+            dtype = numpy.float32 if is_float else numpy.int64 if self.samplewidth == 4 else numpy.int32
+            self.__values = numpy.zeros((self.__capacity, self.nchannels), dtype=dtype)
+        else:
+            arraycode = 'f' if is_float else 'q'
+            self.__values = array.array(arraycode, bytes(self.__capacity * self.nchannels * array.array(arraycode).itemsize))
+
+    def __len__(self) -> int:
+        """returns the number of sample frames mixed so far (up to the end of the last sample)"""
+        return self.__length
+
+    @property
+    def duration(self) -> float:
+        return self.__length / self.samplerate
+
+    def add_at(self, frame_offset: int, sample: Sample, gain: float = 1.0) -> 'MixBuffer':
+        """
+        Mixes the sample into the buffer, starting at the given frame. The sample must have the same format.
+        If a gain is given, the sample values are multiplied by it first (rounded down for integer samples).
+        """
+        assert self.samplewidth == sample.samplewidth
+        assert self.is_float == sample.is_float
+        assert self.samplerate == sample.samplerate
+        assert self.nchannels == sample.nchannels
+        skip = max(0, -frame_offset)
+        start = frame_offset + skip
+        end = frame_offset + len(sample)
+        if end <= start:
+            return self
+        self.__grow(end)
+        values = None  # type: Any
+        if numpy:
+            values = sample.get_frames_numpy()[skip:]
+            if gain != 1.0:
+                values = values * (numpy.float32(gain) if self.is_float else gain)
+                if not self.is_float:
+                    values = numpy.floor(values)
+            numpy.add(self.__values[start:end], values, out=self.__values[start:end], casting="unsafe")
+        else:
+            values = sample.get_frame_array()
+            acc = self.__values
+            nchannels = self.nchannels
+            if self.is_float:
+                for i, v in enumerate(values[skip * nchannels:], start * nchannels):
+                    acc[i] += v * gain
+            else:
+                for i, v in enumerate(values[skip * nchannels:], start * nchannels):
+                    acc[i] += v if gain == 1.0 else math.floor(v * gain)
+        self.__length = max(self.__length, end)
+        return self
+
+    def __grow(self, num_frames: int) -> None:
+        """Makes room for at least the given number of frames, by at least doubling the size of the buffer."""
+        if num_frames <= self.__capacity:
+            return
+        capacity = max(num_frames, 2 * self.__capacity)
+        if numpy:
+            values = numpy.zeros((capacity, self.nchannels), dtype=self.__values.dtype)
+            values[:self.__length] = self.__values[:self.__length]
+            self.__values = values
+        else:
+            self.__values.frombytes(bytes((capacity - self.__capacity) * self.nchannels * self.__values.itemsize))
+        self.__capacity = capacity
+
+    def to_sample(self, name: str = "") -> Sample:
+        """
+        Returns a new sample with the mix (the buffer itself stays as it is).
+        Integer values that got out of range are clipped.
+        """
+        values = None  # type: Any
+        if numpy:
+            values = self.__values[:self.__length]
+            if not self.is_float:
+                info = numpy.iinfo(numpy_sample_types[self.samplewidth])
+                values = numpy.clip(values, info.min, info.max).astype(info.dtype)
+            frames = values.astype(values.dtype.newbyteorder("<"), copy=False).tobytes()
+        else:
+            values = self.__values[:self.__length * self.nchannels]
+            if self.is_float:
+                frames = float_frames(values)
+            else:
+                maxvalue = 2 ** (8 * self.samplewidth - 1)
+                values = Sample.get_array(self.samplewidth, [max(-maxvalue, min(maxvalue-1, v)) for v in values])
+                if sys.byteorder == "big":
+                    values.byteswap()
+                frames = values.tobytes()
+        return Sample.from_raw_frames(frames, self.samplewidth, self.samplerate, self.nchannels, name, self.is_float)
 
 
 # noinspection PyAttributeOutsideInit
@@ -5,7 +5,6 @@ simple stream manipulations such as volume (amplitude) control.
 Written by Irmen de Jong (irmen@razorvine.net) - License: GNU LGPL 3.
 """
 
-import audioop
 import subprocess
 import shutil
 import json
@@ -20,7 +19,7 @@ from collections import namedtuple, defaultdict
 from typing import Callable, Generator, BinaryIO, Optional, Union, Iterable, Tuple, List, Dict, Iterator, Any
 from types import TracebackType
 from .sample import Sample
-from . import params
+from . import params, kernels
 try:
     import miniaudio
 except ImportError:
@@ -455,7 +454,7 @@ class StreamMixer:
                 end_callback()
 
     def add_sample(self, sample: Sample, end_callback: Optional[Callable[[], None]] = None) -> None:
-        assert sample.samplewidth == self.samplewidth
+        assert sample.samplewidth == self.samplewidth or sample.is_float    # (converted when written as wav)
         assert sample.samplerate == self.samplerate
         assert sample.nchannels == self.nchannels
         stream = io.BytesIO()
@@ -611,7 +610,7 @@ class RealTimeMixer:
             mixed = chunks_to_mix[0]
             if len(chunks_to_mix) > 1:
                 for to_mix in chunks_to_mix[1:]:
-                    mixed = audioop.add(mixed, to_mix, params.norm_nchannels)
+                    mixed = kernels.add(mixed, to_mix, params.norm_samplewidth)
                 mixed = memoryview(mixed)
             self.chunks_mixed += 1
             yield mixed
@@ -6,10 +6,12 @@ Written by Irmen de Jong (irmen@razorvine.net) - License: GNU LGPL 3.
 """
 
 import itertools
-from typing import Optional, Generator, List, Tuple
-from . import params
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Generator, List, Tuple, Dict, Any, Iterable
+from . import params, oscillators
 from .sample import Sample
 from .oscillators import *
+from .oscillators import wavetable
 
 
 __all__ = ["key_num", "key_freq", "note_freq", "octave_notes", "note_alias",
@@ -110,13 +112,19 @@ class WaveSynth:
     sine, square (perfect or with harmonics), triangle, sawtooth (perfect or with harmonics),
     variable harmonics, white noise.  It also supports an optional LFO for Frequency Modulation.
     The resulting waveform sample data is in integer 16 or 32 bits format.
+    If use_wavetables is True, the waveforms are played from shared single cycle wavetables
+    (see the Wavetable oscillator) which makes the costly waveforms such as the harmonics ones a lot faster.
+    The blocksize is the number of values in a block for the oscillators that are created
+    (and the generators), if it's not given, params.norm_osc_blocksize is used.
     """
-    def __init__(self, samplerate: int = 0, samplewidth: int = 0) -> None:
+    def __init__(self, samplerate: int = 0, samplewidth: int = 0, use_wavetables: bool = False, blocksize: int = 0) -> None:
         samplewidth = samplewidth or params.norm_samplewidth
         if samplewidth not in (2, 4):
             raise ValueError("only sample widths 2 and 4 are supported")
         self.samplerate = samplerate or params.norm_samplerate
         self.samplewidth = samplewidth
+        self.use_wavetables = use_wavetables
+        self.blocksize = blocksize
 
     def sine(self, frequency: int, duration: float, amplitude: float = 0.999, phase: float = 0.0,
              bias: float = 0.0, fm_lfo: Optional[Oscillator] = None) -> Sample:
@@ -249,14 +257,16 @@ class WaveSynth:
             block = next(wave)
             yield list(map(int, block))
 
-    def white_noise(self, frequency: int, duration: float, amplitude: float = 0.999, bias: float = 0.0) -> Sample:
-        """White noise (randomness) waveform."""
-        wave = self.__white_noise(frequency, amplitude, bias)
+    def white_noise(self, frequency: int, duration: float, amplitude: float = 0.999, bias: float = 0.0,
+                    seed: Optional[int] = None) -> Sample:
+        """White noise (randomness) waveform. Provide a seed to get reproducible noise."""
+        wave = self.__white_noise(frequency, amplitude, bias, seed)
         return Sample.from_oscillator(wave, duration, 1, self.samplewidth)
 
-    def white_noise_gen(self, frequency: int, amplitude: float = 0.999, bias: float = 0.0) -> Generator[List[int], None, None]:
-        """Generator for White noise (randomness) waveform."""
-        wave = self.__white_noise(frequency, amplitude, bias).blocks()
+    def white_noise_gen(self, frequency: int, amplitude: float = 0.999, bias: float = 0.0,
+                        seed: Optional[int] = None) -> Generator[List[int], None, None]:
+        """Generator for White noise (randomness) waveform. Provide a seed to get reproducible noise."""
+        wave = self.__white_noise(frequency, amplitude, bias, seed).blocks()
         while True:
             block = next(wave)
             yield list(map(int, block))
@@ -289,79 +299,148 @@ class WaveSynth:
             block = next(wave)
             yield list(map(int, block))
 
+    def render_batch(self, specs: Iterable[Dict[str, Any]], workers: Optional[int] = None) -> List[Sample]:
+        """
+        Renders a batch of waveform samples in parallel, in a pool of worker processes (as many as
+        there are CPU cores if workers is not given). Every spec is a dict with the 'waveform' (the name of
+        one of the sample methods such as 'sine' or 'pulse') and the keyword arguments for that method,
+        for instance: {"waveform": "sine", "frequency": 440, "duration": 1.0}. Because the specs must be
+        picklable, a fm_lfo or pwm_lfo is given as a dict as well, with the name of the 'oscillator' class and its
+        arguments: {"oscillator": "Sine", "frequency": 5, "amplitude": 0.1}. The samples are in the order of the specs.
+        """
+        specs = list(specs)
+        for spec in specs:
+            if spec.get("waveform") not in batch_waveforms:
+                raise ValueError("invalid waveform in spec: " + repr(spec.get("waveform")))
+        synth_args = (self.samplerate, self.samplewidth, self.use_wavetables, self.blocksize, params.oscillators_use_numpy)
+        if workers == 1 or len(specs) <= 1:
+            results = [_render_spec(synth_args, spec) for spec in specs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_render_spec, itertools.repeat(synth_args), specs))
+        return [Sample.from_raw_frames(frames, samplewidth, self.samplerate, 1, name=spec["waveform"])
+                for (frames, samplewidth), spec in zip(results, specs)]
+
     # note: 'linear'  is not offered as a sampled waveform directly, because this LFO it makes little sense as a sample
 
     def __sine(self, frequency: int, amplitude: float, phase: float, bias: float, fm_lfo: Optional[Oscillator]) -> Oscillator:
+        if self.use_wavetables:
+            return self.__wavetable("sine", frequency, amplitude, phase, bias, fm_lfo)
         scale = self.__check_and_get_scale(frequency, amplitude, bias)
         if fm_lfo:
-            return Sine(frequency, amplitude*scale, phase, bias*scale, fm_lfo=fm_lfo, samplerate=self.samplerate)
+            return self.__blocksized(Sine(frequency, amplitude*scale, phase, bias*scale, fm_lfo=fm_lfo, samplerate=self.samplerate))
         else:
-            return FastSine(frequency, amplitude*scale, phase, bias*scale, samplerate=self.samplerate)
+            return self.__blocksized(FastSine(frequency, amplitude*scale, phase, bias*scale, samplerate=self.samplerate))
 
     def __semicircle(self, frequency: int, amplitude: float, phase: float, bias: float, fm_lfo: Optional[Oscillator]) -> Oscillator:
+        if self.use_wavetables:
+            return self.__wavetable("semicircle", frequency, amplitude, phase, bias, fm_lfo)
         scale = self.__check_and_get_scale(frequency, amplitude, bias)
         if fm_lfo:
-            return Semicircle(frequency, amplitude*scale, phase, bias*scale, fm_lfo=fm_lfo, samplerate=self.samplerate)
+            return self.__blocksized(Semicircle(frequency, amplitude*scale, phase, bias*scale,
+                                                fm_lfo=fm_lfo, samplerate=self.samplerate))
         else:
-            return FastSemicircle(frequency, amplitude*scale, phase, bias*scale, samplerate=self.samplerate)
+            return self.__blocksized(FastSemicircle(frequency, amplitude*scale, phase, bias*scale, samplerate=self.samplerate))
 
     def __pointy(self, frequency: int, amplitude: float, phase: float, bias: float, fm_lfo: Optional[Oscillator]) -> Oscillator:
+        if self.use_wavetables:
+            return self.__wavetable("pointy", frequency, amplitude, phase, bias, fm_lfo)
         scale = self.__check_and_get_scale(frequency, amplitude, bias)
         if fm_lfo:
-            return Pointy(frequency, amplitude*scale, phase, bias*scale, fm_lfo=fm_lfo, samplerate=self.samplerate)
+            return self.__blocksized(Pointy(frequency, amplitude*scale, phase, bias*scale, fm_lfo=fm_lfo, samplerate=self.samplerate))
         else:
-            return FastPointy(frequency, amplitude*scale, phase, bias*scale, samplerate=self.samplerate)
+            return self.__blocksized(FastPointy(frequency, amplitude*scale, phase, bias*scale, samplerate=self.samplerate))
 
     def __square(self, frequency: int, amplitude: float, phase: float, bias: float, fm_lfo: Optional[Oscillator]) -> Oscillator:
+        if self.use_wavetables:
+            return self.__wavetable("square", frequency, amplitude, phase, bias, fm_lfo)
         scale = self.__check_and_get_scale(frequency, amplitude, bias)
         if fm_lfo:
-            return Square(frequency, amplitude*scale, phase, bias*scale, fm_lfo=fm_lfo, samplerate=self.samplerate)
+            return self.__blocksized(Square(frequency, amplitude*scale, phase, bias*scale, fm_lfo=fm_lfo, samplerate=self.samplerate))
         else:
-            return FastSquare(frequency, amplitude*scale, phase, bias*scale, samplerate=self.samplerate)
+            return self.__blocksized(FastSquare(frequency, amplitude*scale, phase, bias*scale, samplerate=self.samplerate))
 
     def __square_h(self, frequency: int, num_harmonics: int, amplitude: float,
                    phase: float, bias: float, fm_lfo: Optional[Oscillator]) -> Oscillator:
+        if self.use_wavetables:
+            return self.__wavetable("square_h", frequency, amplitude, phase, bias, fm_lfo, num_harmonics=num_harmonics)
         scale = self.__check_and_get_scale(frequency, amplitude, bias)
-        return SquareH(frequency, num_harmonics, amplitude*scale, phase, bias*scale, fm_lfo=fm_lfo, samplerate=self.samplerate)
+        return self.__blocksized(SquareH(frequency, num_harmonics, amplitude*scale, phase, bias*scale,
+                                         fm_lfo=fm_lfo, samplerate=self.samplerate))
 
     def __triangle(self, frequency: int, amplitude: float, phase: float, bias: float, fm_lfo: Optional[Oscillator]) -> Oscillator:
+        if self.use_wavetables:
+            return self.__wavetable("triangle", frequency, amplitude, phase, bias, fm_lfo)
         scale = self.__check_and_get_scale(frequency, amplitude, bias)
         if fm_lfo:
-            return Triangle(frequency, amplitude*scale, phase, bias*scale, fm_lfo=fm_lfo, samplerate=self.samplerate)
+            return self.__blocksized(Triangle(frequency, amplitude*scale, phase, bias*scale,
+                                              fm_lfo=fm_lfo, samplerate=self.samplerate))
         else:
-            return FastTriangle(frequency, amplitude*scale, phase, bias*scale, samplerate=self.samplerate)
+            return self.__blocksized(FastTriangle(frequency, amplitude*scale, phase, bias*scale, samplerate=self.samplerate))
 
     def __sawtooth(self, frequency: int, amplitude: float, phase: float, bias: float, fm_lfo: Optional[Oscillator]) -> Oscillator:
+        if self.use_wavetables:
+            return self.__wavetable("sawtooth", frequency, amplitude, phase, bias, fm_lfo)
         scale = self.__check_and_get_scale(frequency, amplitude, bias)
         if fm_lfo:
-            return Sawtooth(frequency, amplitude*scale, phase, bias*scale, fm_lfo=fm_lfo, samplerate=self.samplerate)
+            return self.__blocksized(Sawtooth(frequency, amplitude*scale, phase, bias*scale,
+                                              fm_lfo=fm_lfo, samplerate=self.samplerate))
         else:
-            return FastSawtooth(frequency, amplitude*scale, phase, bias*scale, samplerate=self.samplerate)
+            return self.__blocksized(FastSawtooth(frequency, amplitude*scale, phase, bias*scale, samplerate=self.samplerate))
 
     def __sawtooth_h(self, frequency: int, num_harmonics: int, amplitude: float,
                      phase: float, bias: float, fm_lfo: Optional[Oscillator]) -> Oscillator:
+        if self.use_wavetables:
+            return self.__wavetable("sawtooth_h", frequency, amplitude, phase, bias, fm_lfo, num_harmonics=num_harmonics)
         scale = self.__check_and_get_scale(frequency, amplitude, bias)
-        return SawtoothH(frequency, num_harmonics, amplitude*scale, phase, bias*scale, fm_lfo=fm_lfo, samplerate=self.samplerate)
+        return self.__blocksized(SawtoothH(frequency, num_harmonics, amplitude*scale, phase, bias*scale,
+                                           fm_lfo=fm_lfo, samplerate=self.samplerate))
 
     def __pulse(self, frequency: int, amplitude: float, phase: float, bias: float,
                 pulsewidth: float, fm_lfo: Optional[Oscillator], pwm_lfo: Optional[Oscillator]) -> Oscillator:
         assert 0 <= pulsewidth <= 1
+        if self.use_wavetables and not pwm_lfo:
+            return self.__wavetable("pulse", frequency, amplitude, phase, bias, fm_lfo, pulsewidth=pulsewidth)
         scale = self.__check_and_get_scale(frequency, amplitude, bias)
         if fm_lfo:
-            return Pulse(frequency, amplitude*scale, phase, bias*scale, pulsewidth,
-                         fm_lfo=fm_lfo, pwm_lfo=pwm_lfo, samplerate=self.samplerate)
+            return self.__blocksized(Pulse(frequency, amplitude*scale, phase, bias*scale, pulsewidth,
+                                           fm_lfo=fm_lfo, pwm_lfo=pwm_lfo, samplerate=self.samplerate))
         else:
-            return FastPulse(frequency, amplitude*scale, phase, bias*scale, pulsewidth,
-                             pwm_lfo=pwm_lfo, samplerate=self.samplerate)
+            return self.__blocksized(FastPulse(frequency, amplitude*scale, phase, bias*scale, pulsewidth,
+                                               pwm_lfo=pwm_lfo, samplerate=self.samplerate))
 
     def __harmonics(self, frequency: int, harmonics: List[Tuple[int, float]], amplitude: float,
                     phase: float, bias: float, fm_lfo: Optional[Oscillator]) -> Oscillator:
+        if self.use_wavetables:
+            return self.__wavetable("harmonics", frequency, amplitude, phase, bias, fm_lfo, harmonics=harmonics)
         scale = self.__check_and_get_scale(frequency, amplitude, bias)
-        return Harmonics(frequency, harmonics, amplitude*scale, phase, bias*scale, fm_lfo=fm_lfo, samplerate=self.samplerate)
+        return self.__blocksized(Harmonics(frequency, harmonics, amplitude*scale, phase, bias*scale,
+                                           fm_lfo=fm_lfo, samplerate=self.samplerate))
 
-    def __white_noise(self, frequency: int, amplitude: float, bias: float) -> Oscillator:
+    def __white_noise(self, frequency: int, amplitude: float, bias: float, seed: Optional[int] = None) -> Oscillator:
         scale = self.__check_and_get_scale(frequency, amplitude, bias)
-        return WhiteNoise(frequency, amplitude*scale, bias*scale, samplerate=self.samplerate)
+        return self.__blocksized(WhiteNoise(frequency, amplitude*scale, bias*scale, samplerate=self.samplerate, seed=seed))
+
+    def __wavetable(self, waveform: str, frequency: int, amplitude: float, phase: float, bias: float,
+                    fm_lfo: Optional[Oscillator], num_harmonics: int = 16, harmonics: Optional[List[Tuple[int, float]]] = None,
+                    pulsewidth: float = 0.1) -> Oscillator:
+        scale = self.__check_and_get_scale(frequency, amplitude, bias)
+        # only keep harmonics below the Nyquist frequency, like the Harmonics oscillator does
+        nyquist = self.samplerate / 2
+        if waveform == "square_h":
+            num_harmonics = len([n for n in range(1, num_harmonics*2, 2) if n*frequency <= nyquist])
+        elif waveform == "sawtooth_h":
+            num_harmonics = len([n for n in range(1, num_harmonics+1) if n*frequency <= nyquist])
+        elif waveform == "harmonics":
+            harmonics = [h for h in harmonics or [] if h[0]*frequency <= nyquist]
+        table = wavetable(waveform, pulsewidth=pulsewidth, harmonics=harmonics, num_harmonics=num_harmonics)
+        return self.__blocksized(Wavetable(frequency, table, amplitude*scale, phase, bias*scale,
+                                           fm_lfo=fm_lfo, samplerate=self.samplerate))
+
+    def __blocksized(self, osc: Oscillator) -> Oscillator:
+        if self.blocksize:
+            osc.blocksize = self.blocksize
+        return osc
 
     def __check_and_get_scale(self, freq: float, amplitude: float, bias: float) -> int:
         assert freq <= self.samplerate/2    # don't exceed the Nyquist frequency
@@ -371,6 +450,29 @@ class WaveSynth:
         return scale
 
 
+batch_waveforms = {"sine", "square", "square_h", "triangle", "sawtooth", "sawtooth_h", "pulse",
+                   "harmonics", "white_noise", "semicircle", "pointy"}
+
+
+def _render_spec(synth_args: Tuple[int, int, bool, int, bool], spec: Dict[str, Any]) -> Tuple[bytes, int]:
+    """Renders one spec of WaveSynth.render_batch (in a worker process), returns the frames and the sample width."""
+    samplerate, samplewidth, use_wavetables, blocksize, use_numpy = synth_args
+    params.oscillators_use_numpy = use_numpy
+    synth = WaveSynth(samplerate, samplewidth, use_wavetables, blocksize)
+    kwargs = dict(spec)
+    waveform = kwargs.pop("waveform")
+    for lfo_arg in ("fm_lfo", "pwm_lfo"):
+        if kwargs.get(lfo_arg):
+            lfo_args = dict(kwargs[lfo_arg])
+            lfo_name = lfo_args.pop("oscillator")
+            if lfo_name not in oscillators.__all__:
+                raise ValueError("invalid oscillator in spec: " + repr(lfo_name))
+            lfo_class = getattr(oscillators, lfo_name)
+            kwargs[lfo_arg] = lfo_class(samplerate=samplerate, **lfo_args)
+    sample = getattr(synth, waveform)(**kwargs)
+    return bytes(sample.view_frame_data()), sample.samplewidth
+
+
 def check_waveforms() -> None:
     # white noise frequency issue test
     wn = WhiteNoise(100, samplerate=1000)
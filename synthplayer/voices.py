@@ -0,0 +1,160 @@
+"""
+Polyphonic voice pool: plays a fixed number of voices (oscillator graphs) at the same time,
+mixed together into a single output.
+
+Written by Irmen de Jong (irmen@razorvine.net) - License: GNU LGPL 3.
+"""
+
+import array
+import threading
+from typing import Generator, List, Optional, Any, Hashable
+from .oscillators import Oscillator, BlockRenderer
+try:
+    import numpy
+except ImportError:
+    numpy = None        # type: ignore
+
+
+__all__ = ["Voice", "VoicePool"]
+
+
+class Voice:
+    """
+    A single voice slot in the VoicePool, with its own preallocated buffer.
+    The oscillator is kept, so the voice can be retriggered without creating a new oscillator graph.
+    """
+    def __init__(self, blocksize: int) -> None:
+        self.key = None         # type: Optional[Hashable]
+        self.oscillator = None  # type: Optional[Oscillator]
+        self.renderer = None    # type: Optional[BlockRenderer]
+        self.active = False
+        self.started = 0        # trigger sequence number, to find the oldest voice
+        self.level = 0.0        # peak level of the last block, to find the quietest voice
+        self.buffer = allocate_buffer(blocksize)
+
+    def trigger(self, key: Hashable, oscillator: Oscillator, started: int) -> None:
+        """(Re)start the voice from the beginning of the oscillator."""
+        self.key = key
+        self.oscillator = oscillator
+        self.renderer = BlockRenderer(oscillator, len(self.buffer))
+        self.active = True
+        self.started = started
+        self.level = 0.0
+
+    def release(self) -> None:
+        self.active = False
+        self.renderer = None
+
+    def render(self, size: int) -> int:
+        """Renders the next size values into the voice's buffer, returns the number of values (less at the end)."""
+        if len(self.buffer) < size:
+            self.buffer = allocate_buffer(size)
+        count = self.renderer.render_into(self.buffer[:size] if numpy else memoryview(self.buffer)[:size])   # type: ignore
+        if count:
+            values = self.buffer[:count]
+            self.level = float(numpy.abs(values).max()) if numpy else max(map(abs, values))
+        if count < size:
+            self.release()
+        return count
+
+
+def allocate_buffer(size: int) -> Any:
+    if numpy:
+        return numpy.zeros(size)
+    return array.array('d', bytes(8 * size))
+
+
+class VoicePool(Oscillator):
+    """
+    Plays up to num_voices oscillators (voices) at the same time, mixed together into one output.
+    The voices are mixed as floating point values, the output is like any other oscillator.
+    A note is started with note_on(key, oscillator), where the key is anything that identifies the note.
+    Starting a note that is still playing, retriggers that voice. Calling note_on without an oscillator
+    retriggers the voice with the oscillator that was last played for that key.
+    When all voices are playing, the 'oldest' or 'quietest' voice is stolen (see the steal parameter).
+    Voices are freed when their oscillator ends, or when note_off is called.
+    The pool itself never ends: when no voices are playing it produces silence.
+    """
+    def __init__(self, num_voices: int, samplerate: int = 0, steal: str = "oldest") -> None:
+        assert num_voices > 0
+        if steal not in ("oldest", "quietest"):
+            raise ValueError("steal must be 'oldest' or 'quietest'")
+        super().__init__(samplerate)
+        self.steal = steal
+        self.voices = [Voice(self.blocksize) for _ in range(num_voices)]
+        self._trigger_count = 0
+        self._lock = threading.Lock()
+
+    def note_on(self, key: Hashable, oscillator: Optional[Oscillator] = None) -> Voice:
+        """Starts (or retriggers) the note. Returns the voice that plays it."""
+        with self._lock:
+            voice = self.find_voice(key)
+            if oscillator is None:
+                if voice is None or voice.oscillator is None:
+                    raise ValueError("no oscillator given and the note was not played before")
+                oscillator = voice.oscillator
+            if voice is None:
+                voice = self.free_voice()
+            if oscillator.samplerate != self.samplerate:
+                raise ValueError("oscillator samplerate differs from the voice pool samplerate")
+            oscillator.blocksize = self.blocksize
+            self._trigger_count += 1
+            voice.trigger(key, oscillator, self._trigger_count)
+            return voice
+
+    def note_off(self, key: Hashable) -> None:
+        """Stops the note (if it is still playing)."""
+        with self._lock:
+            for voice in self.voices:
+                if voice.active and voice.key == key:
+                    voice.release()
+
+    def all_notes_off(self) -> None:
+        with self._lock:
+            for voice in self.voices:
+                voice.release()
+
+    def active_voices(self) -> List[Voice]:
+        return [voice for voice in self.voices if voice.active]
+
+    def find_voice(self, key: Hashable) -> Optional[Voice]:
+        """The voice that plays (or last played) the given key, if it has not been reused since."""
+        for voice in self.voices:
+            if voice.key == key and voice.oscillator is not None:
+                return voice
+        return None
+
+    def free_voice(self) -> Voice:
+        """Returns a voice that isn't playing, or steals one if they're all busy."""
+        free = [voice for voice in self.voices if not voice.active]
+        if free:
+            # prefer the voice that has been unused the longest
+            return min(free, key=lambda v: v.started)
+        if self.steal == "quietest":
+            return min(self.voices, key=lambda v: (v.level, v.started))
+        return min(self.voices, key=lambda v: v.started)
+
+    def render_into(self, buffer: Any) -> int:
+        """Mixes the next values of all active voices into the buffer. Always fills the whole buffer."""
+        size = len(buffer)
+        if numpy is not None and not isinstance(buffer, numpy.ndarray):
+            buffer = numpy.frombuffer(buffer, dtype=numpy.float64)
+        with self._lock:
+            if numpy is not None:
+                buffer.fill(0.0)
+                for voice in self.active_voices():
+                    count = voice.render(size)
+                    buffer[:count] += voice.buffer[:count]
+            else:
+                mix = [0.0] * size
+                for voice in self.active_voices():
+                    count = voice.render(size)
+                    mix[:count] = [m+v for m, v in zip(mix, voice.buffer[:count])]
+                buffer[:] = array.array('d', mix)
+        return size
+
+    def blocks(self) -> Generator[List[float], None, None]:
+        buffer = allocate_buffer(self.blocksize)
+        while True:
+            self.render_into(buffer)
+            yield buffer.tolist()